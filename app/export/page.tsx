@@ -1,7 +1,8 @@
 "use client"
 
-import { useState } from "react"
+import { useEffect, useState } from "react"
 import { useRouter } from "next/navigation"
+import { apiClient } from "@/lib/api"
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card"
 import { Button } from "@/components/ui/button"
 import { Label } from "@/components/ui/label"
@@ -39,6 +40,23 @@ export default function ExportPage() {
     incluirAlertas: false,
     incluirEstadisticas: false,
   })
+  const [stations, setStations] = useState<{ id: string; name: string; location: string }[] | null>(null)
+
+  useEffect(() => {
+    apiClient
+      .getSensors()
+      .then((response: any) => {
+        const sensors = Array.isArray(response) ? response : response.results
+        setStations(
+          sensors.map((sensor: any) => ({
+            id: sensor.id,
+            name: sensor.name,
+            location: `${sensor.river_name} · ${sensor.sensor_code}`,
+          })),
+        )
+      })
+      .catch(() => setStations(null))
+  }, [])
 
   const handleBack = () => {
     router.push("/dashboard")
@@ -53,16 +71,31 @@ export default function ExportPage() {
 
     setIsExporting(true)
 
-    // Simular exportación
-    setTimeout(() => {
-      setIsExporting(false)
+    // El servidor genera el archivo por partes; la fecha de término se incluye completa
+    const end = new Date(endDate)
+    end.setDate(end.getDate() + 1)
+    try {
+      const blob = await apiClient.exportReadings(
+        exportData.estaciones,
+        startDate.toISOString(),
+        end.toISOString(),
+        exportData.formato as "csv" | "ndjson" | "parquet",
+      )
+      const filename = `rio_claro_${format(startDate, "yyyy-MM-dd")}_${format(endDate, "yyyy-MM-dd")}.${exportData.formato}`
+      const url = URL.createObjectURL(blob)
+      const link = document.createElement("a")
+      link.href = url
+      link.download = filename
+      link.click()
+      URL.revokeObjectURL(url)
       setShowSuccess(true)
       setTimeout(() => setShowSuccess(false), 3000)
-
-      // Simular descarga
-      const filename = `rio_claro_${format(startDate, "yyyy-MM-dd")}_${format(endDate, "yyyy-MM-dd")}.${exportData.formato}`
-      alert(`Descargando archivo: ${filename}`)
-    }, 2000)
+    } catch {
+      setShowError(true)
+      setTimeout(() => setShowError(false), 3000)
+    } finally {
+      setIsExporting(false)
+    }
   }
 
   const handleStationChange = (stationId: string, checked: boolean) => {
@@ -93,7 +126,8 @@ export default function ExportPage() {
     }
   }
 
-  const availableStations = [
+  // Estaciones de ejemplo sin conexión con el servidor
+  const exampleStations = [
     { id: "RC001", name: "Río Claro - Nacimiento", location: "Volcán Villarrica" },
     { id: "RC002", name: "Río Claro - Sector Alto", location: "Cordillera" },
     { id: "RC003", name: "Río Claro - Puente Pucón", location: "Centro Pucón" },
@@ -206,20 +240,20 @@ export default function ExportPage() {
                       CSV
                     </Button>
                     <Button
-                      variant={exportData.formato === "xlsx" ? "default" : "outline"}
-                      onClick={() => setExportData({ ...exportData, formato: "xlsx" })}
+                      variant={exportData.formato === "parquet" ? "default" : "outline"}
+                      onClick={() => setExportData({ ...exportData, formato: "parquet" })}
                       className="flex items-center gap-2 text-sm"
                     >
                       <FileSpreadsheet className="w-4 h-4" />
-                      Excel
+                      Parquet
                     </Button>
                     <Button
-                      variant={exportData.formato === "pdf" ? "default" : "outline"}
-                      onClick={() => setExportData({ ...exportData, formato: "pdf" })}
+                      variant={exportData.formato === "ndjson" ? "default" : "outline"}
+                      onClick={() => setExportData({ ...exportData, formato: "ndjson" })}
                       className="flex items-center gap-2 text-sm"
                     >
                       <FileText className="w-4 h-4" />
-                      PDF
+                      NDJSON
                     </Button>
                   </div>
                 </div>
@@ -269,7 +303,7 @@ export default function ExportPage() {
                 <div className="space-y-2">
                   <Label className="text-sm font-medium">Estaciones a Exportar *</Label>
                   <div className="grid grid-cols-1 sm:grid-cols-2 gap-2">
-                    {availableStations.map((station) => (
+                    {(stations ?? exampleStations).map((station) => (
                       <div key={station.id} className="flex items-center space-x-2 p-2 border rounded text-sm">
                         <Checkbox
                           id={station.id}
@@ -1,16 +1,81 @@
 "use client"
 
-import { useState } from "react"
+import { useEffect, useRef, useState } from "react"
 import { useRouter } from "next/navigation"
+import { apiClient, type RiverSummary, type SensorSeries } from "@/lib/api"
+import { useLiveStream } from "@/hooks/use-api"
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card"
 import { Button } from "@/components/ui/button"
 import { Badge } from "@/components/ui/badge"
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "@/components/ui/select"
 import { ArrowLeft, MapPin, Droplets, Thermometer, Activity, Zap } from "lucide-react"
 
+interface MapSensor {
+  id: string
+  name: string
+  level: number
+  status: string
+  temp: number | string
+  flow: number | string
+  x: number
+  y: number
+  description: string
+  updatedAt: string | null
+}
+
 export default function MapPage() {
   const router = useRouter()
   const [selectedSensor, setSelectedSensor] = useState("RC001")
+  const [rivers, setRivers] = useState<RiverSummary[] | null>(null)
+  const [series, setSeries] = useState<SensorSeries | null>(null)
+
+  const refresh = useRef<ReturnType<typeof setTimeout> | undefined>(undefined)
+
+  // Todo el mapa se dibuja con una sola petición al resumen por río
+  useEffect(() => {
+    apiClient
+      .getRiverSummary()
+      .then((summary) => {
+        setRivers(summary)
+        const first = summary.find((river) => river.sensors.length > 0)?.sensors[0]
+        if (first) setSelectedSensor(first.id)
+      })
+      .catch(() => setRivers(null))
+    return () => clearTimeout(refresh.current)
+  }, [])
+
+  // Las lecturas llegan por la conexión en vivo; los estados por río se
+  // recalculan con un solo resumen por ráfaga de eventos, sin sondeo
+  const { connected } = useLiveStream({}, (type, event) => {
+    if (type === "reading") {
+      setRivers((current) =>
+        current?.map((river) =>
+          river.id !== event.river
+            ? river
+            : {
+                ...river,
+                sensors: river.sensors.map((sensor) =>
+                  sensor.id !== event.sensor
+                    ? sensor
+                    : {
+                        ...sensor,
+                        level_percentage: event.data.level_percentage,
+                        temperature: event.data.temperature,
+                        flow_rate: event.data.flow_rate,
+                        timestamp: event.data.timestamp,
+                      },
+                ),
+              },
+        ) ?? null,
+      )
+    }
+    if (type === "reading" || type === "alert") {
+      clearTimeout(refresh.current)
+      refresh.current = setTimeout(() => {
+        apiClient.getRiverSummary().then(setRivers).catch(() => undefined)
+      }, 2000)
+    }
+  })
 
   const handleBack = () => {
     router.push("/dashboard")
@@ -110,7 +175,68 @@ export default function MapPage() {
     ],
   }
 
-  const selectedSensorData = rioClaro.sensors.find((s) => s.id === selectedSensor)
+  // Sensores del resumen ubicados en el mapa según sus coordenadas; datos de ejemplo sin conexión
+  const liveSensors = (rivers ?? []).flatMap((river) =>
+    river.sensors.map((sensor) => ({ ...sensor, riverName: river.name })),
+  )
+  const latitudes = liveSensors.map((sensor) => sensor.latitude)
+  const longitudes = liveSensors.map((sensor) => sensor.longitude)
+  const project = (value: number, values: number[], invert: boolean) => {
+    const min = Math.min(...values)
+    const max = Math.max(...values)
+    const position = max > min ? (value - min) / (max - min) : 0.5
+    return Math.round(10 + 80 * (invert ? 1 - position : position))
+  }
+  const mapSensors: MapSensor[] =
+    liveSensors.length > 0
+      ? liveSensors.map((sensor) => ({
+          id: sensor.id,
+          name: sensor.name,
+          level: sensor.level_percentage,
+          status: sensor.level_status,
+          temp: sensor.temperature ?? "-",
+          flow: sensor.flow_rate ?? "-",
+          x: project(sensor.longitude, longitudes, false),
+          y: project(sensor.latitude, latitudes, true),
+          description: `${sensor.riverName} · ${sensor.sensor_code}`,
+          updatedAt: sensor.timestamp,
+        }))
+      : rioClaro.sensors.map((sensor) => ({ ...sensor, updatedAt: null }))
+
+  const selectedSensorData = mapSensors.find((s) => s.id === selectedSensor)
+  const selectedIsLive = liveSensors.some((sensor) => sensor.id === selectedSensor)
+
+  // Nivel de las últimas 24 horas, reducido en el servidor a los puntos del gráfico
+  useEffect(() => {
+    setSeries(null)
+    if (!selectedIsLive) return
+    let cancelled = false
+    apiClient
+      .getSensorSeries(selectedSensor, { points: 150 })
+      .then((result) => {
+        if (!cancelled) setSeries(result)
+      })
+      .catch(() => undefined)
+    return () => {
+      cancelled = true
+    }
+  }, [selectedSensor, selectedIsLive])
+
+  const seriesValues = (series?.points ?? []).filter((point) => point.value !== null)
+  const seriesLine = (() => {
+    if (seriesValues.length < 2) return null
+    const times = seriesValues.map((point) => new Date(point.timestamp).getTime())
+    const values = seriesValues.map((point) => point.value as number)
+    const [minTime, maxTime] = [times[0], times[times.length - 1]]
+    const [minValue, maxValue] = [Math.min(...values), Math.max(...values)]
+    return times
+      .map((time, index) => {
+        const x = maxTime > minTime ? ((time - minTime) / (maxTime - minTime)) * 300 : 0
+        const y = maxValue > minValue ? 75 - ((values[index] - minValue) / (maxValue - minValue)) * 70 : 40
+        return `${x.toFixed(1)},${y.toFixed(1)}`
+      })
+      .join(" ")
+  })()
 
   const getStatusColor = (status: string) => {
     switch (status) {
@@ -131,6 +257,8 @@ export default function MapPage() {
         return "CRÍTICO"
       case "warning":
         return "ALERTA"
+      case "info":
+        return "INFORMATIVO"
       case "normal":
         return "NORMAL"
       default:
@@ -154,12 +282,15 @@ export default function MapPage() {
             </div>
           </div>
           <div className="flex items-center gap-2 sm:gap-4">
+            <Badge variant="outline" className={connected ? "text-green-600" : "text-gray-500"}>
+              {connected ? "En vivo" : "Sin conexión"}
+            </Badge>
             <Select value={selectedSensor} onValueChange={setSelectedSensor}>
               <SelectTrigger className="w-40 sm:w-48 text-sm">
                 <SelectValue />
               </SelectTrigger>
               <SelectContent>
-                {rioClaro.sensors.map((sensor) => (
+                {mapSensors.map((sensor) => (
                   <SelectItem key={sensor.id} value={sensor.id}>
                     {sensor.name}
                   </SelectItem>
@@ -195,7 +326,7 @@ export default function MapPage() {
                 </svg>
 
                 {/* Sensores */}
-                {rioClaro.sensors.map((sensor) => (
+                {mapSensors.map((sensor) => (
                   <div
                     key={sensor.id}
                     className={`absolute w-4 h-4 rounded-full cursor-pointer transform -translate-x-2 -translate-y-2 ${getStatusColor(
@@ -305,9 +436,23 @@ export default function MapPage() {
                     </div>
                   </div>
 
+                  {seriesLine && (
+                    <div className="pt-4 border-t">
+                      <p className="text-xs text-gray-500 mb-2">Nivel del agua - últimas 24 horas</p>
+                      <svg className="w-full h-20" viewBox="0 0 300 80" preserveAspectRatio="none">
+                        <polyline fill="none" stroke="#3B82F6" strokeWidth="2" points={seriesLine} />
+                      </svg>
+                    </div>
+                  )}
+
                   <div className="pt-4 border-t">
                     <p className="text-xs text-gray-500 mb-2">ID del Sensor: {selectedSensorData.id}</p>
-                    <p className="text-xs text-gray-500">Última actualización: hace 2 minutos</p>
+                    <p className="text-xs text-gray-500">
+                      Última actualización:{" "}
+                      {selectedSensorData.updatedAt
+                        ? new Date(selectedSensorData.updatedAt).toLocaleString("es-CL")
+                        : "hace 2 minutos"}
+                    </p>
                   </div>
                 </div>
               )}
@@ -315,6 +460,49 @@ export default function MapPage() {
           </Card>
         </div>
 
+        {/* Resumen por Río */}
+        {rivers && rivers.length > 0 && (
+          <Card className="mt-6">
+            <CardHeader>
+              <CardTitle>Resumen por Río</CardTitle>
+              <CardDescription>Nivel, caudal y estado de alerta de cada río</CardDescription>
+            </CardHeader>
+            <CardContent>
+              <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-3 sm:gap-4">
+                {rivers.map((river) => (
+                  <div key={river.id} className="p-4 border rounded-lg">
+                    <div className="flex items-center justify-between mb-2">
+                      <h4 className="font-medium text-sm">{river.name}</h4>
+                      <Badge
+                        variant={
+                          river.alert_status === "critical"
+                            ? "destructive"
+                            : river.alert_status === "warning"
+                              ? "secondary"
+                              : "default"
+                        }
+                        className="text-xs"
+                      >
+                        {getStatusText(river.alert_status)}
+                      </Badge>
+                    </div>
+                    <div className="text-xs text-gray-500 space-y-1">
+                      <p>
+                        Sensores: {river.active_sensors}/{river.sensor_count} activos
+                      </p>
+                      <p>
+                        Nivel: máx {river.max_level_percentage ?? "-"}% · prom {river.mean_level_percentage ?? "-"}%
+                      </p>
+                      <p>Caudal total: {river.total_flow} m³/s</p>
+                      <p>Alertas activas: {river.active_alerts}</p>
+                    </div>
+                  </div>
+                ))}
+              </div>
+            </CardContent>
+          </Card>
+        )}
+
         {/* Resumen de Todos los Sensores */}
         <Card className="mt-6">
           <CardHeader>
@@ -323,7 +511,7 @@ export default function MapPage() {
           </CardHeader>
           <CardContent>
             <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4 gap-3 sm:gap-4">
-              {rioClaro.sensors.map((sensor) => (
+              {mapSensors.map((sensor) => (
                 <div
                   key={sensor.id}
                   className={`p-4 border rounded-lg cursor-pointer transition-all hover:shadow-md ${
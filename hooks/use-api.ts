@@ -1,6 +1,6 @@
 "use client"
 
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import { apiClient } from "@/lib/api"
 
 export function useApi<T>(apiCall: () => Promise<T>, dependencies: any[] = []) {
@@ -56,3 +56,42 @@ export function useActiveAlerts() {
 export function useAlertsSummary() {
   return useApi(() => apiClient.getAlertsSummary())
 }
+
+export function useLiveStream(
+  filters: { rivers?: number[]; sensors?: string[] },
+  onEvent: (type: string, payload: any) => void,
+) {
+  const [connected, setConnected] = useState(false)
+  const [error, setError] = useState<string | null>(null)
+  // Latest handler, so re-renders do not reconnect
+  const handler = useRef(onEvent)
+  handler.current = onEvent
+
+  useEffect(() => {
+    const controller = new AbortController()
+    let retry: ReturnType<typeof setTimeout>
+
+    const connect = async () => {
+      try {
+        setConnected(true)
+        setError(null)
+        await apiClient.streamLive(filters, (type, payload) => handler.current(type, payload), controller.signal)
+      } catch (err) {
+        if (controller.signal.aborted) return
+        setError(err instanceof Error ? err.message : "An error occurred")
+      } finally {
+        setConnected(false)
+      }
+      if (!controller.signal.aborted) retry = setTimeout(connect, 5000)
+    }
+
+    connect()
+
+    return () => {
+      controller.abort()
+      clearTimeout(retry)
+    }
+  }, [JSON.stringify(filters)])
+
+  return { connected, error }
+}
@@ -1,5 +1,54 @@
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000/api"
 
+export type LevelStatus = "normal" | "warning" | "critical"
+
+// Worst severity of a river's active alerts, "normal" without any
+export type AlertStatus = LevelStatus | "info"
+
+export interface RiverSummarySensor {
+  id: string
+  name: string
+  sensor_code: string
+  latitude: number
+  longitude: number
+  status: string
+  level_percentage: number
+  level_status: LevelStatus
+  temperature: number | null
+  flow_rate: number | null
+  timestamp: string | null
+}
+
+export interface RiverSummary {
+  id: number
+  name: string
+  latitude: number
+  longitude: number
+  sensor_count: number
+  active_sensors: number
+  critical_count: number
+  warning_count: number
+  normal_count: number
+  level_status: LevelStatus
+  alert_status: AlertStatus
+  active_alerts: number
+  max_level_percentage: number | null
+  mean_level_percentage: number | null
+  total_flow: number
+  last_reading: string | null
+  sensors: RiverSummarySensor[]
+}
+
+export interface SensorSeries {
+  sensor: string
+  metric: string
+  method: "lttb" | "minmax"
+  start: string
+  end: string
+  raw_count: number
+  points: { timestamp: string; value: number | null }[]
+}
+
 class ApiClient {
   private baseURL: string
   private token: string | null = null
@@ -102,6 +151,11 @@ class ApiClient {
     }
   }
 
+  // Rivers API
+  async getRiverSummary() {
+    return this.request<RiverSummary[]>("/sensors/rivers/summary/")
+  }
+
   // Sensors API
   async getSensors() {
     return this.request("/sensors/sensors/")
@@ -115,10 +169,32 @@ class ApiClient {
     return this.request(`/sensors/sensors/${sensorId}/readings/?hours=${hours}`)
   }
 
+  async getSensorSeries(sensorId: string, params: { start?: string; end?: string; points?: number; metric?: string; method?: "lttb" | "minmax" } = {}) {
+    const query = new URLSearchParams(
+      Object.entries(params).filter(([, value]) => value !== undefined).map(([key, value]) => [key, String(value)]),
+    )
+    return this.request<SensorSeries>(`/sensors/sensors/${sensorId}/series/?${query}`)
+  }
+
   async getSensorStatistics(sensorId: string, days = 7) {
     return this.request(`/sensors/sensors/${sensorId}/statistics/?days=${days}`)
   }
 
+  async exportReadings(sensorIds: string[], start: string, end: string, fileFormat: "csv" | "ndjson" | "parquet" = "csv") {
+    const query = new URLSearchParams({ sensors: sensorIds.join(","), start, end, file_format: fileFormat })
+    const response = await fetch(`${this.baseURL}/sensors/readings/export/?${query}`, {
+      headers: {
+        Authorization: `Bearer ${this.token}`,
+      },
+    })
+
+    if (!response.ok) {
+      throw new Error("Export failed")
+    }
+
+    return response.blob()
+  }
+
   async getDashboardSummary() {
     return this.request("/sensors/sensors/dashboard_summary/")
   }
@@ -127,6 +203,44 @@ class ApiClient {
     return this.request("/sensors/readings/latest/")
   }
 
+  // Live updates (Server-Sent Events over fetch, so the JWT header can be sent)
+  async streamLive(
+    filters: { rivers?: number[]; sensors?: string[] },
+    onEvent: (type: string, payload: any) => void,
+    signal?: AbortSignal,
+  ) {
+    const query = new URLSearchParams()
+    if (filters.rivers?.length) query.set("rivers", filters.rivers.join(","))
+    if (filters.sensors?.length) query.set("sensors", filters.sensors.join(","))
+
+    const response = await fetch(`${this.baseURL}/sensors/stream/?${query}`, {
+      headers: {
+        Accept: "text/event-stream",
+        Authorization: `Bearer ${this.token}`,
+      },
+      signal,
+    })
+
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP error! status: ${response.status}`)
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+    let buffer = ""
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += value
+      const messages = buffer.split("\n\n")
+      buffer = messages.pop() ?? ""
+      for (const message of messages) {
+        const type = message.match(/^event: (.*)$/m)?.[1]
+        const data = message.match(/^data: (.*)$/m)?.[1]
+        if (type && data) onEvent(type, JSON.parse(data))
+      }
+    }
+  }
+
   // Alerts API
   async getAlerts() {
     return this.request("/alerts/alerts/")
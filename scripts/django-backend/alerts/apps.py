@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+class AlertsConfig(AppConfig):
+    name = 'alerts'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .consumer import evaluation_mode
+
+        # Fail at startup rather than on the first ingest
+        evaluation_mode()
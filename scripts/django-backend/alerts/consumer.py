@@ -0,0 +1,192 @@
+"""
+Alert evaluation off the ingest request path.
+
+ALERT_EVALUATION_MODE selects how new readings are checked against the
+alert rules:
+
+- 'sync': evaluated inside the ingest request (default).
+- 'worker': queued to an in-process background thread that evaluates them
+  in micro-batches. Pending readings are lost if the process exits.
+- 'celery': sent to the evaluate_readings Celery task by id.
+
+In the asynchronous modes the device gets its response as soon as the
+readings are stored.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_MODES = ('sync', 'worker', 'celery')
+
+CELERY_STATS_CACHE_PREFIX = 'alerts:evaluation:celery:'
+CELERY_COUNTERS = ('processed_total', 'batches_total')
+CELERY_GAUGES = ('last_lag_seconds', 'last_batch_seconds')
+
+class AlertEvaluationWorker:
+    """Background thread evaluating queued readings in micro-batches grouped by sensor"""
+
+    def __init__(self, batch_size=None, max_wait=None):
+        self.batch_size = batch_size or settings.ALERT_EVALUATION_BATCH_SIZE
+        self.max_wait = max_wait or settings.ALERT_EVALUATION_MAX_WAIT
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.pending = 0
+        self.processed_total = 0
+        self.batches_total = 0
+        self.errors_total = 0
+        self.last_lag_seconds = 0.0
+        self.last_batch_seconds = 0.0
+        # (finished_at, readings) of recent batches, for throughput
+        self._recent = deque(maxlen=100)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='alert-evaluation', daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, readings):
+        if not readings:
+            return
+        self.start()
+        with self._lock:
+            self.pending += len(readings)
+        self.queue.put((time.monotonic(), readings))
+
+    def _next_batch(self):
+        """Block for the first item, then collect more until the batch is full or max_wait passes"""
+        enqueued_at, readings = self.queue.get()
+        oldest = enqueued_at
+        batch = list(readings)
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                enqueued_at, readings = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            oldest = min(oldest, enqueued_at)
+            batch.extend(readings)
+        return oldest, batch
+
+    def _run(self):
+        from .utils import check_and_create_alerts
+
+        while True:
+            oldest, batch = self._next_batch()
+            started = time.monotonic()
+            close_old_connections()
+            try:
+                batch.sort(key=lambda reading: (str(reading.sensor_id), reading.timestamp))
+                check_and_create_alerts(batch)
+                failed = False
+            except Exception:
+                logger.exception('Alert evaluation failed for a batch of %d readings', len(batch))
+                failed = True
+            finally:
+                close_old_connections()
+
+            finished = time.monotonic()
+            with self._lock:
+                self.errors_total += failed
+                self.pending -= len(batch)
+                self.processed_total += len(batch)
+                self.batches_total += 1
+                self.last_lag_seconds = finished - oldest
+                self.last_batch_seconds = finished - started
+                self._recent.append((finished, len(batch)))
+
+    def oldest_pending_age(self):
+        with self.queue.mutex:
+            if not self.queue.queue:
+                return 0.0
+            return time.monotonic() - self.queue.queue[0][0]
+
+    def metrics(self):
+        now = time.monotonic()
+        with self._lock:
+            recent = [(finished, count) for finished, count in self._recent if now - finished <= 60]
+            return {
+                'mode': 'worker',
+                'running': self._thread is not None and self._thread.is_alive(),
+                'pending_readings': self.pending,
+                'oldest_pending_seconds': round(self.oldest_pending_age(), 3),
+                'last_lag_seconds': round(self.last_lag_seconds, 3),
+                'last_batch_seconds': round(self.last_batch_seconds, 3),
+                'processed_total': self.processed_total,
+                'batches_total': self.batches_total,
+                'errors_total': self.errors_total,
+                'throughput_per_second': round(sum(count for _, count in recent) / 60, 2),
+            }
+
+evaluation_worker = AlertEvaluationWorker()
+
+def evaluation_mode():
+    """ALERT_EVALUATION_MODE, validated"""
+    mode = settings.ALERT_EVALUATION_MODE
+    if mode not in EVALUATION_MODES:
+        raise ImproperlyConfigured(
+            f"ALERT_EVALUATION_MODE must be one of {', '.join(EVALUATION_MODES)}, got {mode!r}"
+        )
+    return mode
+
+def schedule_alert_evaluation(readings):
+    """Evaluate new readings according to ALERT_EVALUATION_MODE"""
+    mode = evaluation_mode()
+
+    if mode == 'worker':
+        evaluation_worker.submit(readings)
+    elif mode == 'celery':
+        from .tasks import evaluate_readings
+        evaluate_readings.delay([reading.id for reading in readings], time.time())
+    else:
+        from .utils import check_and_create_alerts
+        check_and_create_alerts(readings)
+
+def increment(key, delta):
+    """Atomic counter in the shared cache, created on first use"""
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+def record_celery_batch(count, lag_seconds, duration_seconds):
+    """Keep running totals for the Celery consumer in the shared cache"""
+    increment(f"{CELERY_STATS_CACHE_PREFIX}processed_total", count)
+    increment(f"{CELERY_STATS_CACHE_PREFIX}batches_total", 1)
+    cache.set_many({
+        f"{CELERY_STATS_CACHE_PREFIX}last_lag_seconds": round(lag_seconds, 3),
+        f"{CELERY_STATS_CACHE_PREFIX}last_batch_seconds": round(duration_seconds, 3),
+    }, None)
+
+def celery_stats():
+    """Totals and last batch figures recorded by record_celery_batch"""
+    stored = cache.get_many([f"{CELERY_STATS_CACHE_PREFIX}{field}" for field in CELERY_COUNTERS + CELERY_GAUGES])
+    stats = {field: stored.get(f"{CELERY_STATS_CACHE_PREFIX}{field}", 0) for field in CELERY_COUNTERS}
+    for field in CELERY_GAUGES:
+        if f"{CELERY_STATS_CACHE_PREFIX}{field}" in stored:
+            stats[field] = stored[f"{CELERY_STATS_CACHE_PREFIX}{field}"]
+    return stats
+
+def evaluation_metrics():
+    """Lag and throughput of the configured consumer"""
+    mode = evaluation_mode()
+    if mode == 'worker':
+        return evaluation_worker.metrics()
+    if mode == 'celery':
+        return {'mode': 'celery', **celery_stats()}
+    return {'mode': 'sync'}
@@ -0,0 +1,120 @@
+"""
+Coalescing of alert notifications during storms.
+
+Critical alerts are notified as soon as they are created. Other alerts are
+flagged notification_pending and collected by the send_alert_digests task
+every ALERT_DIGEST_WINDOW_SECONDS into one AlertDigest, which goes out as a
+single message per recipient grouped by river and severity. Alerts that
+were acknowledged or resolved before the window closed are left out.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from .models import Alert, AlertDigest
+
+SEVERITY_ORDER = {'critical': 0, 'warning': 1, 'info': 2}
+
+# Alerts listed per group in an email digest, the rest are only counted
+DIGEST_GROUP_LIMIT = 20
+
+def notify_immediately(severity):
+    """Critical alerts (or every alert when coalescing is disabled) skip the digest"""
+    return severity == 'critical' or not settings.ALERT_DIGEST_WINDOW_SECONDS
+
+def group_alerts(alerts):
+    """[(river_name, severity, alerts)] by severity (most severe first), then river"""
+    groups = {}
+    for alert in alerts:
+        groups.setdefault((alert.sensor.river.name, alert.severity), []).append(alert)
+    keys = sorted(groups, key=lambda key: (SEVERITY_ORDER.get(key[1], 99), key[0]))
+    return [(river, severity, sorted(groups[river, severity], key=lambda alert: alert.created_at))
+            for river, severity in keys]
+
+def _severity_display(severity):
+    return dict(Alert.SEVERITY_CHOICES).get(severity, severity)
+
+def digest_email_content(digest):
+    alerts = list(digest.alerts.all())
+    groups = group_alerts(alerts)
+    rivers = {river for river, _, _ in groups}
+    subject = f"[Resumen] {len(alerts)} alertas en {len(rivers)} río(s)"
+
+    lines = [
+        "Resumen de alertas del sistema de monitoreo de ríos de Pucón",
+        f"Periodo: {timezone.localtime(digest.window_start):%d/%m/%Y %H:%M} - "
+        f"{timezone.localtime(digest.window_end):%H:%M}",
+        "",
+    ]
+    for river, severity, group in groups:
+        lines.append(f"{river} - {_severity_display(severity)} ({len(group)} alertas)")
+        for alert in group[:DIGEST_GROUP_LIMIT]:
+            lines.append(f"  - {timezone.localtime(alert.created_at):%H:%M} {alert.title}")
+        if len(group) > DIGEST_GROUP_LIMIT:
+            lines.append(f"  ... y {len(group) - DIGEST_GROUP_LIMIT} más")
+        lines.append("")
+    lines.append("Por favor, revise el sistema para más detalles.")
+    return subject, "\n".join(lines)
+
+def digest_sms_content(digest):
+    groups = group_alerts(digest.alerts.all())
+    total = sum(len(group) for _, _, group in groups)
+    summary = "; ".join(
+        f"{river}: {len(group)} {_severity_display(severity).lower()}" for river, severity, group in groups
+    )
+    return f"RESUMEN ALERTAS ({total}): {summary}"
+
+def digest_webhook_payload(digest):
+    groups = group_alerts(digest.alerts.all())
+    return {
+        'digest_id': digest.id,
+        'window_start': digest.window_start.isoformat(),
+        'window_end': digest.window_end.isoformat(),
+        'alert_count': sum(len(group) for _, _, group in groups),
+        'groups': [
+            {
+                'river_name': river,
+                'severity': severity,
+                'alerts': [
+                    {
+                        'alert_id': alert.id,
+                        'sensor_name': alert.sensor.name,
+                        'title': alert.title,
+                        'message': alert.message,
+                        'timestamp': alert.created_at.isoformat(),
+                    }
+                    for alert in group
+                ],
+            }
+            for river, severity, group in groups
+        ],
+    }
+
+def collect_pending_alerts():
+    """Claim the alerts waiting for a digest, skipping rows another run has locked"""
+    with transaction.atomic():
+        ids = list(
+            Alert.objects.select_for_update(skip_locked=True)
+            .filter(notification_pending=True)
+            .values_list('id', flat=True)
+        )
+        Alert.objects.filter(id__in=ids).update(notification_pending=False)
+    return ids
+
+def build_digest():
+    """Create the digest of the current window, or None if nothing is pending"""
+    ids = collect_pending_alerts()
+    alerts = list(
+        Alert.objects.filter(id__in=ids, status='active')
+        .select_related('sensor__river')
+        .order_by('created_at')
+    )
+    if not alerts:
+        return None
+
+    digest = AlertDigest.objects.create(window_start=alerts[0].created_at, window_end=timezone.now())
+    digest.alerts.set(alerts)
+    prefetch_related_objects(
+        [digest], Prefetch('alerts', queryset=Alert.objects.select_related('sensor__river'))
+    )
+    return digest
@@ -0,0 +1,337 @@
+"""
+Delivery of alert notifications over the active channels.
+
+A dispatch covers a batch of alerts at once: every email channel sends all
+of its messages over a single SMTP connection, webhooks share a pooled
+requests.Session, and the per-channel jobs run on a bounded thread pool.
+Notifications are either for a single alert or for a digest of several
+(see digest.py). The jobs never touch the database (alerts must come with
+sensor__river loaded, digests with their alerts prefetched); results are
+stored with one bulk_create or bulk_update.
+
+Every attempt goes through the channel's guard (see throttling.py).
+Failed attempts are retried with exponential backoff and jitter until
+NOTIFICATION_MAX_ATTEMPTS; attempts refused by an open circuit or the rate
+limit are deferred without counting as an attempt. Both stay 'pending'
+with next_retry_at set and are picked up by the retry_notifications task.
+"""
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from django.db.models import Prefetch
+from .digest import digest_email_content, digest_sms_content, digest_webhook_payload
+from .models import Alert, AlertDigest, AlertNotification, NotificationChannel
+from .throttling import channel_guards
+
+logger = logging.getLogger(__name__)
+
+RESULT_FIELDS = ['recipient', 'status', 'sent_at', 'error_message',
+                 'attempts', 'last_attempt_at', 'next_retry_at']
+
+_lock = threading.Lock()
+_session = None
+_executor = None
+
+def get_http_session():
+    """Process-wide session keeping webhook connections alive between alerts"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.NOTIFICATION_HTTP_POOL_SIZE,
+                    pool_maxsize=settings.NOTIFICATION_HTTP_POOL_SIZE
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+def get_executor():
+    """Shared pool bounding the delivery jobs running at once in this process"""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.NOTIFICATION_MAX_WORKERS,
+                    thread_name_prefix='alert-notification'
+                )
+    return _executor
+
+def email_content(alert):
+    subject = f"[{alert.get_severity_display()}] {alert.title}"
+    message = f"""
+    Se ha generado una nueva alerta en el sistema de monitoreo de ríos de Pucón.
+
+    Sensor: {alert.sensor.name}
+    Río: {alert.sensor.river.name}
+    Severidad: {alert.get_severity_display()}
+    Mensaje: {alert.message}
+    Fecha: {alert.created_at.strftime('%d/%m/%Y %H:%M:%S')}
+
+    Por favor, revise el sistema para más detalles.
+    """
+    return subject, message
+
+def sms_content(alert):
+    return f"ALERTA {alert.get_severity_display()}: {alert.sensor.name} - {alert.message}"
+
+def webhook_payload(alert):
+    return {
+        'alert_id': alert.id,
+        'sensor_name': alert.sensor.name,
+        'river_name': alert.sensor.river.name,
+        'severity': alert.severity,
+        'title': alert.title,
+        'message': alert.message,
+        'timestamp': alert.created_at.isoformat(),
+        'sensor_location': {
+            'latitude': alert.sensor.latitude,
+            'longitude': alert.sensor.longitude
+        }
+    }
+
+def notification_content(notification, for_alert, for_digest):
+    if notification.digest_id is not None:
+        return for_digest(notification.digest)
+    return for_alert(notification.alert)
+
+def retry_delay(attempts):
+    """Exponential backoff in seconds after the given number of attempts, with jitter"""
+    delay = min(
+        settings.NOTIFICATION_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+        settings.NOTIFICATION_RETRY_MAX_SECONDS
+    )
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def record_attempt(notification, error=None):
+    """Store the outcome of a delivery attempt and schedule a retry if needed"""
+    now = timezone.now()
+    notification.attempts += 1
+    notification.last_attempt_at = now
+    notification.error_message = error or ''
+
+    if error is None:
+        notification.status = 'sent'
+        notification.sent_at = now
+        notification.next_retry_at = None
+    elif notification.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+        notification.status = 'failed'
+        notification.next_retry_at = None
+    else:
+        notification.status = 'pending'
+        notification.next_retry_at = now + timedelta(seconds=retry_delay(notification.attempts))
+
+def defer(notification, seconds):
+    """Postpone a notification the channel guard did not let through"""
+    notification.status = 'pending'
+    notification.next_retry_at = timezone.now() + timedelta(seconds=seconds)
+
+def send_email_batch(notifications, guard):
+    """Send a channel's emails over one SMTP connection, reopened only after an error"""
+    connection = None
+    try:
+        for notification in notifications:
+            wait = guard.acquire()
+            if wait:
+                defer(notification, wait)
+                continue
+
+            subject, body = notification_content(notification, email_content, digest_email_content)
+            message = EmailMessage(subject, body, settings.EMAIL_HOST_USER, [notification.recipient])
+            try:
+                if connection is None:
+                    connection = get_connection(fail_silently=False)
+                    connection.open()
+                connection.send_messages([message])
+            except Exception as e:
+                guard.record(False)
+                record_attempt(notification, str(e))
+                connection = _close(connection)
+            else:
+                guard.record(True)
+                record_attempt(notification)
+    finally:
+        _close(connection)
+
+def _close(connection):
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            logger.warning('Could not close the SMTP connection cleanly', exc_info=True)
+    return None
+
+def send_sms_batch(notifications, guard):
+    """Send SMS notifications (placeholder - integrate with SMS provider)"""
+    for notification in notifications:
+        wait = guard.acquire()
+        if wait:
+            defer(notification, wait)
+            continue
+
+        message = notification_content(notification, sms_content, digest_sms_content)
+        # Placeholder for SMS API integration, the message is only logged
+        # response = get_http_session().post('SMS_PROVIDER_API', data={...})
+        logger.info('SMS to %s: %s', notification.recipient, message)
+        guard.record(True)
+        record_attempt(notification)
+
+def send_webhooks(notifications, guard):
+    for notification in notifications:
+        wait = guard.acquire()
+        if wait:
+            defer(notification, wait)
+            continue
+
+        error = post_webhook(notification)
+        guard.record(error is None)
+        record_attempt(notification, error)
+
+def post_webhook(notification):
+    """POST the alert to the channel's current URL, returns an error message on failure"""
+    notification.recipient = notification.channel.configuration.get('url')
+    try:
+        response = get_http_session().post(
+            notification.recipient,
+            json=notification_content(notification, webhook_payload, digest_webhook_payload),
+            timeout=settings.NOTIFICATION_WEBHOOK_TIMEOUT
+        )
+    except Exception as e:
+        return str(e)
+
+    if 200 <= response.status_code < 300:
+        return None
+    return f"HTTP {response.status_code}: {response.text[:1000]}"
+
+SENDERS = {
+    'email': send_email_batch,
+    'sms': send_sms_batch,
+    'webhook': send_webhooks,
+}
+
+def build_notifications(targets, channels):
+    """Unsaved pending notifications, one per target (alert or digest) and channel recipient"""
+    notifications = []
+    for channel in channels:
+        if channel.channel_type == 'webhook':
+            recipients = [channel.configuration.get('url')]
+        elif channel.channel_type in SENDERS:
+            recipients = channel.configuration.get('recipients', [])
+        else:
+            continue
+        for target in targets:
+            key = 'digest' if isinstance(target, AlertDigest) else 'alert'
+            notifications.extend(
+                AlertNotification(channel=channel, recipient=recipient, status='pending', **{key: target})
+                for recipient in recipients
+            )
+    return notifications
+
+def delivery_jobs(notifications):
+    """
+    (function, notifications, guard) per channel; webhooks are split into up
+    to NOTIFICATION_CHANNEL_CONCURRENCY parallel jobs so that one channel
+    never occupies the whole pool
+    """
+    by_channel = {}
+    for notification in notifications:
+        by_channel.setdefault(notification.channel_id, []).append(notification)
+
+    jobs = []
+    for channel_notifications in by_channel.values():
+        channel = channel_notifications[0].channel
+        guard = channel_guards.get(channel)
+        function = SENDERS[channel.channel_type]
+        slices = settings.NOTIFICATION_CHANNEL_CONCURRENCY if channel.channel_type == 'webhook' else 1
+        for index in range(min(slices, len(channel_notifications))):
+            jobs.append((function, channel_notifications[index::slices], guard))
+    return jobs
+
+def deliver(notifications):
+    """Attempt delivery of the notifications, updating them in place"""
+    executor = get_executor()
+    jobs = delivery_jobs(notifications)
+    futures = [executor.submit(function, batch, guard) for function, batch, guard in jobs]
+
+    for (function, batch, guard), future in zip(jobs, futures):
+        try:
+            future.result()
+        except Exception:
+            logger.exception('Notification job %s failed', function.__name__)
+            # Unattempted retries keep their lease and come back after it
+            for notification in batch:
+                if notification.status == 'pending' and notification.next_retry_at is None:
+                    defer(notification, retry_delay(notification.attempts + 1))
+
+def _dispatch(targets, channels):
+    if channels is None:
+        channels = list(NotificationChannel.objects.filter(is_active=True))
+    notifications = build_notifications(targets, channels)
+    if not notifications:
+        return []
+
+    deliver(notifications)
+    return AlertNotification.objects.bulk_create(notifications)
+
+def dispatch_notifications(alerts, channels=None):
+    """
+    Deliver alerts through channels (all active channels by default) and
+    store the resulting AlertNotification rows
+    """
+    return _dispatch(list(alerts), channels)
+
+def dispatch_digest(digest, channels=None):
+    """Deliver a digest (alerts prefetched) as one message per recipient"""
+    return _dispatch([digest], channels)
+
+def claim_due_notifications(limit):
+    """
+    Pending notifications whose retry time has come. They are leased by
+    moving next_retry_at forward, so an overlapping run skips them and a
+    crashed run leaves them to be retried after the lease.
+    """
+    now = timezone.now()
+    ids = list(
+        AlertNotification.objects.filter(status='pending', next_retry_at__lte=now)
+        .order_by('next_retry_at')
+        .values_list('id', flat=True)[:limit]
+    )
+    if not ids:
+        return []
+
+    lease = now + timedelta(seconds=settings.NOTIFICATION_RETRY_LEASE_SECONDS)
+    AlertNotification.objects.filter(
+        id__in=ids, status='pending', next_retry_at__lte=now
+    ).update(next_retry_at=lease)
+    return list(
+        AlertNotification.objects.filter(id__in=ids, next_retry_at=lease)
+        .select_related('alert__sensor__river', 'channel', 'digest')
+        .prefetch_related(Prefetch('digest__alerts', queryset=Alert.objects.select_related('sensor__river')))
+    )
+
+def retry_due_notifications(limit=None):
+    """Retry pending notifications that are due, returns how many were attempted"""
+    notifications = claim_due_notifications(limit or settings.NOTIFICATION_RETRY_BATCH_SIZE)
+
+    deliverable = []
+    for notification in notifications:
+        if notification.channel.is_active:
+            deliverable.append(notification)
+        else:
+            notification.status = 'failed'
+            notification.next_retry_at = None
+            notification.error_message = 'Channel disabled'
+
+    deliver(deliverable)
+    AlertNotification.objects.bulk_update(notifications, RESULT_FIELDS)
+    return len(notifications)
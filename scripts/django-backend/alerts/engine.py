@@ -0,0 +1,117 @@
+"""
+Compiled alert rule engine.
+
+Active alert rules are compiled once into a per-sensor, per-metric lookup
+structure kept in process memory, so evaluating a reading does not touch the
+database. The structure is invalidated by AlertRule save/delete signals in
+the process that made the change. Other processes compare the version of
+the rule table (row count and latest updated_at) at most every
+ALERT_RULES_CHECK_INTERVAL seconds and recompile when it moved, which
+works without a shared cache.
+"""
+import operator
+import threading
+import time
+from django.conf import settings
+from django.db.models import Count, Max
+from .models import AlertRule
+
+CONDITION_OPERATORS = {
+    'greater_than': operator.gt,
+    'less_than': operator.lt,
+    'equals': operator.eq,
+}
+
+class CompiledRule:
+    """Immutable snapshot of an AlertRule used on the ingest path"""
+    __slots__ = ('id', 'name', 'sensor_id', 'metric', 'condition',
+                 'threshold_value', 'severity', 'compare')
+
+    def __init__(self, rule):
+        self.id = rule.id
+        self.name = rule.name
+        self.sensor_id = rule.sensor_id
+        self.metric = rule.metric
+        self.condition = rule.condition
+        self.threshold_value = rule.threshold_value
+        self.severity = rule.severity
+        self.compare = CONDITION_OPERATORS.get(rule.condition)
+
+    def __repr__(self):
+        return f"<CompiledRule {self.id} {self.metric} {self.condition} {self.threshold_value}>"
+
+class RuleEngine:
+    """Evaluates readings against the compiled set of active alert rules"""
+    METRICS = [metric for metric, _ in AlertRule.METRIC_CHOICES]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (rules by scope, merged rules by sensor) - replaced, never mutated in place
+        self._compiled = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        """Drop the compiled rules in this process"""
+        self._compiled = None
+
+    def table_version(self):
+        """Changes whenever a rule is created, saved or deleted"""
+        version = AlertRule.objects.aggregate(count=Count('id'), updated=Max('updated_at'))
+        return version['count'], version['updated']
+
+    def _compile(self):
+        """Build {sensor_id or None: {metric: [CompiledRule, ...]}}"""
+        rules = {}
+        for rule in AlertRule.objects.filter(is_active=True, metric__in=self.METRICS):
+            compiled = CompiledRule(rule)
+            if compiled.compare is None and compiled.condition != 'rapid_change':
+                continue
+            rules.setdefault(compiled.sensor_id, {}).setdefault(compiled.metric, []).append(compiled)
+        return rules
+
+    def refresh(self):
+        """Recompile the rules if they were invalidated here or changed by another process"""
+        compiled = self._compiled
+        now = time.monotonic()
+        if compiled is not None and now - self._checked_at < settings.ALERT_RULES_CHECK_INTERVAL:
+            return compiled
+        version = self.table_version()
+        self._checked_at = now
+        if compiled is not None and version == self._version:
+            return compiled
+        with self._lock:
+            self._compiled = (self._compile(), {})
+            self._version = version
+            return self._compiled
+
+    def rules_for_sensor(self, sensor_id):
+        """Get {metric: [CompiledRule, ...]} for a sensor, including global rules"""
+        compiled = self._compiled or self.refresh()
+        rules, sensor_rules = compiled
+        merged = sensor_rules.get(sensor_id)
+        if merged is None:
+            merged = {}
+            for scope in (None, sensor_id):
+                for metric, scoped_rules in rules.get(scope, {}).items():
+                    merged.setdefault(metric, []).extend(scoped_rules)
+            sensor_rules[sensor_id] = merged
+        return merged
+
+    def evaluate(self, sensor_reading):
+        """
+        Yield (rule, value) for every rule triggered by the reading.
+        Call refresh() once per batch to pick up changes from other processes.
+        """
+        for metric, rules in self.rules_for_sensor(sensor_reading.sensor_id).items():
+            value = getattr(sensor_reading, metric)
+            for rule in rules:
+                if rule.compare is not None:
+                    triggered = rule.compare(value, rule.threshold_value)
+                else:
+                    from .utils import check_rapid_change
+                    triggered = check_rapid_change(sensor_reading, metric, rule.threshold_value)
+                if triggered:
+                    yield rule, value
+
+rule_engine = RuleEngine()
@@ -0,0 +1,239 @@
+"""
+In-memory recent history of sensor readings for window-based alert rules.
+
+Each sensor keeps, per metric, array-backed (timestamp, value) pairs sorted
+by the readings' own timestamps and trimmed to ALERT_HISTORY_WINDOW_MINUTES,
+so out-of-order (replayed) readings are handled correctly. A sensor's
+window is loaded lazily from the database the first time a rule needs it,
+and from then on kept up to date by the readings that go through alert
+evaluation.
+
+Histories are per process and only see the readings that process
+evaluates. Before each batch the tracked sensors' reading counts are
+compared with SensorLatestState (one query); a history that missed
+readings stored by another process is dropped and reloaded from the
+database. A window trimmed by ALERT_HISTORY_MAX_POINTS is only complete
+from its oldest kept point, older lookups go to the database.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import timedelta
+import threading
+from django.conf import settings
+
+METRICS = ['water_level', 'temperature', 'flow_rate', 'battery_level']
+
+class MetricWindow:
+    """Sorted (timestamp, value) pairs for one metric, timestamps as epoch seconds"""
+    __slots__ = ('timestamps', 'values')
+
+    def __init__(self):
+        self.timestamps = array('d')
+        self.values = array('d')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def add(self, timestamp, value):
+        if not self.timestamps or timestamp >= self.timestamps[-1]:
+            self.timestamps.append(timestamp)
+            self.values.append(value)
+        else:
+            index = bisect_right(self.timestamps, timestamp)
+            self.timestamps.insert(index, timestamp)
+            self.values.insert(index, value)
+
+    def trim(self, oldest, max_points):
+        """
+        Drop points older than oldest and keep at most max_points. Returns
+        the oldest kept timestamp if points newer than oldest were dropped.
+        """
+        by_age = bisect_left(self.timestamps, oldest)
+        index = max(by_age, len(self.timestamps) - max_points)
+        if index > 0:
+            del self.timestamps[:index]
+            del self.values[:index]
+        if index > by_age:
+            return self.timestamps[0]
+        return None
+
+    def value_at_or_before(self, timestamp):
+        index = bisect_right(self.timestamps, timestamp) - 1
+        return self.values[index] if index >= 0 else None
+
+    def _range(self, start, end):
+        return bisect_left(self.timestamps, start), bisect_right(self.timestamps, end)
+
+    def moving_average(self, start, end):
+        lo, hi = self._range(start, end)
+        if lo >= hi:
+            return None
+        return sum(self.values[lo:hi]) / (hi - lo)
+
+    def slope(self, start, end):
+        """Least-squares slope in units per second over [start, end]"""
+        lo, hi = self._range(start, end)
+        n = hi - lo
+        if n < 2:
+            return None
+        xs, ys = self.timestamps[lo:hi], self.values[lo:hi]
+        mean_x, mean_y = sum(xs) / n, sum(ys) / n
+        variance = sum((x - mean_x) ** 2 for x in xs)
+        if variance == 0:
+            return None
+        return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+class SensorHistory:
+    """Recent readings of one sensor, complete from covered_from onwards"""
+
+    def __init__(self, covered_from):
+        self.windows = {metric: MetricWindow() for metric in METRICS}
+        self.covered_from = covered_from
+        # SensorLatestState.reading_count the window is known to agree with
+        self.reading_count = None
+        self.lock = threading.Lock()
+
+    def add(self, timestamp, values, window_seconds, max_points):
+        with self.lock:
+            for metric, window in self.windows.items():
+                window.add(timestamp, values[metric])
+            newest = max(window.timestamps[-1] for window in self.windows.values())
+            oldest = newest - window_seconds
+            for window in self.windows.values():
+                kept_from = window.trim(oldest, max_points)
+                if kept_from is not None:
+                    oldest = max(oldest, kept_from)
+            if oldest > self.covered_from:
+                self.covered_from = oldest
+
+class SensorHistoryStore:
+    """Per-sensor histories for the current process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histories = {}
+
+    @property
+    def window(self):
+        return timedelta(minutes=settings.ALERT_HISTORY_WINDOW_MINUTES)
+
+    def invalidate(self, sensor_id=None):
+        with self._lock:
+            if sensor_id is None:
+                self._histories.clear()
+            else:
+                self._histories.pop(sensor_id, None)
+
+    def _load(self, sensor, before):
+        """Rebuild a sensor's window from the readings stored before `before`"""
+        from sensors.models import SensorReading
+
+        history = SensorHistory((before - self.window).timestamp())
+        rows = SensorReading.objects.filter(
+            sensor_id=sensor.pk,
+            timestamp__gte=before - self.window,
+            timestamp__lt=before
+        ).order_by('timestamp').values_list('timestamp', *METRICS)
+
+        for timestamp, *values in rows:
+            history.add(timestamp.timestamp(), dict(zip(METRICS, values)),
+                        self.window.total_seconds(), settings.ALERT_HISTORY_MAX_POINTS)
+        return history
+
+    def get(self, sensor, before):
+        """History of a sensor, loading it from the database on first use"""
+        history = self._histories.get(sensor.pk)
+        if history is None:
+            history = self._load(sensor, before)
+            with self._lock:
+                history = self._histories.setdefault(sensor.pk, history)
+        return history
+
+    def sync(self, readings):
+        """
+        Drop the histories of sensors in a batch that missed readings stored
+        elsewhere, call before evaluating the batch. Returns the reading
+        counts to pass to synced() once the batch has been recorded.
+        """
+        from sensors.models import SensorLatestState
+
+        batch = Counter(reading.sensor_id for reading in readings)
+        tracked = {sensor_id: self._histories[sensor_id] for sensor_id in batch if sensor_id in self._histories}
+        if not tracked:
+            return {}
+
+        counts = dict(SensorLatestState.objects.filter(sensor_id__in=tracked).values_list(
+            'sensor_id', 'reading_count'
+        ))
+        for sensor_id, history in tracked.items():
+            if history.reading_count is None or history.reading_count + batch[sensor_id] != counts.get(sensor_id):
+                with self._lock:
+                    if self._histories.get(sensor_id) is history:
+                        del self._histories[sensor_id]
+        return counts
+
+    def synced(self, readings, counts):
+        """Record the reading counts the histories of a just-evaluated batch agree with"""
+        from sensors.models import SensorLatestState
+
+        sensor_ids = {reading.sensor_id for reading in readings}
+        # Histories loaded during the batch, their count may include newer
+        # readings, which at worst causes one extra reload
+        loaded = [sensor_id for sensor_id in sensor_ids if sensor_id in self._histories and sensor_id not in counts]
+        if loaded:
+            counts = {**counts, **dict(SensorLatestState.objects.filter(sensor_id__in=loaded).values_list(
+                'sensor_id', 'reading_count'
+            ))}
+        for sensor_id in sensor_ids:
+            history = self._histories.get(sensor_id)
+            if history is not None:
+                history.reading_count = counts.get(sensor_id)
+
+    def record(self, sensor_reading):
+        """Add an evaluated reading to its sensor's window (if the sensor is tracked)"""
+        history = self._histories.get(sensor_reading.sensor_id)
+        if history is not None:
+            history.add(
+                sensor_reading.timestamp.timestamp(),
+                {metric: getattr(sensor_reading, metric) for metric in METRICS},
+                self.window.total_seconds(),
+                settings.ALERT_HISTORY_MAX_POINTS
+            )
+
+    def previous_value(self, sensor_reading, metric, minutes):
+        """
+        Newest value of metric at least `minutes` before the reading's own
+        timestamp, looking back no further than the history window
+        """
+        lookup = sensor_reading.timestamp - timedelta(minutes=minutes)
+        history = self.get(sensor_reading.sensor, sensor_reading.timestamp)
+
+        if lookup.timestamp() >= history.covered_from:
+            with history.lock:
+                return history.windows[metric].value_at_or_before(lookup.timestamp())
+
+        # Replayed reading older than the tracked window, read that slice directly
+        previous = sensor_reading.sensor.readings.filter(
+            timestamp__gte=lookup - self.window,
+            timestamp__lte=lookup
+        ).order_by('-timestamp').values_list(metric, flat=True).first()
+        return previous
+
+    def moving_average(self, sensor, metric, end, minutes):
+        history = self.get(sensor, end)
+        with history.lock:
+            return history.windows[metric].moving_average(
+                (end - timedelta(minutes=minutes)).timestamp(), end.timestamp()
+            )
+
+    def slope(self, sensor, metric, end, minutes):
+        """Trend of metric in units per minute over the last `minutes`"""
+        history = self.get(sensor, end)
+        with history.lock:
+            slope = history.windows[metric].slope(
+                (end - timedelta(minutes=minutes)).timestamp(), end.timestamp()
+            )
+        return slope * 60 if slope is not None else None
+
+sensor_history = SensorHistoryStore()
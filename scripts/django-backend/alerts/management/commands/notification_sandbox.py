@@ -0,0 +1,72 @@
+import time
+from django.core.management.base import BaseCommand
+from alerts.models import NotificationChannel
+from alerts.sandbox import NotificationSink
+
+class Command(BaseCommand):
+    help = (
+        'Run a local SMTP server and webhook receiver that accept and print notifications. '
+        'Point the app at it with EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend '
+        'EMAIL_HOST=127.0.0.1 EMAIL_PORT=<smtp port> EMAIL_USE_TLS=False'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--smtp-port', type=int, default=1025)
+        parser.add_argument('--http-port', type=int, default=8025)
+        parser.add_argument('--webhook-delay', type=float, default=0.0,
+                            help='Seconds the webhook receiver waits before answering')
+        parser.add_argument('--webhook-fail-rate', type=float, default=0.0,
+                            help='Fraction of webhook calls answered with HTTP 503')
+        parser.add_argument('--create-channels', action='store_true',
+                            help='Create active email and webhook channels pointing at the sandbox')
+
+    def handle(self, *args, **options):
+        sink = NotificationSink(
+            host=options['host'],
+            smtp_port=options['smtp_port'],
+            http_port=options['http_port'],
+            webhook_delay=options['webhook_delay'],
+            webhook_fail_rate=options['webhook_fail_rate'],
+            on_receive=self.print_received
+        ).start()
+
+        if options['create_channels']:
+            NotificationChannel.objects.update_or_create(
+                name='Sandbox email',
+                defaults={
+                    'channel_type': 'email',
+                    'configuration': {'recipients': ['ops@sandbox.local']},
+                    'is_active': True,
+                }
+            )
+            NotificationChannel.objects.update_or_create(
+                name='Sandbox webhook',
+                defaults={
+                    'channel_type': 'webhook',
+                    'configuration': {'url': sink.webhook_url},
+                    'is_active': True,
+                }
+            )
+
+        host, port = sink.smtp_address
+        self.stdout.write(self.style.SUCCESS(
+            f"SMTP sink on {host}:{port}, webhook receiver at {sink.webhook_url} (Ctrl+C to stop)"
+        ))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.stop()
+            self.stdout.write(f"Received {len(sink.emails)} emails and {len(sink.webhooks)} webhook calls")
+
+    def print_received(self, kind, details):
+        if kind == 'email':
+            self.stdout.write(f"[email] {details['from']} -> {', '.join(details['to'])}")
+        else:
+            status = 'failed' if details['failed'] else 'ok'
+            payload = details['payload']
+            alert_id = payload.get('alert_id') if isinstance(payload, dict) else None
+            self.stdout.write(f"[webhook] {details['path']} ({status}) alert {alert_id}")
@@ -1,5 +1,5 @@
 from django.db import models
-from django.contrib.auth.models import User
+from django.conf import settings
 from sensors.models import Sensor, SensorReading
 
 class Alert(models.Model):
@@ -18,21 +18,31 @@ class Alert(models.Model):
 
     sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='alerts')
     sensor_reading = models.ForeignKey(SensorReading, on_delete=models.CASCADE, null=True, blank=True)
+    rule = models.ForeignKey('AlertRule', on_delete=models.SET_NULL, null=True, blank=True, related_name='alerts')
     severity = models.CharField(max_length=20, choices=SEVERITY_CHOICES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     title = models.CharField(max_length=200)
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     acknowledged_at = models.DateTimeField(null=True, blank=True)
-    acknowledged_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    acknowledged_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
     resolved_at = models.DateTimeField(null=True, blank=True)
-    resolved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='resolved_alerts')
+    resolved_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='resolved_alerts')
+    # Waiting to go out in the next digest (see alerts.digest)
+    notification_pending = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['severity', 'status']),
-            models.Index(fields=['sensor', '-created_at']),
+            models.Index(fields=['sensor', '-created_at', '-id']),
+            models.Index(fields=['sensor', 'rule', 'status']),
+            models.Index(fields=['notification_pending']),
+        ]
+        constraints = [
+            # One active alert per rule and sensor, also across concurrent evaluations
+            models.UniqueConstraint(fields=['sensor', 'rule'], condition=models.Q(status='active'),
+                                    name='unique_active_alert_per_rule'),
         ]
 
     def __str__(self):
@@ -88,6 +98,19 @@ class NotificationChannel(models.Model):
     def __str__(self):
         return f"{self.name} ({self.get_channel_type_display()})"
 
+class AlertDigest(models.Model):
+    """Alerts of one coalescing window, notified together"""
+    alerts = models.ManyToManyField(Alert, related_name='digests')
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-window_end']
+
+    def __str__(self):
+        return f"Digest {self.window_start:%d/%m/%Y %H:%M} - {self.window_end:%H:%M}"
+
 class AlertNotification(models.Model):
     """Model for tracking sent notifications"""
     STATUS_CHOICES = [
@@ -96,15 +119,25 @@ class AlertNotification(models.Model):
         ('failed', 'Fallida'),
     ]
 
-    alert = models.ForeignKey(Alert, on_delete=models.CASCADE, related_name='notifications')
+    # Either a single alert or a digest of several
+    alert = models.ForeignKey(Alert, on_delete=models.CASCADE, related_name='notifications', null=True, blank=True)
+    digest = models.ForeignKey(AlertDigest, on_delete=models.CASCADE, related_name='notifications', null=True, blank=True)
     channel = models.ForeignKey(NotificationChannel, on_delete=models.CASCADE)
     recipient = models.CharField(max_length=200)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     sent_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True)
+    # Delivery attempts so far; pending notifications are retried at next_retry_at
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    next_retry_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-sent_at']
+        indexes = [
+            models.Index(fields=['status', 'next_retry_at']),
+        ]
 
     def __str__(self):
-        return f"{self.alert.title} -> {self.recipient} ({self.status})"
+        subject = self.alert.title if self.alert_id else str(self.digest)
+        return f"{subject} -> {self.recipient} ({self.status})"
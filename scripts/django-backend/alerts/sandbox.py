@@ -0,0 +1,140 @@
+"""
+Local stand-ins for the SMTP server and webhook receivers, for exercising
+notification delivery without sending anything out.
+
+Both servers are threaded, accept everything and keep what they received
+in memory. The webhook sink can be made slow or flaky to reproduce a
+struggling endpoint.
+"""
+import json
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib (any AUTH PLAIN credentials, no STARTTLS)"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply('220 sandbox SMTP sink')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command[:4].upper()
+
+            if verb == 'EHLO':
+                self.reply('250-sandbox')
+                self.reply('250 AUTH PLAIN')
+            elif verb == 'HELO':
+                self.reply('250 sandbox')
+            elif verb == 'AUTH':
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                self.server.sink.record_email(sender, recipients, b''.join(lines).decode(errors='replace'))
+                self.reply('250 OK queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 Command not implemented')
+
+class WebhookSinkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like real receivers
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        sink = self.server.sink
+        if sink.webhook_delay:
+            time.sleep(sink.webhook_delay)
+
+        failed = random.random() < sink.webhook_fail_rate
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = body.decode(errors='replace')
+        sink.record_webhook(self.path, payload, failed)
+
+        response = b'{"error": "simulated failure"}' if failed else b'{"status": "ok"}'
+        self.send_response(503 if failed else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+class _ThreadingSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class NotificationSink:
+    """Runs the SMTP and webhook servers in background threads"""
+
+    def __init__(self, host='127.0.0.1', smtp_port=1025, http_port=8025,
+                 webhook_delay=0.0, webhook_fail_rate=0.0, on_receive=None):
+        self.webhook_delay = webhook_delay
+        self.webhook_fail_rate = webhook_fail_rate
+        self.on_receive = on_receive
+        self.emails = []
+        self.webhooks = []
+        self._lock = threading.Lock()
+
+        self.smtp_server = _ThreadingSMTPServer((host, smtp_port), SMTPSinkHandler)
+        self.http_server = ThreadingHTTPServer((host, http_port), WebhookSinkHandler)
+        self.http_server.daemon_threads = True
+        for server in (self.smtp_server, self.http_server):
+            server.sink = self
+
+    @property
+    def smtp_address(self):
+        return self.smtp_server.server_address
+
+    @property
+    def webhook_url(self):
+        host, port = self.http_server.server_address
+        return f"http://{host}:{port}/webhook"
+
+    def record_email(self, sender, recipients, message):
+        with self._lock:
+            self.emails.append({'from': sender, 'to': recipients, 'message': message})
+        if self.on_receive:
+            self.on_receive('email', {'from': sender, 'to': recipients})
+
+    def record_webhook(self, path, payload, failed):
+        with self._lock:
+            self.webhooks.append({'path': path, 'payload': payload, 'failed': failed})
+        if self.on_receive:
+            self.on_receive('webhook', {'path': path, 'failed': failed, 'payload': payload})
+
+    def start(self):
+        for server in (self.smtp_server, self.http_server):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in (self.smtp_server, self.http_server):
+            server.shutdown()
+            server.server_close()
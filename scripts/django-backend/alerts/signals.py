@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import AlertRule, NotificationChannel
+from .engine import rule_engine
+from .throttling import channel_guards
+
+@receiver(post_save, sender=AlertRule)
+@receiver(post_delete, sender=AlertRule)
+def invalidate_compiled_rules(sender, **kwargs):
+    """Recompile alert rules once the change is committed"""
+    transaction.on_commit(rule_engine.invalidate)
+
+@receiver(post_save, sender=NotificationChannel)
+@receiver(post_delete, sender=NotificationChannel)
+def reset_channel_guard(sender, instance, **kwargs):
+    """Pick up changed rate limits and give a reconfigured endpoint a fresh circuit"""
+    channel_guards.invalidate(instance.pk)
@@ -1,151 +1,78 @@
 from celery import shared_task
-from django.core.mail import send_mail
-from django.conf import settings
-from .models import Alert, NotificationChannel, AlertNotification
-import requests
-import json
+from .models import Alert
+import time
 
 @shared_task
 def send_alert_notification(alert_id):
     """
     Send notifications for an alert through all active channels
     """
-    try:
-        alert = Alert.objects.get(id=alert_id)
-    except Alert.DoesNotExist:
-        return f"Alert {alert_id} not found"
-    
-    # Get active notification channels
-    channels = NotificationChannel.objects.filter(is_active=True)
+    from .dispatch import dispatch_notifications
     
-    for channel in channels:
-        if channel.channel_type == 'email':
-            send_email_notification(alert, channel)
-        elif channel.channel_type == 'sms':
-            send_sms_notification(alert, channel)
-        elif channel.channel_type == 'webhook':
-            send_webhook_notification(alert, channel)
+    alerts = list(Alert.objects.filter(id=alert_id).select_related('sensor__river'))
+    if not alerts:
+        return f"Alert {alert_id} not found"
     
+    dispatch_notifications(alerts)
     return f"Notifications sent for alert {alert_id}"
 
-def send_email_notification(alert, channel):
-    """Send email notification"""
-    config = channel.configuration
-    recipients = config.get('recipients', [])
-    
-    subject = f"[{alert.get_severity_display()}] {alert.title}"
-    message = f"""
-    Se ha generado una nueva alerta en el sistema de monitoreo de ríos de Pucón.
+@shared_task
+def send_alert_notifications(alert_ids):
+    """
+    Send notifications for a batch of alerts, sharing connections between them
+    """
+    from .dispatch import dispatch_notifications
     
-    Sensor: {alert.sensor.name}
-    Río: {alert.sensor.river.name}
-    Severidad: {alert.get_severity_display()}
-    Mensaje: {alert.message}
-    Fecha: {alert.created_at.strftime('%d/%m/%Y %H:%M:%S')}
+    alerts = Alert.objects.filter(id__in=alert_ids).select_related('sensor__river')
+    notifications = dispatch_notifications(alerts)
     
-    Por favor, revise el sistema para más detalles.
+    sent = sum(notification.status == 'sent' for notification in notifications)
+    return f"{sent} of {len(notifications)} notifications sent for {len(alert_ids)} alerts"
+
+@shared_task
+def send_alert_digests():
     """
+    Notify the non-critical alerts of the last window as one digest per recipient
+    (run every ALERT_DIGEST_WINDOW_SECONDS)
+    """
+    from .digest import build_digest
+    from .dispatch import dispatch_digest
     
-    for recipient in recipients:
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[recipient],
-                fail_silently=False,
-            )
-            
-            # Log successful notification
-            AlertNotification.objects.create(
-                alert=alert,
-                channel=channel,
-                recipient=recipient,
-                status='sent',
-                sent_at=timezone.now()
-            )
-            
-        except Exception as e:
-            # Log failed notification
-            AlertNotification.objects.create(
-                alert=alert,
-                channel=channel,
-                recipient=recipient,
-                status='failed',
-                error_message=str(e)
-            )
-
-def send_sms_notification(alert, channel):
-    """Send SMS notification (placeholder - integrate with SMS provider)"""
-    config = channel.configuration
-    recipients = config.get('recipients', [])
-    api_key = config.get('api_key')
+    digest = build_digest()
+    if digest is None:
+        return "No pending alerts"
     
-    message = f"ALERTA {alert.get_severity_display()}: {alert.sensor.name} - {alert.message}"
+    notifications = dispatch_digest(digest)
+    return f"Digest of {len(digest.alerts.all())} alerts sent to {len(notifications)} recipients"
+
+@shared_task
+def retry_notifications():
+    """
+    Retry notifications whose delivery failed or was deferred (run periodically)
+    """
+    from .dispatch import retry_due_notifications
     
-    for recipient in recipients:
-        try:
-            # Placeholder for SMS API integration
-            # response = requests.post('SMS_PROVIDER_API', data={...})
-            
-            AlertNotification.objects.create(
-                alert=alert,
-                channel=channel,
-                recipient=recipient,
-                status='sent',
-                sent_at=timezone.now()
-            )
-            
-        except Exception as e:
-            AlertNotification.objects.create(
-                alert=alert,
-                channel=channel,
-                recipient=recipient,
-                status='failed',
-                error_message=str(e)
-            )
+    retried = retry_due_notifications()
+    return f"Retried {retried} notifications"
 
-def send_webhook_notification(alert, channel):
-    """Send webhook notification"""
-    config = channel.configuration
-    webhook_url = config.get('url')
+@shared_task
+def evaluate_readings(reading_ids, enqueued_at):
+    """
+    Evaluate alert rules for readings stored by the ingest path
+    (ALERT_EVALUATION_MODE = 'celery')
+    """
+    from sensors.models import SensorReading
+    from .consumer import record_celery_batch
+    from .utils import check_and_create_alerts
     
-    payload = {
-        'alert_id': alert.id,
-        'sensor_name': alert.sensor.name,
-        'river_name': alert.sensor.river.name,
-        'severity': alert.severity,
-        'title': alert.title,
-        'message': alert.message,
-        'timestamp': alert.created_at.isoformat(),
-        'sensor_location': {
-            'latitude': alert.sensor.latitude,
-            'longitude': alert.sensor.longitude
-        }
-    }
+    started = time.time()
+    readings = list(
+        SensorReading.objects.filter(id__in=reading_ids)
+        .select_related('sensor')
+        .order_by('sensor_id', 'timestamp')
+    )
+    check_and_create_alerts(readings)
     
-    try:
-        response = requests.post(
-            webhook_url,
-            json=payload,
-            headers={'Content-Type': 'application/json'},
-            timeout=30
-        )
-        
-        AlertNotification.objects.create(
-            alert=alert,
-            channel=channel,
-            recipient=webhook_url,
-            status='sent' if response.status_code == 200 else 'failed',
-            sent_at=timezone.now(),
-            error_message=response.text if response.status_code != 200 else ''
-        )
-        
-    except Exception as e:
-        AlertNotification.objects.create(
-            alert=alert,
-            channel=channel,
-            recipient=webhook_url,
-            status='failed',
-            error_message=str(e)
-        )
+    finished = time.time()
+    record_celery_batch(len(readings), finished - enqueued_at, finished - started)
+    return f"Evaluated {len(readings)} readings"
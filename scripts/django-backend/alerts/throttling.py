@@ -0,0 +1,132 @@
+"""
+Per-channel delivery guards: a token-bucket rate limit and a circuit breaker.
+
+A channel whose endpoint keeps failing is opened for a while, so its
+notifications are deferred instead of tying up delivery workers, and the
+rest of the channels keep their throughput. Channels may override the
+defaults in their configuration with 'rate_per_minute', 'burst',
+'failure_threshold' and 'reset_seconds'. State is kept per process.
+"""
+import threading
+import time
+from django.conf import settings
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available, else return the seconds until the next one"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class CircuitBreaker:
+    """
+    Closed until failure_threshold consecutive failures, then open for
+    reset_seconds; after that a single trial request is let through
+    (half-open) and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return 'open'
+        return 'half_open'
+
+    def try_acquire(self):
+        """0 if a request may go out now, else the seconds to wait"""
+        state = self.state
+        if state == 'closed':
+            return 0.0
+        if state == 'half_open' and not self.trial_running:
+            self.trial_running = True
+            return 0.0
+        if state == 'open':
+            return self.reset_seconds - (time.monotonic() - self.opened_at)
+        # Half-open with the trial request still in flight
+        return 1.0
+
+    def record(self, success):
+        self.trial_running = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+        else:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class ChannelGuard:
+    """Rate limit and circuit breaker of one notification channel"""
+
+    def __init__(self, channel):
+        config = channel.configuration or {}
+        rate_per_minute = config.get('rate_per_minute', settings.NOTIFICATION_RATE_PER_MINUTE)
+        self.bucket = TokenBucket(
+            rate_per_minute / 60,
+            config.get('burst', settings.NOTIFICATION_RATE_BURST)
+        )
+        self.breaker = CircuitBreaker(
+            config.get('failure_threshold', settings.NOTIFICATION_CIRCUIT_FAILURE_THRESHOLD),
+            config.get('reset_seconds', settings.NOTIFICATION_CIRCUIT_RESET_SECONDS)
+        )
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Reserve one delivery attempt: 0 if it may go out now, else the seconds
+        after which it should be tried again (circuit open or rate exceeded)
+        """
+        with self._lock:
+            wait = self.breaker.try_acquire()
+            if wait:
+                return wait
+            wait = self.bucket.try_acquire()
+            if wait and self.breaker.trial_running:
+                self.breaker.trial_running = False
+            return wait
+
+    def record(self, success):
+        with self._lock:
+            self.breaker.record(success)
+
+class ChannelGuards:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._guards = {}
+
+    def get(self, channel):
+        guard = self._guards.get(channel.pk)
+        if guard is None:
+            with self._lock:
+                guard = self._guards.setdefault(channel.pk, ChannelGuard(channel))
+        return guard
+
+    def invalidate(self, channel_id=None):
+        with self._lock:
+            if channel_id is None:
+                self._guards.clear()
+            else:
+                self._guards.pop(channel_id, None)
+
+channel_guards = ChannelGuards()
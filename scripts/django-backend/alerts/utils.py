@@ -1,91 +1,103 @@
-from django.utils import timezone
-from .models import Alert, AlertRule
-from .tasks import send_alert_notification
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from .models import Alert
+from .engine import rule_engine
+from .history import sensor_history
+from .digest import notify_immediately
+from .tasks import send_alert_notifications
+from river_monitoring.live import publish_alert
+from sensors.cache import invalidate_river_summaries
 
 def check_and_create_alert(sensor_reading):
     """
     Check if a sensor reading triggers any alert rules and create alerts if necessary
     """
-    sensor = sensor_reading.sensor
+    check_and_create_alerts([sensor_reading])
+
+def check_and_create_alerts(sensor_readings):
+    """
+    Check a batch of sensor readings against the compiled alert rules.
+    No queries are issued unless a rule fires, apart from one check of the
+    in-memory rapid_change windows when the batch has tracked sensors.
+    """
+    if not sensor_readings:
+        return
     
-    # Get active alert rules for this sensor
-    rules = AlertRule.objects.filter(
-        Q(sensor=sensor) | Q(sensor__isnull=True),
-        is_active=True
-    )
+    rule_engine.refresh()
+    history_counts = sensor_history.sync(sensor_readings)
     
-    for rule in rules:
-        should_trigger = False
-        
-        # Check different conditions
-        if rule.metric == 'water_level':
-            value = sensor_reading.water_level
-        elif rule.metric == 'temperature':
-            value = sensor_reading.temperature
-        elif rule.metric == 'flow_rate':
-            value = sensor_reading.flow_rate
-        elif rule.metric == 'battery_level':
-            value = sensor_reading.battery_level
-        else:
-            continue
-        
-        # Evaluate condition
-        if rule.condition == 'greater_than' and value > rule.threshold_value:
-            should_trigger = True
-        elif rule.condition == 'less_than' and value < rule.threshold_value:
-            should_trigger = True
-        elif rule.condition == 'equals' and value == rule.threshold_value:
-            should_trigger = True
-        elif rule.condition == 'rapid_change':
-            # Check for rapid change (implementation depends on specific requirements)
-            should_trigger = check_rapid_change(sensor, rule.metric, value, rule.threshold_value)
+    # Only the first trigger of a rule per sensor matters within a batch
+    handled = set()
+    created = []
+    
+    for sensor_reading in sensor_readings:
+        for rule, value in rule_engine.evaluate(sensor_reading):
+            key = (sensor_reading.sensor_id, rule.id)
+            if key in handled:
+                continue
+            handled.add(key)
+            alert = create_rule_alert(rule, sensor_reading, value)
+            if alert is not None and not alert.notification_pending:
+                created.append(alert.id)
         
-        if should_trigger:
-            # Check if there's already an active alert for this rule
-            existing_alert = Alert.objects.filter(
+        # Keep the in-memory window current for rapid_change rules
+        sensor_history.record(sensor_reading)
+    
+    sensor_history.synced(sensor_readings, history_counts)
+    
+    # Notify the whole batch at once so deliveries share connections,
+    # the other alerts wait for the next digest
+    if created:
+        send_alert_notifications.delay(created)
+
+def create_rule_alert(rule, sensor_reading, value):
+    """
+    Create an alert for a triggered rule unless one is already active.
+    Notifications are sent by the caller.
+    """
+    sensor = sensor_reading.sensor
+    
+    # Check if there's already an active alert for this rule (indexed lookup)
+    if Alert.objects.filter(sensor=sensor, rule_id=rule.id, status='active').exists():
+        return None
+    
+    # Create new alert, a concurrent evaluation may have created it since
+    # the check (unique_active_alert_per_rule)
+    try:
+        with transaction.atomic():
+            alert = Alert.objects.create(
                 sensor=sensor,
+                sensor_reading=sensor_reading,
+                rule_id=rule.id,
                 severity=rule.severity,
-                status='active',
-                title__icontains=rule.name
-            ).first()
-            
-            if not existing_alert:
-                # Create new alert
-                alert = Alert.objects.create(
-                    sensor=sensor,
-                    sensor_reading=sensor_reading,
-                    severity=rule.severity,
-                    title=f"{rule.name} - {sensor.name}",
-                    message=f"Sensor {sensor.name} ha activado la regla '{rule.name}'. "
-                           f"Valor actual: {value} {get_metric_unit(rule.metric)}"
-                )
-                
-                # Send notifications asynchronously
-                send_alert_notification.delay(alert.id)
+                title=f"{rule.name} - {sensor.name}",
+                message=f"Sensor {sensor.name} ha activado la regla '{rule.name}'. "
+                       f"Valor actual: {value} {get_metric_unit(rule.metric)}",
+                notification_pending=not notify_immediately(rule.severity)
+            )
+    except IntegrityError:
+        return None
+    
+    # The river's alert status comes from its active alerts
+    invalidate_river_summaries([sensor.river_id])
+    publish_alert(alert, 'created')
+    
+    return alert
 
-def check_rapid_change(sensor, metric, current_value, threshold_percentage):
+def check_rapid_change(sensor_reading, metric, threshold_percentage):
     """
-    Check if there's a rapid change in the metric value
+    Check if the metric changed by more than threshold_percentage compared
+    to the sensor's value at least RAPID_CHANGE_MINUTES before this reading
+    (by the reading's own timestamp, so replayed data is evaluated correctly)
     """
-    # Get the previous reading
-    previous_reading = sensor.readings.filter(
-        timestamp__lt=timezone.now() - timezone.timedelta(minutes=5)
-    ).first()
-    
-    if not previous_reading:
-        return False
+    previous_value = sensor_history.previous_value(
+        sensor_reading, metric, settings.RAPID_CHANGE_MINUTES
+    )
     
-    if metric == 'water_level':
-        previous_value = previous_reading.water_level
-    elif metric == 'temperature':
-        previous_value = previous_reading.temperature
-    elif metric == 'flow_rate':
-        previous_value = previous_reading.flow_rate
-    else:
+    if not previous_value:
         return False
     
-    if previous_value == 0:
-        return False
+    current_value = getattr(sensor_reading, metric)
     
     # Calculate percentage change
     change_percentage = abs((current_value - previous_value) / previous_value) * 100
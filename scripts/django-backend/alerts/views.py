@@ -5,6 +5,10 @@ from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
 from django.db.models import Count, Q
 from datetime import timedelta
+from river_monitoring.live import publish_alert
+from sensors.cache import invalidate_river_summaries
+from .consumer import evaluation_metrics
+from river_monitoring.pagination import AlertCursorPagination, NotificationCursorPagination
 from .models import Alert, AlertRule, NotificationChannel, AlertNotification
 from .serializers import (
     AlertSerializer, AlertRuleSerializer, 
@@ -14,9 +18,24 @@ from .serializers import (
 class AlertViewSet(viewsets.ModelViewSet):
     queryset = Alert.objects.select_related('sensor', 'sensor__river', 'acknowledged_by', 'resolved_by')
     serializer_class = AlertSerializer
+    pagination_class = AlertCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['severity', 'status', 'sensor', 'sensor__river']
-    ordering = ['-created_at']
+    ordering = ['-created_at', '-id']
+
+    def perform_create(self, serializer):
+        alert = serializer.save()
+        # River summaries derive their alert status from active alerts
+        invalidate_river_summaries([alert.sensor.river_id])
+
+    def perform_update(self, serializer):
+        alert = serializer.save()
+        invalidate_river_summaries([alert.sensor.river_id])
+
+    def perform_destroy(self, instance):
+        river_id = instance.sensor.river_id
+        instance.delete()
+        invalidate_river_summaries([river_id])
 
     @action(detail=True, methods=['post'])
     def acknowledge(self, request, pk=None):
@@ -33,6 +52,8 @@ class AlertViewSet(viewsets.ModelViewSet):
         alert.acknowledged_at = timezone.now()
         alert.acknowledged_by = request.user
         alert.save()
+        invalidate_river_summaries([alert.sensor.river_id])
+        publish_alert(alert, 'acknowledged')
         
         serializer = self.get_serializer(alert)
         return Response(serializer.data)
@@ -52,6 +73,8 @@ class AlertViewSet(viewsets.ModelViewSet):
         alert.resolved_at = timezone.now()
         alert.resolved_by = request.user
         alert.save()
+        invalidate_river_summaries([alert.sensor.river_id])
+        publish_alert(alert, 'resolved')
         
         serializer = self.get_serializer(alert)
         return Response(serializer.data)
@@ -63,6 +86,11 @@ class AlertViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(active_alerts, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def evaluation_metrics(self, request):
+        """Lag and throughput of background alert evaluation"""
+        return Response(evaluation_metrics())
+
     @action(detail=False, methods=['get'])
     def summary(self, request):
         """Get alert summary for dashboard"""
@@ -101,6 +129,7 @@ class NotificationChannelViewSet(viewsets.ModelViewSet):
 class AlertNotificationViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = AlertNotification.objects.select_related('alert', 'channel')
     serializer_class = AlertNotificationSerializer
+    pagination_class = NotificationCursorPagination
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['alert', 'channel', 'status']
+    filterset_fields = ['alert', 'digest', 'channel', 'status']
     ordering = ['-sent_at']
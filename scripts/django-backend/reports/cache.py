@@ -0,0 +1,184 @@
+"""
+Content-addressed cache of generated report files.
+
+A report over a range that ended at least REPORT_CACHE_SETTLE_SECONDS ago
+gets a cache_key hashing everything that determines its output (type,
+resolved sensor set, rivers, range, parameters, the engine's
+TEMPLATE_VERSION and a watermark of the stored data in the range) and its
+file is stored as reports/<cache_key>.pdf. Later requests with the same
+key reuse the file, or wait for the report already generating it, without
+running a task. Late, edited or recalibrated readings change the
+watermark, so they are never answered from an older file.
+
+A report waiting on a twin that has not finished after
+REPORT_MAX_RUNTIME_MINUTES (its worker died) is queued on its own by
+requeue_stalled_reports. Files are evicted least recently used first once
+MEDIA_ROOT/reports exceeds REPORT_CACHE_MAX_BYTES.
+"""
+import hashlib
+import json
+import logging
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from alerts.models import Alert
+from sensors.models import SensorReading, SensorReadingRollup
+from sensors.rollups import RESOLUTION_STEPS, floor_bucket, get_checkpoint
+from .engine import TEMPLATE_VERSION, report_sensors
+from .models import Report
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DIR = 'reports'
+
+def is_cacheable(report):
+    """Only ranges fully in the past (and settled) always produce the same output"""
+    settled = timezone.now() - timedelta(seconds=settings.REPORT_CACHE_SETTLE_SECONDS)
+    return report.end_date <= settled
+
+def data_watermark(sensor_ids, start, end):
+    """
+    Fingerprint of the data a report over [start, end) reads, in three
+    aggregate queries: reading count and metric total over the whole hours
+    covering the range (hourly rollups plus readings not rolled up yet, so
+    a rollup run does not change it) and the range's alerts
+    """
+    hour = RESOLUTION_STEPS['1h']
+    first = floor_bucket(start, hour)
+    last = floor_bucket(end - timedelta(microseconds=1), hour) + hour
+    rollups = SensorReadingRollup.objects.filter(
+        sensor_id__in=sensor_ids, resolution='1h', bucket_start__gte=first, bucket_start__lt=last
+    ).aggregate(count=Sum('count'), total=Sum(F('water_level_sum') + F('temperature_sum') + F('flow_rate_sum')))
+    recent = SensorReading.objects.filter(
+        id__gt=get_checkpoint().last_reading_id, sensor_id__in=sensor_ids, timestamp__gte=first, timestamp__lt=last
+    ).aggregate(count=Count('id'), total=Sum(F('water_level') + F('temperature') + F('flow_rate')))
+    alerts = Alert.objects.filter(
+        sensor_id__in=sensor_ids, created_at__gte=start, created_at__lt=end
+    ).aggregate(count=Count('id'), last=Max('id'))
+    return [
+        (rollups['count'] or 0) + recent['count'],
+        round((rollups['total'] or 0) + (recent['total'] or 0), 6),
+        alerts['count'],
+        alerts['last'],
+    ]
+
+def report_cache_key(report):
+    sensor_ids = list(report_sensors(report).values_list('pk', flat=True))
+    payload = {
+        'version': TEMPLATE_VERSION,
+        'type': report.report_type,
+        'sensors': sorted(str(pk) for pk in sensor_ids),
+        'rivers': sorted(report.rivers.values_list('pk', flat=True)),
+        # In UTC, a report fresh from a request still has local datetimes
+        'start': report.start_date.astimezone(dt_timezone.utc).isoformat(),
+        'end': report.end_date.astimezone(dt_timezone.utc).isoformat(),
+        'parameters': report.parameters,
+        'data': data_watermark(sensor_ids, report.start_date, report.end_date),
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+def touch(*reports):
+    Report.objects.filter(pk__in=[report.pk for report in reports]).update(last_accessed_at=timezone.now())
+
+def resolve_from_cache(report):
+    """
+    Set the report's cache_key and serve it from the cache if possible.
+    Returns True when no generation task is needed: the report is either
+    completed from a cached file or waits for an identical one in progress.
+    """
+    if not is_cacheable(report):
+        return False
+
+    report.cache_key = report_cache_key(report)
+    same_key = Report.objects.filter(cache_key=report.cache_key).exclude(pk=report.pk)
+
+    cached = same_key.filter(status='completed').exclude(file_path='').order_by('-completed_at').first()
+    if cached is not None and default_storage.exists(cached.file_path.name):
+        now = timezone.now()
+        report.file_path = cached.file_path.name
+        report.status = 'completed'
+        report.completed_at = now
+        report.last_accessed_at = now
+        report.save()
+        touch(cached)
+        return True
+
+    # Twins past REPORT_MAX_RUNTIME_MINUTES are presumed dead
+    in_progress = same_key.filter(status__in=['pending', 'generating'], created_at__gte=stalled_before()).exists()
+    report.save(update_fields=['cache_key'])
+    return in_progress
+
+def stalled_before():
+    return timezone.now() - timedelta(minutes=settings.REPORT_MAX_RUNTIME_MINUTES)
+
+def requeue_stalled_reports():
+    """
+    Fail reports unfinished after REPORT_MAX_RUNTIME_MINUTES and queue the
+    oldest report still waiting on each of them. Returns the queued reports.
+    """
+    from .tasks import generate_report
+
+    stalled = Report.objects.filter(status__in=['pending', 'generating'], created_at__lt=stalled_before())
+    cache_keys = set(stalled.exclude(cache_key='').values_list('cache_key', flat=True))
+    stalled.update(status='failed', error_message='Report generation timed out')
+
+    queued = []
+    for cache_key in cache_keys:
+        waiting = Report.objects.filter(cache_key=cache_key, status='pending').order_by('created_at').first()
+        if waiting is not None:
+            generate_report.delay(waiting.id)
+            queued.append(waiting)
+    return queued
+
+def complete_waiting_reports(report):
+    """Give reports waiting on the same cache_key the outcome of this one"""
+    if not report.cache_key:
+        return
+    waiting = Report.objects.filter(cache_key=report.cache_key, status='pending').exclude(pk=report.pk)
+    if report.status == 'completed':
+        waiting.update(file_path=report.file_path.name, status='completed',
+                       completed_at=report.completed_at, last_accessed_at=report.completed_at)
+    else:
+        waiting.update(status='failed', error_message=report.error_message)
+
+def enforce_size_limit(max_bytes=None):
+    """Delete report files least recently used first until the directory fits in max_bytes"""
+    max_bytes = settings.REPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not default_storage.exists(REPORTS_DIR):
+        return []
+
+    _, filenames = default_storage.listdir(REPORTS_DIR)
+    sizes = {f"{REPORTS_DIR}/{filename}": default_storage.size(f"{REPORTS_DIR}/{filename}")
+             for filename in filenames}
+    total = sum(sizes.values())
+    if total <= max_bytes:
+        return []
+
+    last_used = dict(
+        Report.objects.filter(file_path__in=list(sizes))
+        .order_by()
+        .values('file_path')
+        .annotate(last=Max(Coalesce('last_accessed_at', 'completed_at', 'created_at')))
+        .values_list('file_path', 'last')
+    )
+    # Files no report points to go first
+    oldest_first = sorted(sizes, key=lambda name: (name in last_used, last_used.get(name) or 0))
+
+    evicted = []
+    for name in oldest_first:
+        if total <= max_bytes:
+            break
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning('Could not delete report file %s', name, exc_info=True)
+            continue
+        total -= sizes[name]
+        evicted.append(name)
+
+    Report.objects.filter(file_path__in=evicted).update(file_path='', status='expired')
+    return evicted
@@ -0,0 +1,272 @@
+"""
+Report engine.
+
+Reports are built in two steps. The data step aggregates readings per
+sensor and per hour or local day on the database side (from rollups, with
+raw readings only where no rollup exists yet), so the work and the memory
+used depend on the number of sensors and periods, not readings. It runs
+either at once (compute_report_data) or split into per-sensor, per-time
+chunks (report_chunks / compute_chunk) whose partial aggregates are merged
+exactly by assemble_report_data. render_report_pdf() then lays the
+aggregates out with reportlab platypus into a paginated PDF written to a
+temporary file, which generate_report_file() saves under MEDIA_ROOT
+through the storage API.
+"""
+import tempfile
+from collections import Counter
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.core.files import File
+from django.db.models import Count
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import CondPageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from alerts.models import Alert
+from sensors.models import Sensor
+from sensors.rollups import Aggregate, iter_hourly_aggregates
+
+# Bump whenever the computed data or the layout changes, so cached report
+# files (see cache.py) are not reused across versions
+TEMPLATE_VERSION = 1
+
+# Period of the per-sensor tables for each report type
+REPORT_INTERVALS = {
+    'daily': 'hour',
+    'incident': 'hour',
+    'weekly': 'day',
+    'monthly': 'day',
+}
+
+PERIOD_FORMATS = {
+    'hour': '%d/%m/%Y %H:%M',
+    'day': '%d/%m/%Y',
+}
+
+class SensorSection:
+    """Aggregates of one sensor: whole range, per period and alert counts"""
+
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.summary = Aggregate()
+        self.periods = {}
+        self.alerts = Counter()
+
+    def add(self, period, aggregate):
+        self.summary.merge(aggregate)
+        self.periods.setdefault(period, Aggregate()).merge(aggregate)
+
+class ReportData:
+    def __init__(self, report, interval, sections):
+        self.report = report
+        self.interval = interval
+        self.sections = sections
+
+    @property
+    def total_readings(self):
+        return sum(section.summary.count for section in self.sections)
+
+def report_sensors(report):
+    """Selected sensors, else the sensors of the selected rivers, else all active sensors"""
+    sensors = report.sensors.all()
+    if not sensors.exists():
+        if report.rivers.exists():
+            sensors = Sensor.objects.filter(river__in=report.rivers.all())
+        else:
+            sensors = Sensor.objects.filter(status='active')
+    return sensors.select_related('river').order_by('river__name', 'name')
+
+def report_interval(report):
+    interval = report.parameters.get('interval') or REPORT_INTERVALS.get(report.report_type)
+    if interval not in PERIOD_FORMATS:
+        interval = 'hour' if report.end_date - report.start_date <= timedelta(days=2) else 'day'
+    return interval
+
+def period_key(hour_start, interval):
+    local = timezone.localtime(hour_start)
+    return local if interval == 'hour' else local.date()
+
+def add_alert_counts(report, sections):
+    """Count the range's alerts per sensor and severity into sections (keyed by sensor pk)"""
+    alert_counts = Alert.objects.filter(
+        sensor_id__in=list(sections),
+        created_at__gte=report.start_date,
+        created_at__lt=report.end_date
+    ).order_by().values('sensor_id', 'severity').annotate(count=Count('id'))
+    for row in alert_counts:
+        sections[row['sensor_id']].alerts[row['severity']] = row['count']
+
+def compute_report_data(report):
+    """All of a report's data in one pass (two aggregate queries)"""
+    interval = report_interval(report)
+    sections = {sensor.pk: SensorSection(sensor) for sensor in report_sensors(report)}
+
+    for sensor_id, hour_start, aggregate in iter_hourly_aggregates(
+        list(sections), report.start_date, report.end_date
+    ):
+        sections[sensor_id].add(period_key(hour_start, interval), aggregate)
+
+    add_alert_counts(report, sections)
+    return ReportData(report, interval, list(sections.values()))
+
+def report_chunks(report, sensors):
+    """(sensor_id, start, end) work units covering the range in REPORT_CHUNK_DAYS pieces"""
+    step = timedelta(days=settings.REPORT_CHUNK_DAYS)
+    chunks = []
+    for sensor in sensors:
+        chunk_start = report.start_date
+        while chunk_start < report.end_date:
+            chunk_end = min(chunk_start + step, report.end_date)
+            chunks.append((sensor.pk, chunk_start, chunk_end))
+            chunk_start = chunk_end
+    return chunks
+
+def compute_chunk(sensor_id, start, end, interval):
+    """Per-period aggregates of one sensor over [start, end) as {period: Aggregate}"""
+    periods = {}
+    for _, hour_start, aggregate in iter_hourly_aggregates([sensor_id], start, end):
+        periods.setdefault(period_key(hour_start, interval), Aggregate()).merge(aggregate)
+    return periods
+
+def encode_periods(periods):
+    """JSON-serializable form of compute_chunk's result"""
+    return [[period.isoformat(), aggregate.to_fields()] for period, aggregate in periods.items()]
+
+def decode_periods(encoded, interval):
+    parse = datetime.fromisoformat if interval == 'hour' else date.fromisoformat
+    return {parse(period): Aggregate.from_values(fields) for period, fields in encoded}
+
+def assemble_report_data(report, interval, partials):
+    """Merge (sensor_id, {period: Aggregate}) partial results into ReportData"""
+    sections = {sensor.pk: SensorSection(sensor) for sensor in report_sensors(report)}
+    by_id = {str(pk): section for pk, section in sections.items()}
+
+    for sensor_id, periods in partials:
+        section = by_id[str(sensor_id)]
+        for period, aggregate in periods.items():
+            section.add(period, aggregate)
+
+    add_alert_counts(report, sections)
+    return ReportData(report, interval, list(sections.values()))
+
+def _number(value, digits=2):
+    return '-' if value is None else f"{value:.{digits}f}"
+
+def _metric_columns(aggregate):
+    return [
+        _number(aggregate.mean('water_level')),
+        _number(aggregate.mins['water_level']),
+        _number(aggregate.maxs['water_level']),
+        _number(aggregate.mean('temperature'), 1),
+        _number(aggregate.mean('flow_rate')),
+    ]
+
+METRIC_HEADERS = ['Nivel prom. (m)', 'Nivel mín.', 'Nivel máx.', 'Temp. prom. (°C)', 'Caudal prom. (m³/s)']
+
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1f4e79')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f2f2f2')]),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+])
+
+def _table(rows, col_widths=None):
+    # Header row is repeated on every page the table spans
+    table = Table(rows, colWidths=col_widths, repeatRows=1)
+    table.setStyle(TABLE_STYLE)
+    return table
+
+def _draw_footer(canvas, doc):
+    canvas.saveState()
+    canvas.setFont('Helvetica', 8)
+    canvas.drawString(doc.leftMargin, 1 * cm, doc.title)
+    canvas.drawRightString(doc.pagesize[0] - doc.rightMargin, 1 * cm, f"Página {doc.page}")
+    canvas.restoreState()
+
+def build_story(data):
+    styles = getSampleStyleSheet()
+    report = data.report
+    start = timezone.localtime(report.start_date)
+    end = timezone.localtime(report.end_date)
+
+    story = [
+        Paragraph(f"{report.get_report_type_display()} - {report.title}", styles['Title']),
+        Paragraph(
+            f"Periodo: {start:%d/%m/%Y %H:%M} - {end:%d/%m/%Y %H:%M} · "
+            f"{len(data.sections)} sensores · {data.total_readings} lecturas",
+            styles['Normal']
+        ),
+        Spacer(1, 0.5 * cm),
+        Paragraph("Resumen por sensor", styles['Heading2']),
+    ]
+
+    summary_rows = [['Sensor', 'Río', 'Lecturas', *METRIC_HEADERS, 'Alertas']]
+    for section in data.sections:
+        summary_rows.append([
+            section.sensor.name,
+            section.sensor.river.name,
+            section.summary.count,
+            *_metric_columns(section.summary),
+            sum(section.alerts.values()),
+        ])
+    story.append(_table(summary_rows))
+
+    alert_rows = [['Sensor', 'Crítico', 'Advertencia', 'Información']]
+    alert_rows += [
+        [section.sensor.name, section.alerts['critical'], section.alerts['warning'], section.alerts['info']]
+        for section in data.sections if section.alerts
+    ]
+    if len(alert_rows) > 1:
+        story += [Spacer(1, 0.5 * cm), Paragraph("Alertas del periodo", styles['Heading2']), _table(alert_rows)]
+
+    period_format = PERIOD_FORMATS[data.interval]
+    period_header = 'Hora' if data.interval == 'hour' else 'Día'
+    for section in data.sections:
+        story += [
+            CondPageBreak(4 * cm),
+            Paragraph(f"{section.sensor.name} ({section.sensor.sensor_code}) - {section.sensor.river.name}",
+                      styles['Heading3']),
+        ]
+        if not section.periods:
+            story.append(Paragraph("Sin lecturas en el periodo.", styles['Normal']))
+            continue
+        rows = [[period_header, 'Lecturas', *METRIC_HEADERS]]
+        for period in sorted(section.periods):
+            aggregate = section.periods[period]
+            rows.append([period.strftime(period_format), aggregate.count, *_metric_columns(aggregate)])
+        story.append(_table(rows))
+
+    return story
+
+def render_report_pdf(data, output):
+    """Render report data as a PDF into output (a path or a binary file object)"""
+    doc = SimpleDocTemplate(
+        output,
+        pagesize=letter,
+        title=data.report.title,
+        leftMargin=1.5 * cm,
+        rightMargin=1.5 * cm,
+        topMargin=1.5 * cm,
+        bottomMargin=1.8 * cm,
+    )
+    doc.build(build_story(data), onFirstPage=_draw_footer, onLaterPages=_draw_footer)
+
+def report_filename(report):
+    if report.cache_key:
+        return f"{report.cache_key}.pdf"
+    return f"{report.report_type}_report_{report.id}_{timezone.now():%Y%m%d%H%M%S}.pdf"
+
+def generate_report_file(report, data=None):
+    """Render a report (computing its data unless given), store the PDF in report.file_path (not saved)"""
+    if data is None:
+        data = compute_report_data(report)
+    with tempfile.TemporaryFile() as output:
+        render_report_pdf(data, output)
+        output.seek(0)
+        report.file_path.save(report_filename(report), File(output), save=False)
+    return report.file_path.name
@@ -1,3 +1,4 @@
+from datetime import time
 from django.db import models
 from django.contrib.auth import get_user_model
 from sensors.models import Sensor, River
@@ -19,6 +20,7 @@ class Report(models.Model):
         ('generating', 'Generando'),
         ('completed', 'Completado'),
         ('failed', 'Fallido'),
+        ('expired', 'Expirado'),
     ]
 
     title = models.CharField(max_length=200)
@@ -34,6 +36,16 @@ class Report(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True)
+    # Hash of everything that determines the output, set for reports over
+    # ranges in the past so identical requests can share the file
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+    template = models.ForeignKey('ReportTemplate', on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='reports', help_text="Template that scheduled this report")
+    # Generation progress: percent complete and computed chunks out of total
+    progress = models.PositiveSmallIntegerField(default=0)
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_done = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
@@ -43,11 +55,25 @@ class Report(models.Model):
 
 class ReportTemplate(models.Model):
     """Model for report templates"""
+    SCHEDULE_CHOICES = [
+        ('', 'Sin programar'),
+        ('daily', 'Diario'),
+        ('weekly', 'Semanal (lunes)'),
+        ('monthly', 'Mensual (día 1)'),
+    ]
+
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     report_type = models.CharField(max_length=20, choices=Report.REPORT_TYPES)
-    template_config = models.JSONField(help_text="Template configuration")
+    template_config = models.JSONField(
+        help_text="Template configuration: sensors, rivers (ids) and parameters of the generated reports"
+    )
     is_active = models.BooleanField(default=True)
+    # Scheduled templates generate the report of the previous day/week/month at run_at (local time)
+    schedule = models.CharField(max_length=20, choices=SCHEDULE_CHOICES, blank=True, default='')
+    run_at = models.TimeField(default=time(3, 0))
+    next_run_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,119 @@
+"""
+Scheduled reports from ReportTemplate.
+
+A template with a schedule produces, at its local run_at time, the report
+of the previous day, week (Monday to Monday) or calendar month. The
+run_scheduled_reports beat task creates the due reports and queues them
+staggered by REPORT_STAGGER_SECONDS, never letting more than
+REPORT_MAX_CONCURRENT_JOBS reports generate at once; templates beyond the
+cap stay due and are picked up by a later run. Runs default to 03:00 so
+reports are ready before operators arrive. Reports that are already in the
+cache (see cache.py) cost no worker time.
+
+Runs missed while the scheduler was down are backfilled one period per
+template and check, oldest first; runs older than REPORT_BACKFILL_DAYS are
+skipped.
+"""
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.utils import timezone
+from .cache import resolve_from_cache
+from .models import Report, ReportTemplate
+
+SCHEDULE_TITLES = {
+    'daily': '%d/%m/%Y',
+    'weekly': 'semana del %d/%m/%Y',
+    'monthly': '%m/%Y',
+}
+
+def _local_datetime(day, at):
+    return datetime.combine(day, at, tzinfo=timezone.get_current_timezone())
+
+def _runs_on(schedule, day):
+    if schedule == 'weekly':
+        return day.weekday() == 0
+    if schedule == 'monthly':
+        return day.day == 1
+    return True
+
+def next_run_time(schedule, run_at, after):
+    """First run of the schedule strictly after `after`"""
+    day = timezone.localtime(after).date()
+    while True:
+        candidate = _local_datetime(day, run_at)
+        if candidate > after and _runs_on(schedule, day):
+            return candidate
+        day += timedelta(days=1)
+
+def report_period(schedule, run_time):
+    """Last complete local day, week or month before run_time"""
+    today = timezone.localtime(run_time).date()
+    if schedule == 'weekly':
+        end = today - timedelta(days=today.weekday())
+        start = end - timedelta(days=7)
+    elif schedule == 'monthly':
+        end = today.replace(day=1)
+        start = (end - timedelta(days=1)).replace(day=1)
+    else:
+        end = today
+        start = end - timedelta(days=1)
+    return _local_datetime(start, time.min), _local_datetime(end, time.min)
+
+def jobs_in_flight():
+    """Scheduled reports generating now (stuck ones stop counting after REPORT_MAX_RUNTIME_MINUTES)"""
+    recent = timezone.now() - timedelta(minutes=settings.REPORT_MAX_RUNTIME_MINUTES)
+    return Report.objects.filter(
+        template__isnull=False, status__in=['pending', 'generating'], created_at__gte=recent
+    ).count()
+
+def create_scheduled_report(template, run_time):
+    start, end = report_period(template.schedule, run_time)
+    config = template.template_config or {}
+
+    report = Report.objects.create(
+        title=f"{template.name} - {timezone.localtime(start).strftime(SCHEDULE_TITLES[template.schedule])}",
+        report_type=template.report_type,
+        created_by=template.created_by,
+        template=template,
+        start_date=start,
+        end_date=end,
+        parameters=config.get('parameters', {}),
+    )
+    report.sensors.set(config.get('sensors', []))
+    report.rivers.set(config.get('rivers', []))
+    return report
+
+def run_due_templates(now=None):
+    """Create and queue the reports of due templates, returns the reports created"""
+    from .tasks import generate_report
+
+    now = now or timezone.now()
+    templates = ReportTemplate.objects.filter(is_active=True).exclude(schedule='')
+
+    # Newly scheduled templates only get their first run time
+    for template in templates.filter(next_run_at__isnull=True):
+        template.next_run_at = next_run_time(template.schedule, template.run_at, now)
+        template.save(update_fields=['next_run_at'])
+
+    available = settings.REPORT_MAX_CONCURRENT_JOBS - jobs_in_flight()
+    created = []
+    queued = 0
+    for template in templates.filter(next_run_at__lte=now).select_related('created_by').order_by('next_run_at'):
+        if queued >= available:
+            # Concurrency cap reached, the remaining templates stay due for the next run
+            break
+
+        report = create_scheduled_report(template, template.next_run_at)
+        if not resolve_from_cache(report):
+            generate_report.apply_async((report.id,), countdown=queued * settings.REPORT_STAGGER_SECONDS)
+            queued += 1
+
+        template.last_run_at = now
+        # The next period, not the next one after now, so missed runs are backfilled
+        backfill_from = now - timedelta(days=settings.REPORT_BACKFILL_DAYS)
+        template.next_run_at = next_run_time(template.schedule, template.run_at,
+                                             max(template.next_run_at, backfill_from))
+        template.save(update_fields=['last_run_at', 'next_run_at'])
+        created.append(report)
+
+    return created
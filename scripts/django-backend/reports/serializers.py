@@ -1,7 +1,10 @@
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Report, ReportTemplate
+from .schedule import next_run_time
+from river_monitoring.metrics import TimedSerializerMixin
 
-class ReportSerializer(serializers.ModelSerializer):
+class ReportSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     created_by_name = serializers.CharField(source='created_by.get_full_name', read_only=True)
     sensor_names = serializers.StringRelatedField(source='sensors', many=True, read_only=True)
     river_names = serializers.StringRelatedField(source='rivers', many=True, read_only=True)
@@ -11,9 +14,9 @@ class ReportSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'report_type', 'status', 'created_by', 
                  'created_by_name', 'sensors', 'sensor_names', 'rivers', 
                  'river_names', 'start_date', 'end_date', 'parameters',
-                 'file_path', 'created_at', 'completed_at', 'error_message']
+                 'file_path', 'progress', 'created_at', 'completed_at', 'error_message']
 
-class ReportCreateSerializer(serializers.ModelSerializer):
+class ReportCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Report
         fields = ['title', 'report_type', 'sensors', 'rivers', 
@@ -23,10 +26,22 @@ class ReportCreateSerializer(serializers.ModelSerializer):
         validated_data['created_by'] = self.context['request'].user
         return super().create(validated_data)
 
-class ReportTemplateSerializer(serializers.ModelSerializer):
+class ReportTemplateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     created_by_name = serializers.CharField(source='created_by.get_full_name', read_only=True)
 
     class Meta:
         model = ReportTemplate
         fields = ['id', 'name', 'description', 'report_type', 'template_config',
-                 'is_active', 'created_by', 'created_by_name', 'created_at', 'updated_at']
+                 'is_active', 'schedule', 'run_at', 'next_run_at', 'last_run_at',
+                 'created_by', 'created_by_name', 'created_at', 'updated_at']
+        read_only_fields = ['next_run_at', 'last_run_at']
+
+    def save(self, **kwargs):
+        # Reschedule from now whenever the schedule may have changed
+        template = super().save(**kwargs)
+        if template.schedule:
+            template.next_run_at = next_run_time(template.schedule, template.run_at, timezone.now())
+        else:
+            template.next_run_at = None
+        template.save(update_fields=['next_run_at'])
+        return template
@@ -1,89 +1,115 @@
-from celery import shared_task
+from datetime import datetime
+from celery import chord, shared_task
+from django.db.models import F
 from django.utils import timezone
-from django.template.loader import render_to_string
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from io import BytesIO
-import os
+from .cache import complete_waiting_reports, enforce_size_limit, requeue_stalled_reports
+from .engine import (
+    assemble_report_data, compute_chunk, decode_periods, encode_periods,
+    generate_report_file, report_chunks, report_interval, report_sensors
+)
 from .models import Report
-from sensors.models import SensorReading
+
+# Progress reached once every chunk is computed, rendering takes the rest
+COMPUTED_PROGRESS = 95
 
 @shared_task
 def generate_report(report_id):
-    """Generate a report file"""
+    """
+    Generate a report file: a chord of per-sensor, per-time-chunk
+    compute_report_chunk tasks merged and rendered by render_report
+    """
+    # Claim the report so one queued twice is still generated once
+    if not Report.objects.filter(id=report_id, status='pending').update(status='generating'):
+        return f"Report {report_id} not found or already generating"
+    report = Report.objects.get(id=report_id)
+
     try:
-        report = Report.objects.get(id=report_id)
+        interval = report_interval(report)
+        chunks = report_chunks(report, report_sensors(report))
+
         report.status = 'generating'
+        report.progress = 0
+        report.chunks_total = len(chunks)
+        report.chunks_done = 0
         report.save()
-        
-        # Generate report based on type
-        if report.report_type == 'daily':
-            file_path = generate_daily_report(report)
-        elif report.report_type == 'weekly':
-            file_path = generate_weekly_report(report)
-        elif report.report_type == 'monthly':
-            file_path = generate_monthly_report(report)
+
+        callback = render_report.s(report_id, interval).on_error(report_generation_failed.s(report_id))
+        if not chunks:
+            callback.delay([])
         else:
-            file_path = generate_custom_report(report)
-        
-        report.file_path = file_path
+            chord(
+                compute_report_chunk.s(report_id, str(sensor_id), start.isoformat(), end.isoformat(), interval)
+                for sensor_id, start, end in chunks
+            )(callback)
+
+        return f"Report {report_id} split into {len(chunks)} chunks"
+
+    except Exception as e:
+        fail_report(report, str(e))
+        return f"Report {report_id} generation failed: {str(e)}"
+
+@shared_task
+def compute_report_chunk(report_id, sensor_id, start, end, interval):
+    """Partial aggregates of one sensor over one time chunk"""
+    periods = compute_chunk(sensor_id, datetime.fromisoformat(start), datetime.fromisoformat(end), interval)
+
+    Report.objects.filter(id=report_id).update(
+        chunks_done=F('chunks_done') + 1,
+        progress=(F('chunks_done') + 1) * COMPUTED_PROGRESS / F('chunks_total')
+    )
+    return sensor_id, encode_periods(periods)
+
+@shared_task
+def render_report(partials, report_id, interval):
+    """Merge the chunk results and render the report file"""
+    report = Report.objects.get(id=report_id)
+
+    try:
+        data = assemble_report_data(
+            report, interval,
+            ((sensor_id, decode_periods(encoded, interval)) for sensor_id, encoded in partials)
+        )
+        generate_report_file(report, data)
+
         report.status = 'completed'
+        report.progress = 100
         report.completed_at = timezone.now()
+        report.last_accessed_at = report.completed_at
         report.save()
-        
+        complete_waiting_reports(report)
+        enforce_size_limit()
+
         return f"Report {report_id} generated successfully"
-        
+
     except Exception as e:
-        report.status = 'failed'
-        report.error_message = str(e)
-        report.save()
+        fail_report(report, str(e))
         return f"Report {report_id} generation failed: {str(e)}"
 
-def generate_daily_report(report):
-    """Generate daily report"""
-    # Get sensor readings for the specified date range
-    readings = SensorReading.objects.filter(
-        sensor__in=report.sensors.all(),
-        timestamp__range=[report.start_date, report.end_date]
-    ).select_related('sensor', 'sensor__river')
-    
-    # Create PDF
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    
-    # Add content to PDF
-    p.drawString(100, 750, f"Reporte Diario - {report.title}")
-    p.drawString(100, 730, f"Fecha: {report.start_date.strftime('%d/%m/%Y')}")
-    
-    y_position = 700
-    for reading in readings[:20]:  # Limit to first 20 readings
-        text = f"{reading.sensor.name}: {reading.water_level}m, {reading.temperature}°C"
-        p.drawString(100, y_position, text)
-        y_position -= 20
-    
-    p.showPage()
-    p.save()
-    
-    # Save file
-    filename = f"daily_report_{report.id}_{timezone.now().strftime('%Y%m%d')}.pdf"
-    file_path = os.path.join('reports', filename)
-    
-    with open(file_path, 'wb') as f:
-        f.write(buffer.getvalue())
+@shared_task
+def report_generation_failed(request, exc, traceback, report_id):
+    """Error callback of the chord, a chunk task failed"""
+    report = Report.objects.filter(id=report_id).first()
+    if report is not None:
+        fail_report(report, str(exc))
+
+def fail_report(report, error):
+    report.status = 'failed'
+    report.error_message = error
+    report.save()
+    complete_waiting_reports(report)
+
+@shared_task
+def run_scheduled_reports():
+    """
+    Create and queue the reports of due scheduled templates (run periodically)
+    """
+    from .schedule import run_due_templates
     
-    return file_path
-
-def generate_weekly_report(report):
-    """Generate weekly report"""
-    # Similar implementation for weekly reports
-    return generate_daily_report(report)  # Placeholder
-
-def generate_monthly_report(report):
-    """Generate monthly report"""
-    # Similar implementation for monthly reports
-    return generate_daily_report(report)  # Placeholder
-
-def generate_custom_report(report):
-    """Generate custom report"""
-    # Custom report generation based on parameters
-    return generate_daily_report(report)  # Placeholder
+    reports = run_due_templates()
+    return f"Scheduled {len(reports)} reports"
+
+@shared_task
+def requeue_stalled_report_jobs():
+    """Time out stuck reports and queue the ones waiting on them (run periodically)"""
+    reports = requeue_stalled_reports()
+    return f"Requeued {len(reports)} reports"
@@ -5,6 +5,7 @@ from django_filters.rest_framework import DjangoFilterBackend
 from django.http import FileResponse
 from .models import Report, ReportTemplate
 from .serializers import ReportSerializer, ReportCreateSerializer, ReportTemplateSerializer
+from .cache import resolve_from_cache, touch
 from .tasks import generate_report
 
 class ReportViewSet(viewsets.ModelViewSet):
@@ -23,8 +24,9 @@ class ReportViewSet(viewsets.ModelViewSet):
         if serializer.is_valid():
             report = serializer.save()
             
-            # Start report generation task
-            generate_report.delay(report.id)
+            # Identical reports over past ranges are served from the cache
+            if not resolve_from_cache(report):
+                generate_report.delay(report.id)
             
             return Response(
                 ReportSerializer(report).data, 
@@ -43,6 +45,7 @@ class ReportViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        touch(report)
         return FileResponse(
             report.file_path.open('rb'),
             as_attachment=True,
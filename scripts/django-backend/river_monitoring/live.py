@@ -0,0 +1,262 @@
+"""
+Live event fan-out for dashboards (Server-Sent Events).
+
+New readings and alert state changes are published to a broker and pushed
+to every subscribed client whose river/sensor filter matches. The default
+LocalBroker keeps subscribers in process memory, which is enough for a
+single web process; set LIVE_BROKER_URL to a Redis URL to fan out across
+processes with Redis pub/sub.
+
+Each open stream holds a web worker thread, so a process serves at most
+LIVE_MAX_STREAMS of them, and every stream ends after LIVE_STREAM_MAX_SECONDS;
+EventSource clients reconnect on their own after the advertised retry delay.
+"""
+import json
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF views negotiate text/event-stream (errors are sent as an error event)"""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event({'type': 'error', 'data': data})
+
+class EventFilter:
+    """Matches events by river and/or sensor; an empty filter matches everything"""
+
+    def __init__(self, rivers=None, sensors=None):
+        self.rivers = {str(river) for river in rivers or []}
+        self.sensors = {str(sensor) for sensor in sensors or []}
+
+    def matches(self, event):
+        if not self.rivers and not self.sensors:
+            return True
+        return str(event.get('river')) in self.rivers or str(event.get('sensor')) in self.sensors
+
+class LocalSubscription:
+    def __init__(self, broker, event_filter):
+        self.broker = broker
+        self.filter = event_filter
+        self.queue = queue.Queue(maxsize=settings.LIVE_SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow consumers lose events instead of blocking publishers
+            self.dropped += 1
+
+    def get(self, timeout):
+        """Next matching event, or None after timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class LocalBroker:
+    """In-process pub/sub standing in for Redis"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, rivers=None, sensors=None):
+        subscription = LocalSubscription(self, EventFilter(rivers, sensors))
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def publish(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        if not subscriptions:
+            return
+        for event in events:
+            for subscription in subscriptions:
+                if subscription.filter.matches(event):
+                    subscription.offer(event)
+
+class RedisSubscription:
+    def __init__(self, pubsub, event_filter):
+        self.pubsub = pubsub
+        self.filter = event_filter
+
+    def get(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is None:
+                continue
+            event = json.loads(message['data'])
+            if self.filter.matches(event):
+                return event
+
+    def close(self):
+        self.pubsub.close()
+
+class RedisBroker:
+    """Pub/sub over a Redis channel, shared by all web and worker processes"""
+    CHANNEL = 'river_monitoring:live'
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def subscribe(self, rivers=None, sensors=None):
+        pubsub = self.client.pubsub()
+        pubsub.subscribe(self.CHANNEL)
+        return RedisSubscription(pubsub, EventFilter(rivers, sensors))
+
+    def has_subscribers(self):
+        # Subscribers may live in other processes
+        return True
+
+    def publish(self, events):
+        pipeline = self.client.pipeline(transaction=False)
+        for event in events:
+            pipeline.publish(self.CHANNEL, json.dumps(event, cls=DjangoJSONEncoder))
+        pipeline.execute()
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                url = settings.LIVE_BROKER_URL
+                _broker = RedisBroker(url) if url else LocalBroker()
+    return _broker
+
+def publish_readings(readings):
+    """Publish newly ingested readings (sensor must be loaded on each reading)"""
+    from sensors.serializers import SensorReadingSerializer
+
+    broker = get_broker()
+    if not broker.has_subscribers():
+        return
+
+    events = []
+    for reading in readings:
+        data = SensorReadingSerializer(reading).data
+        data['sensor'] = reading.sensor_id
+        events.append({
+            'type': 'reading',
+            'river': reading.sensor.river_id,
+            'sensor': reading.sensor_id,
+            'data': data,
+        })
+    broker.publish(events)
+
+def publish_alert(alert, change):
+    """Publish an alert state change ('created', 'acknowledged', 'resolved')"""
+    from alerts.serializers import AlertSerializer
+
+    broker = get_broker()
+    if not broker.has_subscribers():
+        return
+
+    broker.publish([{
+        'type': 'alert',
+        'change': change,
+        'river': alert.sensor.river_id,
+        'sensor': alert.sensor_id,
+        'data': AlertSerializer(alert).data,
+    }])
+
+def format_event(event):
+    """Encode an event as a Server-Sent Events message"""
+    payload = json.dumps(event, cls=DjangoJSONEncoder)
+    return f"event: {event['type']}\ndata: {payload}\n\n"
+
+def event_stream(rivers=None, sensors=None):
+    """
+    Generator for StreamingHttpResponse, sends a comment line as keep-alive
+    and returns after LIVE_STREAM_MAX_SECONDS so the client reconnects.
+    Subscribes on first iteration so abandoned responses never leak a subscription.
+    """
+    # Streams can stay open for minutes, don't hold a database connection meanwhile
+    connections.close_all()
+    deadline = time.monotonic() + settings.LIVE_STREAM_MAX_SECONDS
+    subscription = get_broker().subscribe(rivers=rivers, sensors=sensors)
+    try:
+        yield f"retry: {settings.LIVE_RETRY_MILLISECONDS}\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            event = subscription.get(timeout=min(settings.LIVE_HEARTBEAT_SECONDS, remaining))
+            if event is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield format_event(event)
+    finally:
+        subscription.close()
+
+class StreamSlots:
+    """Counts the streams open in this process against LIVE_MAX_STREAMS"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+
+    def acquire(self):
+        with self._lock:
+            if self.open >= settings.LIVE_MAX_STREAMS:
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+stream_slots = StreamSlots()
+
+class LiveStream:
+    """
+    Response body over event_stream holding one of the process's stream
+    slots, released when the response is closed even if it never started
+    """
+
+    def __init__(self, rivers=None, sensors=None):
+        self._events = event_stream(rivers=rivers, sensors=sensors)
+        self._closed = False
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._events.close()
+            stream_slots.release()
+
+def open_stream(rivers=None, sensors=None):
+    """LiveStream for a new client, None if this process is at LIVE_MAX_STREAMS"""
+    if not stream_slots.acquire():
+        return None
+    return LiveStream(rivers=rivers, sensors=sensors)
@@ -0,0 +1,352 @@
+"""
+Performance metrics in the Prometheus text format, served on /metrics.
+
+RequestMetricsMiddleware records, per view and action, the wall time,
+number of database queries, database time, serializer time (serializers
+using TimedSerializerMixin) and response size of every request. Celery
+task durations and queue lag (time from publish, or from the ETA of
+delayed tasks, to start) are recorded by the workers for
+METRICS_CELERY_TASKS. Both go into histograms kept as counters in the
+shared cache, so whichever web process serves a scrape reports the
+observations of all web processes and workers; with the default
+per-process LocMemCache each process only reports its own, set CACHE_URL
+to a Redis URL when running several. Observations are added up in memory
+and written to the cache every METRICS_FLUSH_INTERVAL seconds, keeping
+cache round trips off the request path. The alert evaluation consumer and
+notification backlog are exported as gauges.
+
+/metrics requires METRICS_TOKEN as a Bearer token, without a token it is
+only served with DEBUG on.
+"""
+import bisect
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from celery import signals as celery_signals
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from django.urls import URLPattern, URLResolver, get_resolver
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+TASK_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+def _format_number(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_histogram(name, help_text, buckets, series):
+    """Text lines of a histogram from {label tuples: (per-bucket counts incl. +Inf, sum)}"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, (counts, total) in sorted(series.items()):
+        cumulative = 0
+        for bound, count in zip((*buckets, '+Inf'), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels((*labels, ('le', bound)))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return lines
+
+def render_gauge(name, help_text, samples):
+    """Text lines of a gauge from [(label tuples, value)]"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines += [f"{name}{_format_labels(labels)} {_format_number(value)}" for labels, value in samples]
+    return lines
+
+class CounterBuffer:
+    """
+    Increments of shared cache counters, added up in this process and
+    written every METRICS_FLUSH_INTERVAL seconds
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._flushed_at = time.monotonic()
+
+    def add(self, increments):
+        with self._lock:
+            self._pending.update(increments)
+            due = time.monotonic() - self._flushed_at >= settings.METRICS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = time.monotonic()
+        for key, delta in pending.items():
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                # Another process may create the counter between both calls
+                if not cache.add(key, delta, None):
+                    cache.incr(key, delta)
+
+counter_buffer = CounterBuffer()
+
+class SharedHistogram:
+    """
+    Histogram kept in the shared cache (one counter per label set and
+    bucket), so every process sees the observations of the others. Label
+    values must be known in advance to be rendered. The cache only
+    increments integers, sums are kept in 1/sum_scale units. Observations
+    reach the cache when counter_buffer is flushed.
+    """
+
+    def __init__(self, name, help_text, labelnames, buckets, sum_scale=1_000_000):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.sum_scale = sum_scale
+
+    def _key(self, labelvalues, part):
+        return f"metrics:{self.name}:{':'.join(labelvalues)}:{part}"
+
+    def increments(self, value, *labelvalues):
+        """{cache key: increment} recording one observation"""
+        return {
+            self._key(labelvalues, bisect.bisect_left(self.buckets, value)): 1,
+            self._key(labelvalues, 'sum'): round(value * self.sum_scale),
+        }
+
+    def observe(self, value, *labelvalues):
+        counter_buffer.add(self.increments(value, *labelvalues))
+
+    def render(self, labelsets):
+        """Text lines for the given label value tuples, skipping the ones never observed"""
+        parts = [*range(len(self.buckets) + 1), 'sum']
+        keys = [self._key(labelvalues, part) for labelvalues in labelsets for part in parts]
+        stored = cache.get_many(keys)
+        series = {}
+        for labelvalues in labelsets:
+            values = [stored.get(self._key(labelvalues, part), 0) for part in parts]
+            if any(values):
+                series[tuple(zip(self.labelnames, labelvalues))] = (values[:-1], values[-1] / self.sum_scale)
+        return render_histogram(self.name, self.help_text, self.buckets, series)
+
+REQUEST_LABELS = ('view', 'action')
+
+request_duration = SharedHistogram(
+    'http_request_duration_seconds', 'Wall time of requests', REQUEST_LABELS, LATENCY_BUCKETS)
+request_queries = SharedHistogram(
+    'http_request_db_queries', 'Database queries per request', REQUEST_LABELS, QUERY_COUNT_BUCKETS, sum_scale=1)
+request_db_time = SharedHistogram(
+    'http_request_db_seconds', 'Database time per request', REQUEST_LABELS, LATENCY_BUCKETS)
+request_serializer_time = SharedHistogram(
+    'http_request_serializer_seconds', 'Serializer time per request', REQUEST_LABELS, LATENCY_BUCKETS)
+response_size = SharedHistogram(
+    'http_response_size_bytes', 'Size of non-streaming responses', REQUEST_LABELS, SIZE_BUCKETS, sum_scale=1)
+
+REQUEST_HISTOGRAMS = [request_duration, request_queries, request_db_time, request_serializer_time, response_size]
+
+TASK_LABELS = ('task',)
+
+task_duration = SharedHistogram('celery_task_duration_seconds', 'Run time of tasks', TASK_LABELS, TASK_BUCKETS)
+task_queue_lag = SharedHistogram(
+    'celery_task_queue_lag_seconds', 'Time tasks waited in the queue before starting', TASK_LABELS, TASK_BUCKETS)
+
+class RequestStats:
+    """Database and serializer time of the request running in this thread"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+_current = threading.local()
+
+def current_stats():
+    return getattr(_current, 'stats', None)
+
+class TimedSerializerMixin:
+    """
+    Adds the time a serializer spends building representations to the
+    current request's serializer time (outermost serializer only, nested
+    ones are part of it)
+    """
+
+    def to_representation(self, instance):
+        stats = current_stats()
+        if stats is None or stats.serializer_depth:
+            return super().to_representation(instance)
+        stats.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_time += time.perf_counter() - started
+            stats.serializer_depth -= 1
+
+def _url_callbacks(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _url_callbacks(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            yield pattern.callback
+
+@lru_cache(maxsize=None)
+def request_labelsets():
+    """Every (view, action) of the URLconf view_labels can produce, function views assumed GET/POST"""
+    labelsets = set()
+    for callback in _url_callbacks(get_resolver().url_patterns):
+        if callback is metrics_view:
+            continue
+        view_class = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None)
+        actions = getattr(callback, 'actions', None)
+        if actions:
+            methods = list(actions)
+        elif view_class is not None:
+            methods = [method for method in view_class.http_method_names if hasattr(view_class, method)]
+        else:
+            methods = ['get', 'post']
+        labelsets.update(view_labels(callback, method) for method in methods)
+    return sorted(labelsets)
+
+def view_labels(view_func, method):
+    """(view, action) of a resolved view: the DRF action of viewsets, else the HTTP method"""
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    view = f"{view_class.__module__}.{view_class.__name__}" if view_class else \
+        f"{view_func.__module__}.{view_func.__name__}"
+    actions = getattr(view_func, 'actions', None) or {}
+    return view, actions.get(method.lower(), method.lower())
+
+class RequestMetricsMiddleware:
+    """Record per-view request metrics (see module docstring)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        _current.stats = stats
+        request.metrics_labels = None
+
+        def count_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats.queries += 1
+                stats.db_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_query):
+                response = self.get_response(request)
+        finally:
+            _current.stats = None
+        elapsed = time.perf_counter() - started
+
+        labels = request.metrics_labels
+        if labels is not None:
+            increments = Counter()
+            increments.update(request_duration.increments(elapsed, *labels))
+            increments.update(request_queries.increments(stats.queries, *labels))
+            increments.update(request_db_time.increments(stats.db_time, *labels))
+            increments.update(request_serializer_time.increments(stats.serializer_time, *labels))
+            if not response.streaming:
+                increments.update(response_size.increments(len(response.content), *labels))
+            counter_buffer.add(increments)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if view_func is not metrics_view:
+            request.metrics_labels = view_labels(view_func, request.method)
+
+_task_started = {}
+
+@celery_signals.before_task_publish.connect
+def _stamp_published_at(sender=None, headers=None, **kwargs):
+    if headers is not None and sender in settings.METRICS_CELERY_TASKS:
+        headers['published_at'] = time.time()
+
+def _published_at(request):
+    published_at = getattr(request, 'published_at', None) or (request.headers or {}).get('published_at')
+    if published_at is None:
+        return None
+    if request.eta:
+        # Delayed tasks (countdown/eta) only start queueing at their ETA
+        eta = request.eta if isinstance(request.eta, datetime) else datetime.fromisoformat(request.eta)
+        published_at = max(published_at, eta.timestamp())
+    return published_at
+
+@celery_signals.task_prerun.connect
+def _task_prerun(sender=None, task_id=None, task=None, **kwargs):
+    if task is None or task.name not in settings.METRICS_CELERY_TASKS:
+        return
+    _task_started[task_id] = time.perf_counter()
+    published_at = _published_at(task.request)
+    if published_at is not None:
+        task_queue_lag.observe(max(time.time() - published_at, 0.0), task.name)
+
+@celery_signals.task_postrun.connect
+def _task_postrun(sender=None, task_id=None, task=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        task_duration.observe(time.perf_counter() - started, task.name)
+
+@celery_signals.worker_process_shutdown.connect
+@celery_signals.worker_shutdown.connect
+def _flush_on_shutdown(**kwargs):
+    counter_buffer.flush()
+
+def evaluation_gauges():
+    from alerts.consumer import evaluation_metrics
+
+    values = evaluation_metrics()
+    mode = values.pop('mode')
+    return render_gauge(
+        'alert_evaluation', 'Alert evaluation consumer state by metric',
+        [((('mode', mode), ('metric', name)), value) for name, value in sorted(values.items())
+         if isinstance(value, (int, float))]
+    )
+
+def notification_gauges():
+    from django.db.models import Count
+    from alerts.models import AlertNotification
+
+    counts = dict(AlertNotification.objects.order_by().values_list('status').annotate(count=Count('id')))
+    return render_gauge(
+        'alert_notifications', 'Alert notifications by delivery status',
+        [((('status', status),), counts.get(status, 0)) for status, _ in AlertNotification.STATUS_CHOICES]
+    )
+
+def render_metrics():
+    # Other processes' observations may be up to METRICS_FLUSH_INTERVAL old
+    counter_buffer.flush()
+    lines = []
+    labelsets = request_labelsets()
+    for histogram in REQUEST_HISTOGRAMS:
+        lines += histogram.render(labelsets)
+    tasks = [(task,) for task in sorted(settings.METRICS_CELERY_TASKS)]
+    lines += task_duration.render(tasks)
+    lines += task_queue_lag.render(tasks)
+    lines += evaluation_gauges()
+    lines += notification_gauges()
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, protected by METRICS_TOKEN (open without one only with DEBUG)"""
+    if not settings.METRICS_TOKEN:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
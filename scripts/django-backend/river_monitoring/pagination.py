@@ -0,0 +1,26 @@
+"""
+Keyset (cursor) pagination for the large time-ordered tables.
+
+Unlike PageNumberPagination these never run COUNT(*) or OFFSET scans: each
+page is a range query on an indexed column, so deep pages cost the same as
+the first one. Cursors are opaque and there is no total count. Orderings end
+with the primary key, so rows sharing a timestamp keep a stable order
+across pages.
+"""
+from rest_framework.pagination import CursorPagination
+
+class KeysetPagination(CursorPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+class ReadingCursorPagination(KeysetPagination):
+    """Uses the (sensor, -timestamp, -id) and (-timestamp, -id) indexes"""
+    ordering = ('-timestamp', '-id')
+
+class AlertCursorPagination(KeysetPagination):
+    """Uses the (sensor, -created_at, -id) index"""
+    ordering = ('-created_at', '-id')
+
+class NotificationCursorPagination(KeysetPagination):
+    """sent_at is nullable, so notifications are keyed on the primary key"""
+    ordering = '-id'
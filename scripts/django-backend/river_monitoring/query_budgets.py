@@ -0,0 +1,199 @@
+"""
+Query budgets of the API endpoints.
+
+Every endpoint in ENDPOINTS has a fixed number of SQL queries one request
+issues at most, whatever the number of rows. river_monitoring/tests.py
+checks them at two data volumes, so `manage.py test` catches both extra
+queries and N+1 patterns. check_query_budgets (sensors
+management command) seeds realistic volumes and records the query counts
+and latency percentiles of every endpoint in a JSON baseline that later
+runs compare against.
+"""
+import time
+import numpy as np
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import connection
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+from alerts.models import Alert, AlertNotification, AlertRule, NotificationChannel
+from reports.models import Report, ReportTemplate
+from users.models import UserSession
+from sensors.models import River, Sensor, SensorReading
+from sensors.rollups import update_rollups
+
+class Endpoint:
+    def __init__(self, name, url_name, max_queries, detail=None, params=None, known_issue=None):
+        self.name = name
+        self.url_name = url_name
+        self.max_queries = max_queries
+        # Known problem: violations are reported but do not fail the check
+        self.known_issue = known_issue
+        # Kind of object ('sensor', 'river', 'alert', 'report') the URL needs
+        self.detail = detail
+        # Query parameters, or a function of the measured objects returning them
+        self.params = params or {}
+
+    def url(self, objects):
+        kwargs = {'pk': objects[self.detail]} if self.detail else {}
+        return reverse(self.url_name, kwargs=kwargs)
+
+    def query(self, objects):
+        return self.params(objects) if callable(self.params) else self.params
+
+ENDPOINTS = [
+    Endpoint('rivers list', 'river-list', 2),
+    Endpoint('river detail', 'river-detail', 1, detail='river'),
+    Endpoint('rivers summary', 'river-summary', 4),
+    Endpoint('sensors list', 'sensor-list', 2),
+    Endpoint('sensor detail', 'sensor-detail', 1, detail='sensor'),
+    Endpoint('sensor readings', 'sensor-readings', 2, detail='sensor'),
+    Endpoint('sensor series', 'sensor-series', 3, detail='sensor', params={'points': 500}),
+    Endpoint('sensor statistics', 'sensor-statistics', 4, detail='sensor'),
+    Endpoint('dashboard summary', 'sensor-dashboard-summary', 2),
+    Endpoint('readings list', 'sensorreading-list', 1),
+    Endpoint('readings latest', 'sensorreading-latest', 1),
+    Endpoint('readings export', 'sensorreading-export', 3,
+             params=lambda objects: {'file_format': 'csv', 'river': objects['river']}),
+    Endpoint('calibrations list', 'sensorcalibration-list', 1),
+    Endpoint('alerts list', 'alert-list', 1),
+    Endpoint('alert detail', 'alert-detail', 1, detail='alert'),
+    Endpoint('alerts active', 'alert-active', 1),
+    Endpoint('alerts summary', 'alert-summary', 2),
+    Endpoint('alert rules list', 'alertrule-list', 2),
+    Endpoint('channels list', 'notificationchannel-list', 2),
+    Endpoint('notifications list', 'alertnotification-list', 1),
+    Endpoint('reports list', 'report-list', 4),
+    Endpoint('report detail', 'report-detail', 3, detail='report'),
+    Endpoint('report templates list', 'reporttemplate-list', 2),
+    Endpoint('users list', 'user-list', 2),
+    Endpoint('users me', 'user-me', 1),
+    Endpoint('user sessions list', 'usersession-list', 2),
+]
+
+SEVERITIES = ['info', 'warning', 'critical']
+
+def seed_dataset(user, sensors, readings_per_sensor, alerts, seed=0):
+    """
+    Grow the database to at least the given number of sensors, readings per
+    sensor and alerts (one river per 5 sensors, a reading every 5 minutes
+    up to now). Returns the objects detail endpoints are measured on.
+    """
+    rng = np.random.default_rng(seed)
+    now = timezone.now()
+    step = timedelta(minutes=5)
+
+    for index in range(Sensor.objects.count(), sensors):
+        river, _ = River.objects.get_or_create(
+            name=f"Río {index // 5 + 1}", defaults={'latitude': -39.27, 'longitude': -71.97}
+        )
+        Sensor.objects.create(
+            name=f"Sensor {index + 1}", sensor_code=f"QB-{index + 1:03d}", river=river,
+            latitude=-39.27, longitude=-71.97, installation_date=now.date(), max_level=5
+        )
+
+    for sensor in Sensor.objects.all():
+        existing = sensor.readings.count()
+        missing = readings_per_sensor - existing
+        if missing <= 0:
+            continue
+        levels = 1.5 + np.cumsum(rng.normal(0, 0.01, missing))
+        first = now - step * readings_per_sensor
+        SensorReading.objects.bulk_create(
+            (
+                SensorReading(
+                    sensor=sensor, water_level=float(level), temperature=12.0, flow_rate=float(level * 8),
+                    battery_level=90.0, signal_strength=-70, timestamp=first + step * offset
+                )
+                for offset, level in enumerate(levels)
+            ),
+            batch_size=5000
+        )
+    update_rollups(batch_size=10 ** 9)
+
+    sensor_ids = list(Sensor.objects.values_list('pk', flat=True))
+    missing = alerts - Alert.objects.count()
+    if missing > 0:
+        created = Alert.objects.bulk_create(
+            Alert(
+                sensor_id=sensor_ids[index % len(sensor_ids)], severity=SEVERITIES[index % 3],
+                status='active' if index % 4 else 'resolved', title=f"Alerta {index}", message='Nivel alto'
+            )
+            for index in range(missing)
+        )
+        channel, _ = NotificationChannel.objects.get_or_create(
+            name='Operaciones', channel_type='email', defaults={'configuration': {'recipients': ['ops@example.com']}}
+        )
+        AlertNotification.objects.bulk_create(
+            AlertNotification(alert=alert, channel=channel, recipient='ops@example.com', status='sent', sent_at=now)
+            for alert in created
+        )
+        AlertRule.objects.get_or_create(
+            name='Nivel alto', defaults={'metric': 'water_level', 'condition': 'greater_than',
+                                         'threshold_value': 4, 'severity': 'warning'}
+        )
+
+    for index in range(Report.objects.count(), max(sensors // 2, 1)):
+        report = Report.objects.create(
+            title=f"Reporte {index}", report_type='daily', created_by=user, status='completed',
+            start_date=now - timedelta(days=1), end_date=now
+        )
+        report.sensors.set(sensor_ids[:3])
+    if not ReportTemplate.objects.exists():
+        ReportTemplate.objects.create(name='Diario', report_type='daily', created_by=user, template_config={})
+    for index in range(user.sessions.count(), 3):
+        UserSession.objects.create(user=user, session_key=f"query-budget-{index}", ip_address='127.0.0.1',
+                                   user_agent='check_query_budgets')
+
+    return {
+        'sensor': sensor_ids[0],
+        'river': River.objects.values_list('pk', flat=True).first(),
+        'alert': Alert.objects.values_list('pk', flat=True).first(),
+        'report': Report.objects.values_list('pk', flat=True).first(),
+    }
+
+def available_endpoints():
+    """Endpoints whose URL is installed"""
+    endpoints = []
+    for endpoint in ENDPOINTS:
+        try:
+            reverse(endpoint.url_name, kwargs={'pk': 1} if endpoint.detail else {})
+        except NoReverseMatch:
+            continue
+        endpoints.append(endpoint)
+    return endpoints
+
+def request_endpoint(client, endpoint, objects):
+    """GET an endpoint, consuming streamed responses"""
+    response = client.get(endpoint.url(objects), endpoint.query(objects))
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+def measure(client, endpoint, objects, repeat):
+    """
+    (status, query count, [latency seconds]) of an endpoint. Caches are
+    cleared before every request so the uncached path is measured.
+    """
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    cache.clear()
+    with connection.execute_wrapper(count_query):
+        response = request_endpoint(client, endpoint, objects)
+
+    latencies = []
+    for _ in range(repeat):
+        cache.clear()
+        started = time.perf_counter()
+        request_endpoint(client, endpoint, objects)
+        latencies.append(time.perf_counter() - started)
+    return response.status_code, len(queries), latencies
+
+def percentiles(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2)}
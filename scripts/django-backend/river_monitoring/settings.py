@@ -5,6 +5,7 @@ Django settings for river_monitoring project.
 from pathlib import Path
 import os
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -36,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'river_monitoring.metrics.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -66,13 +68,68 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'river_monitoring.wsgi.application'
 
-# Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Database profile: 'sqlite' (single node, tuned for concurrent writers) or
+# 'postgres' (persistent connections, optionally behind PgBouncer)
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'postgres':
+    # 'pgbouncer' for a transaction-pooling PgBouncer in front of PostgreSQL
+    DB_POOLER = os.environ.get('DB_POOLER', '')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'river_monitoring'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '6432' if DB_POOLER == 'pgbouncer' else '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),  # Seconds, reuse connections across requests
+            'CONN_HEALTH_CHECKS': True,
+            # Server-side cursors (iterator()) do not survive transaction pooling
+            'DISABLE_SERVER_SIDE_CURSORS': DB_POOLER == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
     }
-}
+elif DB_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'river_monitoring.sqlite',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': 20,  # Seconds a writer waits for the lock (busy timeout)
+            },
+            'PRAGMAS': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -20000,  # KiB
+                'temp_store': 'MEMORY',
+            },
+            'TRANSACTION_MODE': 'IMMEDIATE',
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown DB_PROFILE {DB_PROFILE!r}, use 'sqlite' or 'postgres'")
+
+# Cache (shared between workers when CACHE_URL points at Redis)
+CACHE_URL = os.environ.get('CACHE_URL')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+AUTH_USER_MODEL = 'users.User'
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -140,10 +197,11 @@ CORS_ALLOWED_ORIGINS = [
 CORS_ALLOW_CREDENTIALS = True
 
 # Email configuration (for alerts)
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True') == 'True'
+EMAIL_TIMEOUT = 10
 EMAIL_HOST_USER = 'your-email@gmail.com'
 EMAIL_HOST_PASSWORD = 'your-app-password'
 
@@ -163,3 +221,128 @@ ALERT_THRESHOLDS = {
     'TEMPERATURE_MAX': 25,
     'FLOW_RATE_MAX': 100,
 }
+
+# Sensor reading ingestion
+READING_BULK_MAX_SIZE = 10000  # Max readings per bulk request
+READING_BULK_INSERT_BATCH_SIZE = 1000  # Rows per INSERT statement
+
+# Sensor calibrations, applied to water levels at write time (see sensors/calibration.py)
+CALIBRATION_CHECK_INTERVAL = 5  # Seconds between checks for calibration changes made by other processes
+CALIBRATION_RECALIBRATE_DELAY = 15  # Seconds before stored readings are re-corrected after a change
+
+# Reading rollups (5-minute, hourly and daily aggregates)
+ROLLUP_BATCH_SIZE = 200000  # Max new readings folded per task run
+ROLLUP_ID_LOOKBACK = 1000  # Re-check recent ids in case of late commits
+ROLLUP_COMMIT_SIZE = 20000  # Readings folded per transaction, bounds how long the write lock is held
+
+CELERY_BEAT_SCHEDULE = {
+    'update-reading-rollups': {
+        'task': 'sensors.tasks.update_reading_rollups',
+        'schedule': 60.0,
+    },
+}
+
+# Downsampled chart series
+SERIES_MAX_POINTS = 5000
+
+# Streaming reading export
+EXPORT_CHUNK_SIZE = 5000  # Rows fetched and encoded per chunk
+
+# Dashboard summary
+DASHBOARD_SUMMARY_CACHE_TTL = 5  # Seconds, also invalidated on ingest
+RIVER_SUMMARY_CACHE_TTL = 30  # Seconds per river, also invalidated on ingest
+
+# Live updates (Server-Sent Events), in-process broker unless a Redis URL is set
+LIVE_BROKER_URL = os.environ.get('LIVE_BROKER_URL')
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_SUBSCRIBER_QUEUE_SIZE = 1000  # Events buffered per client before dropping
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', 50))  # Open streams per web process
+LIVE_STREAM_MAX_SECONDS = 300  # Streams end after this, clients reconnect
+LIVE_RETRY_MILLISECONDS = 5000  # Reconnect delay advertised to clients
+
+# Alert evaluation: 'sync' (in the ingest request), 'worker' (in-process
+# background thread) or 'celery' (evaluate_readings task)
+ALERT_EVALUATION_MODE = os.environ.get('ALERT_EVALUATION_MODE', 'sync')
+ALERT_EVALUATION_BATCH_SIZE = 500  # Max readings per micro-batch
+ALERT_EVALUATION_MAX_WAIT = 0.5  # Seconds to wait for a micro-batch to fill
+ALERT_RULES_CHECK_INTERVAL = 5  # Seconds between checks for rule changes made by other processes
+
+# Window-based alert rules (in-memory per-sensor history)
+RAPID_CHANGE_MINUTES = 5  # rapid_change compares against the value this long before
+ALERT_HISTORY_WINDOW_MINUTES = 60
+ALERT_HISTORY_MAX_POINTS = 4096  # Per sensor and metric
+
+# Alert notification delivery
+NOTIFICATION_MAX_WORKERS = 8  # Delivery jobs running at once per process
+NOTIFICATION_HTTP_POOL_SIZE = 10  # Keep-alive connections per webhook host
+NOTIFICATION_CHANNEL_CONCURRENCY = 4  # Parallel webhook jobs per channel
+NOTIFICATION_WEBHOOK_TIMEOUT = (3.05, 5)  # Connect and read timeouts in seconds
+
+# Notification retries and per-channel guards (overridable in a channel's configuration)
+NOTIFICATION_MAX_ATTEMPTS = 6
+NOTIFICATION_RETRY_BASE_SECONDS = 30  # Doubled after every failed attempt
+NOTIFICATION_RETRY_MAX_SECONDS = 3600
+NOTIFICATION_RETRY_BATCH_SIZE = 500  # Due notifications retried per task run
+NOTIFICATION_RETRY_LEASE_SECONDS = 300
+NOTIFICATION_RATE_PER_MINUTE = 120
+NOTIFICATION_RATE_BURST = 30
+NOTIFICATION_CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures before the circuit opens
+NOTIFICATION_CIRCUIT_RESET_SECONDS = 60
+
+CELERY_BEAT_SCHEDULE['retry-alert-notifications'] = {
+    'task': 'alerts.tasks.retry_notifications',
+    'schedule': 30.0,
+}
+
+# Alert coalescing: non-critical alerts are notified as one digest per window
+ALERT_DIGEST_WINDOW_SECONDS = 300  # 0 notifies every alert immediately
+
+if ALERT_DIGEST_WINDOW_SECONDS:
+    CELERY_BEAT_SCHEDULE['send-alert-digests'] = {
+        'task': 'alerts.tasks.send_alert_digests',
+        'schedule': float(ALERT_DIGEST_WINDOW_SECONDS),
+    }
+
+# Report file cache (MEDIA_ROOT/reports)
+REPORT_CACHE_MAX_BYTES = 500 * 1024 * 1024  # Least recently used files are deleted beyond this
+REPORT_CACHE_SETTLE_SECONDS = 600  # Ranges must have ended this long ago to be cached
+
+# Parallel report generation: one subtask per sensor and chunk of this many days
+REPORT_CHUNK_DAYS = 7
+
+# Scheduled reports (ReportTemplate.schedule)
+REPORT_SCHEDULE_CHECK_SECONDS = 300
+REPORT_MAX_CONCURRENT_JOBS = 2  # Reports generating at once, further due templates wait
+REPORT_STAGGER_SECONDS = 120  # Delay between reports queued in the same run
+REPORT_MAX_RUNTIME_MINUTES = 60  # Older unfinished reports are timed out and no longer count against the cap
+REPORT_BACKFILL_DAYS = 31  # Missed scheduled runs older than this are skipped
+
+CELERY_BEAT_SCHEDULE['run-scheduled-reports'] = {
+    'task': 'reports.tasks.run_scheduled_reports',
+    'schedule': float(REPORT_SCHEDULE_CHECK_SECONDS),
+}
+CELERY_BEAT_SCHEDULE['requeue-stalled-reports'] = {
+    'task': 'reports.tasks.requeue_stalled_report_jobs',
+    'schedule': float(REPORT_SCHEDULE_CHECK_SECONDS),
+}
+
+# Raw reading retention: older months are compacted into rollups and moved
+# to archive files under MEDIA_ROOT/archives (see sensors/archive.py)
+READING_RETENTION_DAYS = int(os.environ.get('READING_RETENTION_DAYS', 180))
+
+CELERY_BEAT_SCHEDULE['archive-old-readings'] = {
+    'task': 'sensors.tasks.archive_old_readings',
+    'schedule': 24 * 60 * 60.0,
+}
+
+# Prometheus metrics on /metrics (see river_monitoring/metrics.py)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # Required as a Bearer token, without one /metrics is only served with DEBUG
+METRICS_FLUSH_INTERVAL = 10  # Seconds observations are added up in memory before being written to the cache
+METRICS_CELERY_TASKS = [  # Tasks whose duration and queue lag are recorded
+    'alerts.tasks.send_alert_notification',
+    'alerts.tasks.send_alert_notifications',
+    'alerts.tasks.evaluate_readings',
+    'reports.tasks.generate_report',
+    'reports.tasks.compute_report_chunk',
+    'reports.tasks.render_report',
+]
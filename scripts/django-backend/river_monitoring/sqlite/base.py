@@ -0,0 +1,23 @@
+"""
+SQLite backend tuned for single-node installs with concurrent writers.
+
+Every new connection applies the PRAGMAS of its DATABASES entry (WAL
+journal so reads no longer wait for writes, synchronous=NORMAL, memory map,
+busy timeout), and transactions start with BEGIN <TRANSACTION_MODE>
+(IMMEDIATE by default): a writer takes the write lock up front and waits
+for it up to the busy timeout, instead of failing with "database is
+locked" when a deferred transaction tries to upgrade its read lock.
+"""
+from django.db.backends.sqlite3 import base
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in self.settings_dict.get('PRAGMAS', {}).items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict.get('TRANSACTION_MODE') or ''
+        self.cursor().execute(f"BEGIN {mode}".strip())
@@ -0,0 +1,43 @@
+"""
+Query budgets of the API endpoints (see river_monitoring/query_budgets.py)
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from .query_budgets import available_endpoints, request_endpoint, seed_dataset
+
+class QueryBudgetTests(APITestCase):
+    """
+    No endpoint issues more queries than its budget, at two data volumes to
+    expose N+1 patterns. Needs AUTH_USER_MODEL = 'users.User' (settings.py).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            'query-budget', is_staff=True, is_superuser=True
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assert_within_budgets(self, objects):
+        for endpoint in available_endpoints():
+            if endpoint.known_issue:
+                continue
+            with self.subTest(endpoint=endpoint.name):
+                # Measure the uncached path
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = request_endpoint(self.client, endpoint, objects)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(len(queries), endpoint.max_queries,
+                                     '\n'.join(query['sql'] for query in queries.captured_queries))
+
+    def test_small_dataset(self):
+        self.assert_within_budgets(seed_dataset(self.user, sensors=3, readings_per_sensor=100, alerts=20))
+
+    def test_larger_dataset(self):
+        self.assert_within_budgets(seed_dataset(self.user, sensors=12, readings_per_sensor=500, alerts=100))
@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+class SensorsConfig(AppConfig):
+    name = 'sensors'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,315 @@
+"""
+Retention of raw sensor readings.
+
+Raw readings of UTC months that ended more than READING_RETENTION_DAYS ago
+are moved out of the SensorReading table, one month at a time:
+
+1. the month's rollups are rebuilt from its raw readings (compaction), so
+   statistics, reports and coarse charts keep working from rollups alone;
+2. the readings are written, sorted by sensor and time, to a compressed
+   columnar file under MEDIA_ROOT/archives (Parquet with zstd when pyarrow
+   is installed, NumPy .npz otherwise) recorded as a ReadingArchive;
+3. they are deleted from the table in the same transaction that records
+   the archive, so readers see them in exactly one place.
+
+Readings referenced by alerts, and readings the rollups have not folded in
+yet, stay in the table. Raw reads over old ranges (exports, chart series,
+rollup rebuilds) merge in archived_rows(), which returns the same tuples
+as the equivalent SensorReading query.
+"""
+import heapq
+import tempfile
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from operator import itemgetter
+import numpy as np
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+from .calibration import correct_levels
+from .models import ReadingArchive, Sensor, SensorLatestState, SensorReading
+from .rollups import get_checkpoint, rebuild_rollups
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet archives are optional, npz is used otherwise
+    pa = pq = None
+
+ARCHIVE_METRICS = ['water_level', 'temperature', 'flow_rate', 'battery_level', 'signal_strength']
+
+COLUMN_DTYPES = {
+    'id': np.int64,
+    'timestamp': np.int64,  # Microseconds since the epoch, UTC
+    'water_level': np.float64,
+    'temperature': np.float64,
+    'flow_rate': np.float64,
+    'battery_level': np.float64,
+    'signal_strength': np.int32,
+    'raw_water_level': np.float64,  # NaN while no calibration applies
+}
+
+# Stored alongside the metrics, absent from archives written before calibration
+ARCHIVE_COLUMNS = [*ARCHIVE_METRICS, 'raw_water_level']
+
+# Rows read per query while exporting, and deleted per query afterwards
+ARCHIVE_CHUNK_SIZE = 10000
+ARCHIVE_DELETE_BATCH_SIZE = 2000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+def month_start(moment):
+    return moment.astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(start):
+    return (start + timedelta(days=32)).replace(day=1)
+
+def retention_cutoff(now=None):
+    """Start of the oldest month whose raw readings are kept"""
+    now = now or timezone.now()
+    return month_start(now - timedelta(days=settings.READING_RETENTION_DAYS))
+
+def months_to_archive(before):
+    """Month starts (UTC) with readings in the table older than `before`"""
+    oldest = (SensorReading.objects.filter(timestamp__lt=before)
+              .order_by('timestamp').values_list('timestamp', flat=True).first())
+    months = []
+    if oldest is not None:
+        month = month_start(oldest)
+        while month < before:
+            months.append(month)
+            month = next_month(month)
+    return months
+
+def archived_until():
+    """End of the last archived month, None if nothing was archived"""
+    return ReadingArchive.objects.aggregate(end=Max('period_end'))['end']
+
+def movable_readings(period_start, period_end):
+    """Readings of the period that may leave the table: already rolled up and not referenced by alerts"""
+    return SensorReading.objects.filter(
+        timestamp__gte=period_start,
+        timestamp__lt=period_end,
+        id__lte=get_checkpoint().last_reading_id,
+        alert__isnull=True
+    )
+
+def _to_micros(moment):
+    return (moment - EPOCH) // MICROSECOND
+
+def _column_chunks(readings):
+    """Dicts of column arrays, ARCHIVE_CHUNK_SIZE readings each, ordered by sensor and time"""
+    rows = readings.order_by('sensor_id', 'timestamp').values_list(
+        'id', 'sensor_id', 'timestamp', *ARCHIVE_COLUMNS
+    )
+    chunk = []
+    for row in rows.iterator(chunk_size=ARCHIVE_CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) >= ARCHIVE_CHUNK_SIZE:
+            yield _columns(chunk)
+            chunk = []
+    if chunk:
+        yield _columns(chunk)
+
+def _columns(rows):
+    ids, sensor_ids, timestamps, *metrics = zip(*rows)
+    columns = {
+        'id': np.array(ids, dtype=COLUMN_DTYPES['id']),
+        'sensor_id': np.array([str(sensor_id) for sensor_id in sensor_ids]),
+        'timestamp': np.array([_to_micros(timestamp) for timestamp in timestamps],
+                              dtype=COLUMN_DTYPES['timestamp']),
+    }
+    for name, values in zip(ARCHIVE_COLUMNS, metrics):
+        columns[name] = np.array(values, dtype=COLUMN_DTYPES[name])
+    return columns
+
+def _write_parquet(chunks, output):
+    """One row group per chunk, returns the archived reading ids"""
+    writer = None
+    ids = []
+    for columns in chunks:
+        table = pa.table({
+            name: (pa.array(values).cast(pa.timestamp('us', tz='UTC')) if name == 'timestamp'
+                   else pa.array(values))
+            for name, values in columns.items()
+        })
+        if writer is None:
+            writer = pq.ParquetWriter(output, table.schema, compression='zstd')
+        writer.write_table(table)
+        ids.append(columns['id'])
+    if writer is not None:
+        writer.close()
+    return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+
+def _write_npz(chunks, output):
+    chunks = list(chunks)
+    if not chunks:
+        return np.empty(0, dtype=np.int64)
+    columns = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    np.savez_compressed(output, **columns)
+    return columns['id']
+
+def archive_format():
+    return 'parquet' if pq is not None else 'npz'
+
+WRITERS = {
+    'parquet': _write_parquet,
+    'npz': _write_npz,
+}
+
+def delete_readings(ids):
+    """Delete readings by id in batches, returns {sensor_id: readings deleted}"""
+    deleted = Counter()
+    for offset in range(0, len(ids), ARCHIVE_DELETE_BATCH_SIZE):
+        batch = SensorReading.objects.filter(id__in=ids[offset:offset + ARCHIVE_DELETE_BATCH_SIZE].tolist())
+        deleted.update(dict(batch.order_by().values_list('sensor_id').annotate(count=Count('id'))))
+        batch.delete()
+    return deleted
+
+def archive_month(period_start):
+    """
+    Compact, export and delete the readings of the UTC month starting at
+    period_start. Returns the ReadingArchive, or None if nothing was moved.
+    """
+    period_end = next_month(period_start)
+    readings = movable_readings(period_start, period_end)
+    # Months only holding readings referenced by alerts are left alone
+    sensors = list(Sensor.objects.filter(pk__in=readings.values('sensor_id')))
+    if not sensors:
+        return None
+
+    rebuild_rollups(sensors, period_start, period_end)
+
+    file_format = archive_format()
+    with tempfile.TemporaryFile() as output:
+        ids = WRITERS[file_format](_column_chunks(readings), output)
+        if not len(ids):
+            return None
+
+        archive = ReadingArchive(
+            period_start=period_start,
+            period_end=period_end,
+            file_format=file_format,
+            row_count=len(ids),
+            size_bytes=output.tell(),
+        )
+        output.seek(0)
+        archive.file.save(f"readings_{period_start:%Y_%m}.{file_format}", File(output), save=False)
+
+    try:
+        with transaction.atomic():
+            archive.save()
+            # reading_count counts the readings still in the table
+            for sensor_id, count in delete_readings(ids).items():
+                SensorLatestState.objects.filter(sensor_id=sensor_id).update(
+                    reading_count=F('reading_count') - count
+                )
+    except Exception:
+        archive.file.delete(save=False)
+        raise
+    return archive
+
+def archive_old_readings(before=None):
+    """Archive every month older than `before` (default: the retention cutoff), returns the archives"""
+    before = month_start(before) if before is not None else retention_cutoff()
+    archives = [archive_month(month) for month in months_to_archive(before)]
+    return [archive for archive in archives if archive is not None]
+
+def _load_columns(archive, names, sensor_ids, start, end):
+    with archive.file.open('rb') as source:
+        if archive.file_format == 'parquet':
+            table = pq.read_table(source, columns=names, filters=[
+                ('sensor_id', 'in', sensor_ids),
+                ('timestamp', '>=', start),
+                ('timestamp', '<', end),
+            ])
+            return {
+                name: (table[name].cast(pa.int64()) if name == 'timestamp' else table[name])
+                .to_numpy(zero_copy_only=False)
+                for name in names
+            }
+        with np.load(source) as npz:
+            return {name: npz[name] for name in names}
+
+def _load_all_columns(archive):
+    with archive.file.open('rb') as source:
+        if archive.file_format == 'parquet':
+            table = pq.read_table(source)
+            return {
+                name: (table[name].cast(pa.int64()) if name == 'timestamp' else table[name])
+                .to_numpy(zero_copy_only=False)
+                for name in table.column_names
+            }
+        with np.load(source) as npz:
+            return {name: npz[name] for name in npz.files}
+
+def recalibrate_archives(sensor_id, start, end, starts, factors):
+    """
+    Re-correct the archived water levels of a sensor in [start, end) (end
+    None meaning open) with the calibrations (starts, factors) of
+    calibration.build_index, rewriting the affected archive files
+    """
+    archives = ReadingArchive.objects.filter(period_end__gt=start)
+    if end is not None:
+        archives = archives.filter(period_start__lt=end)
+    starts = np.array([_to_micros(moment) for moment in starts], dtype=np.int64)
+
+    for archive in archives:
+        columns = _load_all_columns(archive)
+        timestamps = columns['timestamp']
+        mask = (columns['sensor_id'] == str(sensor_id)) & (timestamps >= _to_micros(start))
+        if end is not None:
+            mask &= timestamps < _to_micros(end)
+        if not mask.any():
+            continue
+
+        raw = columns.get('raw_water_level', np.full(len(timestamps), np.nan))
+        measured = np.where(np.isnan(raw), columns['water_level'], raw)
+        columns['water_level'] = columns['water_level'].copy()
+        columns['raw_water_level'] = raw.copy()
+        columns['water_level'][mask], columns['raw_water_level'][mask] = correct_levels(
+            timestamps[mask], measured[mask], starts, factors
+        )
+
+        previous = archive.file.name
+        with tempfile.TemporaryFile() as output:
+            WRITERS[archive.file_format]([columns], output)
+            archive.size_bytes = output.tell()
+            output.seek(0)
+            archive.file.save(f"readings_{archive.period_start:%Y_%m}.{archive.file_format}",
+                              File(output), save=False)
+        archive.save(update_fields=['file', 'size_bytes'])
+        archive.file.storage.delete(previous)
+
+def _archive_rows(archive, sensor_ids, start, end, fields):
+    columns = _load_columns(archive, ['sensor_id', 'timestamp', *fields], sensor_ids, start, end)
+    timestamps = columns['timestamp']
+    mask = (np.isin(columns['sensor_id'], sensor_ids)
+            & (timestamps >= _to_micros(start)) & (timestamps < _to_micros(end)))
+
+    sensor_column = columns['sensor_id'][mask].tolist()
+    parsed = {sensor_id: uuid.UUID(sensor_id) for sensor_id in set(sensor_column)}
+    return zip(
+        map(parsed.__getitem__, sensor_column),
+        (EPOCH + timedelta(microseconds=micros) for micros in timestamps[mask].tolist()),
+        *(columns[field][mask].tolist() for field in fields)
+    )
+
+def archived_rows(sensor_ids, start, end, fields=ARCHIVE_METRICS):
+    """
+    Iterator of the archived readings of the sensors in [start, end) as
+    (sensor_id, timestamp, *fields) tuples ordered by sensor and time,
+    empty when no archive overlaps the range
+    """
+    archives = list(ReadingArchive.objects.filter(period_start__lt=end, period_end__gt=start))
+    if not archives:
+        return iter(())
+    sensor_ids = [str(sensor_id) for sensor_id in sensor_ids]
+    return heapq.merge(
+        *(_archive_rows(archive, sensor_ids, start, end, fields) for archive in archives),
+        key=itemgetter(0, 1)
+    )
@@ -0,0 +1,18 @@
+"""
+Shared cache keys for sensor data derived from readings
+"""
+from django.core.cache import cache
+
+DASHBOARD_SUMMARY_CACHE_KEY = 'sensors:dashboard_summary'
+RIVER_SUMMARY_CACHE_KEY = 'sensors:river_summary:{}'
+
+def river_summary_cache_key(river_id):
+    return RIVER_SUMMARY_CACHE_KEY.format(river_id)
+
+def invalidate_river_summaries(river_ids):
+    cache.delete_many([river_summary_cache_key(river_id) for river_id in river_ids])
+
+def invalidate_reading_caches(readings):
+    """Drop cached summaries affected by newly ingested readings"""
+    cache.delete(DASHBOARD_SUMMARY_CACHE_KEY)
+    invalidate_river_summaries({reading.sensor.river_id for reading in readings})
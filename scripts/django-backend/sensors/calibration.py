@@ -0,0 +1,195 @@
+"""
+Calibration of water level readings.
+
+A SensorCalibration applies from its effective_from until the sensor's next
+calibration: water_level = measured * scale_factor + offset_adjustment.
+Corrections are applied once, when readings are written, and the measured
+value is kept in raw_water_level (NULL while no correction applies), so
+queries, rollups and exports read corrected values at no extra cost.
+
+- Ingest looks the factors up in an in-memory index of each sensor's
+  calibration start times, kept sorted for bisection. It is invalidated by
+  SensorCalibration signals in the process making the change; like the
+  compiled alert rules, other processes compare the calibration table's
+  row count and latest updated_at every CALIBRATION_CHECK_INTERVAL
+  seconds and rebuild when it changed.
+- When a calibration is added, moved or removed, the readings it governs
+  are re-corrected in bulk: one UPDATE per calibration interval in the
+  table and a vectorized rewrite of the archived months, then the affected
+  rollups and latest state are rebuilt. This runs after the other
+  processes noticed the change, so readings they stored with the old
+  factors meanwhile are corrected too.
+"""
+import threading
+import time
+from bisect import bisect_right
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Sensor, SensorCalibration, SensorReading
+
+IDENTITY = (1.0, 0.0)
+
+MICROSECOND = timedelta(microseconds=1)
+
+def build_index(calibrations):
+    """
+    {sensor_id: (starts, factors)} with effective_from datetimes in ascending
+    order and (scale_factor, offset_adjustment) of the calibration starting
+    at each; the latest recorded calibration wins on equal start times
+    """
+    index = {}
+    rows = calibrations.order_by('sensor_id', 'effective_from', 'calibration_date', 'id').values_list(
+        'sensor_id', 'effective_from', 'scale_factor', 'offset_adjustment'
+    )
+    for sensor_id, effective_from, scale_factor, offset_adjustment in rows:
+        starts, factors = index.setdefault(sensor_id, ([], []))
+        if starts and starts[-1] == effective_from:
+            factors[-1] = (scale_factor, offset_adjustment)
+        else:
+            starts.append(effective_from)
+            factors.append((scale_factor, offset_adjustment))
+    return index
+
+class CalibrationIndex:
+    """Per-sensor sorted calibration intervals used on the ingest path"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Replaced, never mutated in place
+        self._index = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        """Drop the index in this process, others notice through table_version"""
+        self._index = None
+
+    def table_version(self):
+        """Changes whenever a calibration is added, edited or deleted"""
+        version = SensorCalibration.objects.aggregate(count=Count('id'), updated=Max('updated_at'))
+        return version['count'], version['updated']
+
+    def refresh(self):
+        """
+        Rebuild the index if it was invalidated here, or if the table changed
+        (checked at most every CALIBRATION_CHECK_INTERVAL seconds)
+        """
+        index = self._index
+        now = time.monotonic()
+        if index is not None and now - self._checked_at < settings.CALIBRATION_CHECK_INTERVAL:
+            return index
+        version = self.table_version()
+        self._checked_at = now
+        if index is not None and version == self._version:
+            return index
+        with self._lock:
+            self._index = build_index(SensorCalibration.objects.all())
+            self._version = version
+            return self._index
+
+    def factors(self, sensor_id, timestamp):
+        """(scale_factor, offset_adjustment) in effect at timestamp, None if readings stay as measured"""
+        entry = (self._index or self.refresh()).get(sensor_id)
+        if entry is None:
+            return None
+        starts, factors = entry
+        position = bisect_right(starts, timestamp) - 1
+        if position < 0 or factors[position] == IDENTITY:
+            return None
+        return factors[position]
+
+    def apply(self, readings):
+        """Correct unsaved readings in place, call once per batch"""
+        self.refresh()
+        for reading in readings:
+            factors = self.factors(reading.sensor_id, reading.timestamp)
+            if factors is not None:
+                scale_factor, offset_adjustment = factors
+                reading.raw_water_level = reading.water_level
+                reading.water_level = reading.water_level * scale_factor + offset_adjustment
+
+calibration_index = CalibrationIndex()
+
+def correct_levels(timestamps, measured, starts, factors):
+    """
+    Vectorized correction of measured levels at the given timestamps (any
+    comparable NumPy values, sorted starts of the same kind). Returns
+    (water_level, raw_water_level) arrays, raw_water_level is NaN where no
+    correction applies.
+    """
+    position = np.searchsorted(np.asarray(starts), timestamps, side='right')
+    scales = np.array([IDENTITY[0], *(scale for scale, _ in factors)])[position]
+    offsets = np.array([IDENTITY[1], *(offset for _, offset in factors)])[position]
+    corrected = (scales != IDENTITY[0]) | (offsets != IDENTITY[1])
+    return measured * scales + offsets, np.where(corrected, measured, np.nan)
+
+def calibration_intervals(starts, factors, start, end):
+    """[(from, to, factors or None)] covering [start, end), end None meaning open"""
+    bounds = [None, *starts, None]
+    intervals = []
+    for lower, upper, interval_factors in zip(bounds, bounds[1:], [None, *factors]):
+        lower = start if lower is None else max(lower, start)
+        if upper is None or end is not None and end < upper:
+            upper = end
+        if upper is not None and lower >= upper:
+            continue
+        intervals.append((lower, upper, None if interval_factors == IDENTITY else interval_factors))
+    return intervals
+
+def recalibrate_readings(sensor_id, start, through=None):
+    """
+    Re-apply the calibrations of a sensor to its readings from `start` up to
+    the first calibration boundary after `through` (default: start), the
+    range a calibration changed at those times governs. Returns the number of
+    readings updated in the table.
+    """
+    from .archive import recalibrate_archives
+    from .ingest import rebuild_latest_state
+    from .rollups import rebuild_rollups
+    from .cache import invalidate_reading_caches, invalidate_river_summaries
+    from alerts.history import sensor_history
+
+    sensor = Sensor.objects.filter(pk=sensor_id).first()
+    if sensor is None:  # Calibrations deleted along with their sensor
+        return 0
+    starts, factors = build_index(sensor.calibrations.all()).get(sensor.pk, ([], []))
+    through = through or start
+    position = bisect_right(starts, through)
+    end = starts[position] if position < len(starts) else None
+
+    measured = Coalesce('raw_water_level', 'water_level')
+    updated = 0
+    with transaction.atomic():
+        for lower, upper, interval_factors in calibration_intervals(starts, factors, start, end):
+            readings = SensorReading.objects.filter(sensor=sensor, timestamp__gte=lower)
+            if upper is not None:
+                readings = readings.filter(timestamp__lt=upper)
+            if interval_factors is None:
+                updated += readings.filter(raw_water_level__isnull=False).update(
+                    water_level=F('raw_water_level'), raw_water_level=None
+                )
+            else:
+                scale_factor, offset_adjustment = interval_factors
+                updated += readings.update(
+                    raw_water_level=measured, water_level=measured * scale_factor + offset_adjustment
+                )
+
+    recalibrate_archives(sensor.pk, start, end, starts, factors)
+
+    # Rollups only need rebuilding up to the sensor's last reading
+    last = sensor.readings.filter(timestamp__gte=start).aggregate(last=Max('timestamp'))['last']
+    limit = last + MICROSECOND if last is not None else timezone.now()
+    rebuild_end = min(end, limit) if end is not None else limit
+    if rebuild_end > start:
+        rebuild_rollups([sensor], start, rebuild_end)
+    rebuild_latest_state([sensor])
+    # Cached reports over the range get new keys through their data watermark
+    invalidate_reading_caches([])
+    invalidate_river_summaries([sensor.river_id])
+    sensor_history.invalidate(sensor.pk)
+    return updated
@@ -0,0 +1,87 @@
+"""
+Downsampling of reading time series for chart rendering.
+
+Both methods take x (timestamps as epoch seconds) and y as NumPy arrays
+sorted by x, and return the indices of the points to keep.
+"""
+import numpy as np
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: keeps the point of each bucket that forms
+    the largest triangle with the previously kept point and the mean of the
+    next bucket, which preserves the visual shape (peaks included).
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket boundaries for the points between the fixed first and last ones
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    # Mean of every bucket, used as the third vertex of the triangle
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    avg_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    avg_x = np.append(avg_x[1:], x[-1])
+    avg_y = np.append(avg_y[1:], y[-1])
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        bx, by = x[start:end], y[start:end]
+        # Twice the triangle area, vectorized over the bucket
+        areas = np.abs(
+            (x[previous] - avg_x[bucket]) * (by - y[previous])
+            - (x[previous] - bx) * (avg_y[bucket] - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+
+    return indices
+
+def minmax(x, y, threshold):
+    """
+    Keep the first and last points plus the minimum and maximum of each of
+    ceil((threshold - 2) / 2) equal-count buckets of the points in between,
+    only the more extreme of both in the last bucket for odd thresholds:
+    exactly min(threshold, len(x)) points.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # n > threshold leaves at least 2 points per bucket
+    interior = y[1:n - 1]
+    picks = threshold - 2
+    buckets = -(-picks // 2)
+    edges = np.linspace(0, n - 2, buckets + 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # Buckets padded to the largest one, padding never selected
+    positions = starts[:, None] + np.arange(int((ends - starts).max()))
+    padding = positions >= ends[:, None]
+    values = np.where(padding, np.nan, interior[np.minimum(positions, n - 3)])
+    low = starts + np.nanargmin(values, axis=1)
+    high = starts + np.nanargmax(values, axis=1)
+
+    # Constant buckets: keep a second, distinct point
+    same = low == high
+    high[same] = np.where(low[same] == starts[same], starts[same] + 1, starts[same])
+
+    pairs = np.sort(np.stack((low, high), axis=1), axis=1)
+    kept = pairs.ravel()
+    if picks % 2:
+        # Only room for one point in the last bucket, the farthest from its mean
+        deviation = np.abs(interior[pairs[-1]] - np.nanmean(values[-1]))
+        kept = np.append(kept[:-2], pairs[-1][int(np.argmax(deviation))])
+
+    return np.concatenate(([0], kept + 1, [n - 1]))
+
+DOWNSAMPLING_METHODS = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
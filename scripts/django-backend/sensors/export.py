@@ -0,0 +1,139 @@
+"""
+Streaming export of sensor readings as CSV, NDJSON or Parquet.
+
+Rows are read with values_list over a server-side cursor and encoded chunk
+by chunk, so no model instances are built and memory stays constant
+regardless of the export size. Readings of archived months are merged in
+from the archive files (see archive.py).
+"""
+import csv
+import heapq
+import io
+import json
+from operator import itemgetter
+from django.conf import settings
+from .archive import archived_rows
+from .models import SensorReading
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+COLUMNS = ['sensor_code', 'timestamp', 'water_level', 'temperature',
+           'flow_rate', 'battery_level', 'signal_strength']
+
+READING_FIELDS = ['sensor_id', 'timestamp', 'water_level', 'temperature',
+                  'flow_rate', 'battery_level', 'signal_strength']
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+def parquet_available():
+    return pq is not None
+
+def iter_reading_chunks(sensors, start, end):
+    """Yield lists of export rows (tuples in COLUMNS order)"""
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    sensor_codes = {sensor.pk: sensor.sensor_code for sensor in sensors}
+
+    rows = SensorReading.objects.filter(
+        sensor_id__in=sensor_codes,
+        timestamp__gte=start,
+        timestamp__lt=end
+    ).order_by('sensor_id', 'timestamp').values_list(*READING_FIELDS)
+    rows = heapq.merge(
+        archived_rows(list(sensor_codes), start, end, READING_FIELDS[2:]),
+        rows.iterator(chunk_size=chunk_size),
+        key=itemgetter(0, 1)
+    )
+
+    chunk = []
+    for sensor_id, *values in rows:
+        chunk.append((sensor_codes[sensor_id], *values))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for chunk in chunks:
+        writer.writerows(
+            (code, timestamp.isoformat(), *values) for code, timestamp, *values in chunk
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def stream_ndjson(chunks):
+    for chunk in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, (code, timestamp.isoformat(), *values)))) + '\n'
+            for code, timestamp, *values in chunk
+        )
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands over whatever was written since the last drain"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def stream_parquet(chunks):
+    """Write one Parquet row group per chunk and stream the bytes as they are produced"""
+    schema = pa.schema([
+        ('sensor_code', pa.string()),
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('water_level', pa.float64()),
+        ('temperature', pa.float64()),
+        ('flow_rate', pa.float64()),
+        ('battery_level', pa.float64()),
+        ('signal_strength', pa.int32()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    for chunk in chunks:
+        columns = list(zip(*chunk))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+STREAMERS = {
+    'csv': stream_csv,
+    'ndjson': stream_ndjson,
+    'parquet': stream_parquet,
+}
+
+def stream_readings(sensors, start, end, export_format):
+    """Iterator of encoded export chunks for StreamingHttpResponse"""
+    return STREAMERS[export_format](iter_reading_chunks(sensors, start, end))
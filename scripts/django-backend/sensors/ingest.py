@@ -0,0 +1,137 @@
+"""
+Ingestion pipeline for sensor readings
+"""
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .models import Sensor, SensorReading, SensorLatestState
+from .serializers import SensorReadingBulkRowSerializer
+from .cache import invalidate_reading_caches, invalidate_river_summaries
+from .calibration import MICROSECOND, calibration_index
+from river_monitoring.live import publish_readings
+
+def ingest_readings(rows):
+    """
+    Validate and store a batch of readings.
+
+    Invalid rows are skipped and reported, valid rows are written with bulk
+    inserts inside a single transaction. Returns (readings, errors) where
+    errors is a list of {'index': ..., 'errors': ...} dicts.
+    """
+    row_serializer = SensorReadingBulkRowSerializer()
+    errors = []
+    valid_rows = []
+
+    for index, row in enumerate(rows):
+        try:
+            valid_rows.append((index, row_serializer.run_validation(row)))
+        except ValidationError as e:
+            errors.append({'index': index, 'errors': e.detail})
+
+    # Resolve all referenced sensors with a single query
+    sensors = Sensor.objects.in_bulk({data['sensor'] for _, data in valid_rows})
+
+    readings = []
+    for index, data in valid_rows:
+        sensor = sensors.get(data.pop('sensor'))
+        if sensor is None:
+            errors.append({'index': index, 'errors': {'sensor': ['Sensor not found']}})
+            continue
+        readings.append(SensorReading(sensor=sensor, **data))
+
+    if readings:
+        calibration_index.apply(readings)
+        with transaction.atomic():
+            readings = SensorReading.objects.bulk_create(
+                readings, batch_size=settings.READING_BULK_INSERT_BATCH_SIZE
+            )
+        process_new_readings(readings)
+
+    errors.sort(key=lambda error: error['index'])
+    return readings, errors
+
+def process_new_readings(readings):
+    """Run post-ingest processing for readings that were just stored"""
+    # Evaluate rules in timestamp order so replayed backlogs behave like live data
+    readings = sorted(readings, key=lambda reading: reading.timestamp)
+
+    update_latest_state(readings)
+    invalidate_reading_caches(readings)
+    publish_readings(readings)
+
+    from alerts.consumer import schedule_alert_evaluation
+    schedule_alert_evaluation(readings)
+
+def update_latest_state(readings):
+    """
+    Fold new readings into SensorLatestState with a constant number of
+    queries per batch. Older (backfilled) readings only bump the counters.
+    """
+    newest = {}
+    counts = Counter()
+    for reading in readings:
+        counts[reading.sensor_id] += 1
+        current = newest.get(reading.sensor_id)
+        if current is None or reading.timestamp >= current.timestamp:
+            newest[reading.sensor_id] = reading
+
+    if not newest:
+        return
+
+    with transaction.atomic():
+        # Make sure a row exists for every sensor, then lock and update them
+        SensorLatestState.objects.bulk_create(
+            [SensorLatestState(sensor_id=sensor_id) for sensor_id in newest],
+            ignore_conflicts=True
+        )
+        states = list(
+            SensorLatestState.objects.select_for_update().filter(sensor_id__in=newest)
+        )
+        now = timezone.now()
+        for state in states:
+            reading = newest[state.sensor_id]
+            state.updated_at = now
+            state.reading_count += counts[state.sensor_id]
+            if state.timestamp is None or reading.timestamp >= state.timestamp:
+                state.reading_id = reading.pk
+                for field in SensorLatestState.READING_FIELDS:
+                    setattr(state, field, getattr(reading, field))
+
+        SensorLatestState.objects.bulk_update(
+            states,
+            ['reading', 'reading_count', 'updated_at'] + SensorLatestState.READING_FIELDS
+        )
+
+def rebuild_latest_state(sensors=None):
+    """Recompute SensorLatestState from the readings table"""
+    if sensors is None:
+        sensors = Sensor.objects.all()
+
+    for sensor in sensors:
+        latest = sensor.readings.first()
+        state = SensorLatestState(
+            sensor=sensor,
+            reading=latest,
+            reading_count=sensor.readings.count()
+        )
+        if latest:
+            for field in SensorLatestState.READING_FIELDS:
+                setattr(state, field, getattr(latest, field))
+        state.save()
+
+def readings_changed(sensor, timestamps):
+    """
+    Bring rollups, latest state and cached summaries up to date after stored
+    readings of a sensor at the given timestamps were edited or deleted
+    """
+    from .rollups import rebuild_rollups
+    from alerts.history import sensor_history
+
+    for timestamp in set(timestamps):
+        rebuild_rollups([sensor], timestamp, timestamp + MICROSECOND)
+    rebuild_latest_state([sensor])
+    invalidate_reading_caches([])
+    invalidate_river_summaries([sensor.river_id])
+    sensor_history.invalidate(sensor.pk)
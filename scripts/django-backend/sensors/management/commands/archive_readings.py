@@ -0,0 +1,47 @@
+from datetime import datetime, time, timezone as dt_timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from sensors.archive import (
+    archive_month, month_start, months_to_archive, movable_readings, next_month, retention_cutoff
+)
+
+class Command(BaseCommand):
+    help = 'Compact raw readings older than the retention horizon into rollups and move them to monthly archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive months before this date (YYYY-MM-DD), '
+                                             'defaults to READING_RETENTION_DAYS ago')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            day = parse_date(options['before'])
+            if day is None:
+                raise CommandError('--before must be a date (YYYY-MM-DD)')
+            before = month_start(datetime.combine(day, time.min, tzinfo=dt_timezone.utc))
+        else:
+            before = retention_cutoff()
+
+        months = months_to_archive(before)
+        if not months:
+            self.stdout.write(f"No readings before {before:%Y-%m}")
+            return
+
+        total = 0
+        for month in months:
+            if options['dry_run']:
+                count = movable_readings(month, next_month(month)).count()
+                self.stdout.write(f"{month:%Y-%m}: {count} readings would be archived")
+                continue
+
+            archive = archive_month(month)
+            if archive is None:
+                self.stdout.write(f"{month:%Y-%m}: nothing to archive")
+                continue
+            total += archive.row_count
+            self.stdout.write(
+                f"{month:%Y-%m}: {archive.row_count} readings -> {archive.file.name} ({archive.size_bytes} bytes)"
+            )
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Archived {total} readings"))
@@ -0,0 +1,131 @@
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.utils import timezone
+from sensors.ingest import ingest_readings
+from sensors.models import River, Sensor, SensorReading
+
+class Command(BaseCommand):
+    help = ('Measure concurrent reading ingest and read throughput on the configured database '
+            '(creates temporary BENCH-* sensors and deletes them afterwards)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Concurrent ingesting threads')
+        parser.add_argument('--readers', type=int, default=4, help='Concurrent threads polling latest readings')
+        parser.add_argument('--batches', type=int, default=50, help='Batches posted by each writer')
+        parser.add_argument('--batch-size', type=int, default=50, help='Readings per batch')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark sensors and readings')
+
+    def handle(self, *args, **options):
+        river = River.objects.create(name=f"Benchmark {timezone.now():%Y%m%d%H%M%S}", latitude=0, longitude=0)
+        sensors = [
+            Sensor.objects.create(
+                name=f"Benchmark {index}", sensor_code=f"BENCH-{index}", river=river,
+                latitude=0, longitude=0, installation_date=timezone.localdate(), max_level=10
+            )
+            for index in range(options['writers'])
+        ]
+
+        try:
+            writes, reads, elapsed = self.run(sensors, options)
+        finally:
+            if not options['keep']:
+                river.delete()
+
+        written = sum(len(latencies) for latencies, _ in writes) * options['batch_size']
+        write_latencies = np.array([latency for latencies, _ in writes for latency in latencies])
+        read_latencies = np.array([latency for latencies, _ in reads for latency in latencies])
+        locked = sum(errors for _, errors in writes) + sum(errors for _, errors in reads)
+
+        self.stdout.write(f"Database: {self.describe_database()}")
+        self.stdout.write(f"Writers: {options['writers']} x {options['batches']} batches of {options['batch_size']}, "
+                          f"readers: {options['readers']}, {elapsed:.2f}s")
+        self.stdout.write(f"Writes: {written / elapsed:.0f} readings/s, batch latency "
+                          f"{self.percentiles(write_latencies)}")
+        self.stdout.write(f"Reads: {len(read_latencies) / elapsed:.0f} queries/s, latency "
+                          f"{self.percentiles(read_latencies)}")
+        style = self.style.SUCCESS if not locked else self.style.ERROR
+        self.stdout.write(style(f"Lock errors: {locked}"))
+
+    def run(self, sensors, options):
+        """Returns ([(latencies, errors)] per writer and per reader, elapsed seconds)"""
+        done = threading.Event()
+        writes = [([], 0) for _ in sensors]
+        reads = [([], 0) for _ in range(options['readers'])]
+        start_time = timezone.now() - timedelta(days=1)
+
+        def write(index, sensor):
+            latencies, errors = writes[index]
+            try:
+                for batch in range(options['batches']):
+                    rows = [
+                        {
+                            'sensor': str(sensor.pk),
+                            'water_level': 1 + (batch + row) % 10 / 10,
+                            'temperature': 10.0,
+                            'flow_rate': 2.0,
+                            'battery_level': 90.0,
+                            'signal_strength': -60,
+                            'timestamp': start_time + timedelta(seconds=batch * options['batch_size'] + row),
+                        }
+                        for row in range(options['batch_size'])
+                    ]
+                    began = time.perf_counter()
+                    try:
+                        ingest_readings(rows)
+                    except OperationalError:
+                        errors += 1
+                        continue
+                    latencies.append(time.perf_counter() - began)
+            finally:
+                writes[index] = (latencies, errors)
+                connection.close()
+
+        def read(index):
+            latencies, errors = reads[index]
+            try:
+                while not done.is_set():
+                    began = time.perf_counter()
+                    try:
+                        list(SensorReading.objects.filter(sensor__in=sensors)
+                             .order_by('-timestamp').values_list('id', 'water_level')[:100])
+                    except OperationalError:
+                        errors += 1
+                        continue
+                    latencies.append(time.perf_counter() - began)
+            finally:
+                reads[index] = (latencies, errors)
+                connection.close()
+
+        writers = [threading.Thread(target=write, args=(index, sensor)) for index, sensor in enumerate(sensors)]
+        readers = [threading.Thread(target=read, args=(index,)) for index in range(options['readers'])]
+
+        began = time.perf_counter()
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - began
+        done.set()
+        for thread in readers:
+            thread.join()
+        return writes, reads, elapsed
+
+    def describe_database(self):
+        description = f"{connection.vendor} ({connection.settings_dict['NAME']})"
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                description += f", journal_mode={cursor.fetchone()[0]}"
+        else:
+            description += f", CONN_MAX_AGE={connection.settings_dict['CONN_MAX_AGE']}"
+        return description
+
+    def percentiles(self, latencies):
+        if not len(latencies):
+            return '-'
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        return f"p50 {p50:.1f}ms, p95 {p95:.1f}ms, p99 {p99:.1f}ms"
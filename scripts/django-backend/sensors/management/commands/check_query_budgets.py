@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+from river_monitoring.query_budgets import available_endpoints, measure, percentiles, seed_dataset
+
+class Command(BaseCommand):
+    help = ('Seed realistic data volumes and record the query counts and latency percentiles of every API '
+            'endpoint (runs on a separate test database). Query budgets are enforced by manage.py test.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sensors', type=int, default=40)
+        parser.add_argument('--readings-per-sensor', type=int, default=50000)
+        parser.add_argument('--alerts', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--output', default=str(Path(settings.BASE_DIR) / 'query_budgets.json'),
+                            help='Where to write the measured baseline')
+        parser.add_argument('--compare', help='Baseline JSON to compare p95 latencies against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 latency increase over the baseline (fraction)')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the seeded test database for the next run')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)['endpoints']
+
+        # Lets the test client's 'testserver' host through ALLOWED_HOSTS
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            results, failures = self.run(options, baseline)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as output:
+            json.dump({'scale': {key: options[key] for key in ('sensors', 'readings_per_sensor', 'alerts')},
+                       'endpoints': results}, output, indent=2)
+        self.stdout.write(f"Baseline written to {options['output']}")
+
+        if failures:
+            raise CommandError(f"{len(failures)} endpoint(s) failed or regressed: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} endpoints measured"))
+
+    def run(self, options, baseline):
+        user, _ = get_user_model().objects.get_or_create(
+            username='query-budget', defaults={'is_staff': True, 'is_superuser': True}
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+
+        self.stdout.write(f"Seeding {options['sensors']} sensors x {options['readings_per_sensor']} readings, "
+                          f"{options['alerts']} alerts...")
+        objects = seed_dataset(user, options['sensors'], options['readings_per_sensor'], options['alerts'])
+
+        results = {}
+        failures = []
+        for endpoint in available_endpoints():
+            try:
+                status, queries, latencies = measure(client, endpoint, objects, options['repeat'])
+            except Exception as e:
+                problem = f"{type(e).__name__}: {e}"
+                if endpoint.known_issue:
+                    self.stdout.write(self.style.WARNING(
+                        f"{endpoint.name:<24} KNOWN ISSUE ({endpoint.known_issue}): {problem}"
+                    ))
+                else:
+                    failures.append(endpoint.name)
+                    self.stdout.write(self.style.ERROR(f"{endpoint.name:<24} FAIL: {problem}"))
+                continue
+
+            result = {'status': status, 'queries': queries, 'max_queries': endpoint.max_queries,
+                      **percentiles(latencies)}
+            results[endpoint.name] = result
+
+            problems = []
+            if status >= 400:
+                problems.append(f"status {status}")
+            previous = (baseline or {}).get(endpoint.name)
+            if previous and result['p95_ms'] > previous['p95_ms'] * (1 + options['tolerance']):
+                problems.append(f"p95 {result['p95_ms']}ms vs baseline {previous['p95_ms']}ms")
+
+            line = (f"{endpoint.name:<24} {queries:>3} queries (budget {endpoint.max_queries}) "
+                    f"p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms")
+            if problems and endpoint.known_issue:
+                self.stdout.write(self.style.WARNING(
+                    f"{line}  KNOWN ISSUE ({endpoint.known_issue}): {'; '.join(problems)}"
+                ))
+            elif problems:
+                failures.append(endpoint.name)
+                self.stdout.write(self.style.ERROR(f"{line}  FAIL: {'; '.join(problems)}"))
+            else:
+                self.stdout.write(line)
+        return results, failures
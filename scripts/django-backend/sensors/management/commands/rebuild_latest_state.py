@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from sensors.ingest import rebuild_latest_state
+from sensors.models import Sensor
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-sensor latest reading snapshot from the readings table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sensor_codes', nargs='*', help='Only rebuild these sensors')
+
+    def handle(self, *args, **options):
+        sensors = Sensor.objects.all()
+        if options['sensor_codes']:
+            sensors = sensors.filter(sensor_code__in=options['sensor_codes'])
+
+        rebuild_latest_state(sensors)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt latest state for {sensors.count()} sensors"))
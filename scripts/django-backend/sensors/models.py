@@ -1,6 +1,7 @@
 from django.db import models
-from django.contrib.auth.models import User
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 import uuid
 
 class River(models.Model):
@@ -58,8 +59,11 @@ class Sensor(models.Model):
 
     @property
     def current_reading(self):
-        """Get the most recent sensor reading"""
-        return self.readings.first()
+        """Get the most recent sensor reading (from the maintained latest state)"""
+        state = getattr(self, 'latest_state', None)
+        if state is None or state.timestamp is None:
+            return None
+        return state.as_reading()
 
     @property
     def current_level_percentage(self):
@@ -93,13 +97,15 @@ class SensorReading(models.Model):
         validators=[MinValueValidator(-120), MaxValueValidator(0)],
         help_text="Fuerza de señal en dBm"
     )
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Measured level when a calibration corrected water_level (see sensors/calibration.py)
+    raw_water_level = models.FloatField(null=True, blank=True, help_text="Nivel de agua medido, sin calibrar")
 
     class Meta:
         ordering = ['-timestamp']
         indexes = [
-            models.Index(fields=['sensor', '-timestamp']),
-            models.Index(fields=['-timestamp']),
+            models.Index(fields=['sensor', '-timestamp', '-id']),
+            models.Index(fields=['-timestamp', '-id']),
         ]
 
     def __str__(self):
@@ -112,14 +118,111 @@ class SensorReading(models.Model):
             return min((self.water_level / self.sensor.max_level) * 100, 100)
         return 0
 
+class SensorLatestState(models.Model):
+    """Latest reading of each sensor, denormalized and maintained on ingest"""
+    sensor = models.OneToOneField(Sensor, on_delete=models.CASCADE, primary_key=True, related_name='latest_state')
+    reading = models.ForeignKey(SensorReading, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    water_level = models.FloatField(null=True, blank=True)
+    temperature = models.FloatField(null=True, blank=True)
+    flow_rate = models.FloatField(null=True, blank=True)
+    battery_level = models.FloatField(null=True, blank=True)
+    signal_strength = models.IntegerField(null=True, blank=True)
+    timestamp = models.DateTimeField(null=True, blank=True)
+    reading_count = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    READING_FIELDS = ['water_level', 'temperature', 'flow_rate',
+                      'battery_level', 'signal_strength', 'timestamp']
+
+    def __str__(self):
+        return f"{self.sensor_id} @ {self.timestamp}"
+
+    def as_reading(self):
+        """Build an unsaved SensorReading equivalent to the latest reading"""
+        return SensorReading(
+            id=self.reading_id,
+            sensor=self.sensor,
+            **{field: getattr(self, field) for field in self.READING_FIELDS}
+        )
+
+class SensorReadingRollup(models.Model):
+    """Per-sensor reading aggregates over fixed time buckets"""
+    RESOLUTION_CHOICES = [
+        ('5m', '5 minutos'),
+        ('1h', '1 hora'),
+        ('1d', '1 día'),
+    ]
+
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='rollups')
+    resolution = models.CharField(max_length=3, choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    # count/sum/min/max/sum of squares per metric so buckets merge exactly
+    water_level_sum = models.FloatField(default=0)
+    water_level_min = models.FloatField(null=True, blank=True)
+    water_level_max = models.FloatField(null=True, blank=True)
+    water_level_sum_sq = models.FloatField(default=0)
+    temperature_sum = models.FloatField(default=0)
+    temperature_min = models.FloatField(null=True, blank=True)
+    temperature_max = models.FloatField(null=True, blank=True)
+    temperature_sum_sq = models.FloatField(default=0)
+    flow_rate_sum = models.FloatField(default=0)
+    flow_rate_min = models.FloatField(null=True, blank=True)
+    flow_rate_max = models.FloatField(null=True, blank=True)
+    flow_rate_sum_sq = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['sensor', 'resolution', 'bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['sensor', 'resolution', 'bucket_start'],
+                                    name='unique_sensor_rollup_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.sensor_id} {self.resolution} {self.bucket_start:%Y-%m-%d %H:%M}"
+
+class SensorRollupCheckpoint(models.Model):
+    """Progress of the incremental rollup maintenance (single row)"""
+    last_reading_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Rollups up to reading {self.last_reading_id}"
+
+class ReadingArchive(models.Model):
+    """Raw readings of one month moved out of SensorReading into a columnar file"""
+    FORMAT_CHOICES = [
+        ('parquet', 'Parquet'),
+        ('npz', 'NumPy npz'),
+    ]
+
+    period_start = models.DateTimeField(db_index=True)
+    period_end = models.DateTimeField()
+    file = models.FileField(upload_to='archives/')
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    row_count = models.PositiveBigIntegerField(default=0)
+    size_bytes = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['period_start', 'created_at']
+
+    def __str__(self):
+        return f"{self.period_start:%Y-%m} ({self.row_count} lecturas)"
+
 class SensorCalibration(models.Model):
     """Model for sensor calibration records"""
     sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='calibrations')
-    calibrated_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    calibrated_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     calibration_date = models.DateTimeField(auto_now_add=True)
+    effective_from = models.DateTimeField(
+        default=timezone.now, db_index=True,
+        help_text="Las lecturas desde este instante se corrigen con esta calibración"
+    )
     offset_adjustment = models.FloatField(default=0.0)
     scale_factor = models.FloatField(default=1.0)
     notes = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-calibration_date']
@@ -0,0 +1,388 @@
+"""
+Time-bucketed rollups of sensor readings.
+
+Each SensorReadingRollup row keeps count, sum, min, max and sum of squares
+for every metric, so any set of buckets can be merged into exact statistics.
+5-minute buckets are computed from raw readings, hourly buckets from
+5-minute buckets and daily buckets from hourly ones. Bucket boundaries are
+aligned to UTC.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import reduce
+from itertools import chain
+import operator
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncHour
+from .models import SensorReading, SensorReadingRollup, SensorRollupCheckpoint
+
+METRICS = ['water_level', 'temperature', 'flow_rate']
+
+# Coarsest first, each resolution is built from the next finer one
+RESOLUTIONS = [
+    ('1d', timedelta(days=1)),
+    ('1h', timedelta(hours=1)),
+    ('5m', timedelta(minutes=5)),
+]
+RESOLUTION_STEPS = dict(RESOLUTIONS)
+SOURCE_RESOLUTION = {'1d': '1h', '1h': '5m'}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def floor_bucket(value, step):
+    """Start of the bucket of size step containing value"""
+    return value - (value - EPOCH) % step
+
+def ceil_bucket(value, step):
+    """Smallest bucket boundary >= value"""
+    floor = floor_bucket(value, step)
+    return floor if floor == value else floor + step
+
+class Aggregate:
+    """Mergeable count/sum/min/max/sum of squares for each metric"""
+
+    def __init__(self):
+        self.count = 0
+        self.sums = dict.fromkeys(METRICS, 0.0)
+        self.mins = dict.fromkeys(METRICS)
+        self.maxs = dict.fromkeys(METRICS)
+        self.sums_sq = dict.fromkeys(METRICS, 0.0)
+
+    def add(self, values):
+        """Add one reading given as {metric: value}"""
+        self.count += 1
+        for metric in METRICS:
+            value = values[metric]
+            self.sums[metric] += value
+            self.sums_sq[metric] += value * value
+            if self.mins[metric] is None or value < self.mins[metric]:
+                self.mins[metric] = value
+            if self.maxs[metric] is None or value > self.maxs[metric]:
+                self.maxs[metric] = value
+
+    def merge(self, other):
+        """Fold another aggregate into this one"""
+        if not other.count:
+            return self
+        self.count += other.count
+        for metric in METRICS:
+            self.sums[metric] += other.sums[metric]
+            self.sums_sq[metric] += other.sums_sq[metric]
+            if self.mins[metric] is None or other.mins[metric] < self.mins[metric]:
+                self.mins[metric] = other.mins[metric]
+            if self.maxs[metric] is None or other.maxs[metric] > self.maxs[metric]:
+                self.maxs[metric] = other.maxs[metric]
+        return self
+
+    @classmethod
+    def from_values(cls, values):
+        """Build from a dict with count and <metric>_sum/_min/_max/_sum_sq keys"""
+        aggregate = cls()
+        aggregate.count = values['count'] or 0
+        if aggregate.count:
+            for metric in METRICS:
+                aggregate.sums[metric] = values[f'{metric}_sum']
+                aggregate.mins[metric] = values[f'{metric}_min']
+                aggregate.maxs[metric] = values[f'{metric}_max']
+                aggregate.sums_sq[metric] = values[f'{metric}_sum_sq']
+        return aggregate
+
+    @classmethod
+    def from_rollup(cls, rollup):
+        return cls.from_values(rollup.__dict__)
+
+    def to_fields(self):
+        """Field values for a SensorReadingRollup row"""
+        fields = {'count': self.count}
+        for metric in METRICS:
+            fields[f'{metric}_sum'] = self.sums[metric]
+            fields[f'{metric}_min'] = self.mins[metric]
+            fields[f'{metric}_max'] = self.maxs[metric]
+            fields[f'{metric}_sum_sq'] = self.sums_sq[metric]
+        return fields
+
+    def mean(self, metric):
+        return self.sums[metric] / self.count if self.count else None
+
+    def std(self, metric):
+        """Population standard deviation"""
+        if not self.count:
+            return None
+        mean = self.mean(metric)
+        return max(self.sums_sq[metric] / self.count - mean * mean, 0.0) ** 0.5
+
+def raw_aggregate_expressions():
+    """Aggregate expressions over SensorReading producing Aggregate.from_values keys"""
+    expressions = {'count': Count('id')}
+    for metric in METRICS:
+        expressions[f'{metric}_sum'] = Sum(metric)
+        expressions[f'{metric}_min'] = Min(metric)
+        expressions[f'{metric}_max'] = Max(metric)
+        expressions[f'{metric}_sum_sq'] = Sum(F(metric) * F(metric))
+    return expressions
+
+def rollup_aggregate_expressions():
+    """Aggregate expressions merging SensorReadingRollup rows"""
+    expressions = {'count': Sum('count')}
+    for metric in METRICS:
+        expressions[f'{metric}_sum'] = Sum(f'{metric}_sum')
+        expressions[f'{metric}_min'] = Min(f'{metric}_min')
+        expressions[f'{metric}_max'] = Max(f'{metric}_max')
+        expressions[f'{metric}_sum_sq'] = Sum(f'{metric}_sum_sq')
+    return expressions
+
+def plan_segments(start, end, levels=RESOLUTIONS):
+    """
+    Split [start, end) into aligned bucket ranges, coarsest first.
+    Returns a list of (resolution, segment_start, segment_end), where
+    resolution is None for the unaligned edges that must be read raw.
+    """
+    def split(lo, hi, levels):
+        if lo >= hi:
+            return []
+        if not levels:
+            return [(None, lo, hi)]
+        resolution, step = levels[0]
+        first, last = ceil_bucket(lo, step), floor_bucket(hi, step)
+        if first >= last:
+            return split(lo, hi, levels[1:])
+        return split(lo, first, levels[1:]) + [(resolution, first, last)] + split(last, hi, levels[1:])
+
+    return split(start, end, levels)
+
+def get_checkpoint():
+    checkpoint, _ = SensorRollupCheckpoint.objects.get_or_create(pk=1)
+    return checkpoint
+
+def segment_filters(start, end, levels=RESOLUTIONS):
+    """
+    (rollup_filters, raw_filters) covering [start, end): rollup buckets for
+    the aligned segments, raw readings for the edges and for readings that
+    arrived after the last rollup run
+    """
+    last_rolled_id = get_checkpoint().last_reading_id
+    rollup_filters = []
+    raw_filters = []
+
+    for resolution, segment_start, segment_end in plan_segments(start, end, levels):
+        if resolution is None:
+            raw_filters.append(Q(timestamp__gte=segment_start, timestamp__lt=segment_end))
+        else:
+            rollup_filters.append(Q(resolution=resolution, bucket_start__gte=segment_start,
+                                    bucket_start__lt=segment_end))
+            raw_filters.append(Q(timestamp__gte=segment_start, timestamp__lt=segment_end,
+                                 id__gt=last_rolled_id))
+    return rollup_filters, raw_filters
+
+def sensor_statistics(sensor, start, end):
+    """
+    Exact statistics for a sensor over [start, end), answered from the
+    coarsest rollups that fit and raw readings only at the edges and for
+    readings not yet folded into rollups.
+    """
+    rollup_filters, raw_filters = segment_filters(start, end)
+
+    aggregate = Aggregate()
+    if rollup_filters:
+        aggregate.merge(Aggregate.from_values(
+            sensor.rollups.filter(reduce(operator.or_, rollup_filters))
+            .aggregate(**rollup_aggregate_expressions())
+        ))
+    if raw_filters:
+        aggregate.merge(Aggregate.from_values(
+            sensor.readings.filter(reduce(operator.or_, raw_filters))
+            .aggregate(**raw_aggregate_expressions())
+        ))
+    return aggregate
+
+# Hourly and finer, so that hours can be regrouped into local days
+HOURLY_LEVELS = [level for level in RESOLUTIONS if level[0] != '1d']
+
+def iter_hourly_aggregates(sensor_ids, start, end):
+    """
+    Yield (sensor_id, hour_start, Aggregate) pieces covering [start, end)
+    for several sensors with two queries. A sensor and hour may come in
+    several pieces (5-minute buckets, raw edges), which callers merge.
+    """
+    rollup_filters, raw_filters = segment_filters(start, end, HOURLY_LEVELS)
+    hour = RESOLUTION_STEPS['1h']
+    rollup_fields = [f'{metric}_{part}' for metric in METRICS for part in ('sum', 'min', 'max', 'sum_sq')]
+
+    if rollup_filters:
+        rows = SensorReadingRollup.objects.filter(
+            reduce(operator.or_, rollup_filters), sensor_id__in=sensor_ids
+        ).order_by().values('sensor_id', 'bucket_start', 'count', *rollup_fields)
+        for row in rows.iterator(chunk_size=5000):
+            yield row['sensor_id'], floor_bucket(row['bucket_start'], hour), Aggregate.from_values(row)
+
+    if raw_filters:
+        rows = SensorReading.objects.filter(
+            reduce(operator.or_, raw_filters), sensor_id__in=sensor_ids
+        ).annotate(
+            hour=TruncHour('timestamp', tzinfo=dt_timezone.utc)
+        ).order_by().values('sensor_id', 'hour').annotate(**raw_aggregate_expressions())
+        for row in rows:
+            yield row['sensor_id'], row['hour'], Aggregate.from_values(row)
+
+def save_buckets(resolution, buckets):
+    """Upsert {(sensor_id, bucket_start): Aggregate} for one resolution, dropping empty buckets"""
+    rows = []
+    empty = defaultdict(list)
+    for (sensor_id, bucket_start), aggregate in buckets.items():
+        if aggregate.count:
+            rows.append(SensorReadingRollup(sensor_id=sensor_id, resolution=resolution,
+                                            bucket_start=bucket_start, **aggregate.to_fields()))
+        else:
+            empty[sensor_id].append(bucket_start)
+
+    SensorReadingRollup.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['sensor', 'resolution', 'bucket_start'],
+        update_fields=list(Aggregate().to_fields())
+    )
+    for sensor_id, bucket_starts in empty.items():
+        SensorReadingRollup.objects.filter(
+            sensor_id=sensor_id, resolution=resolution, bucket_start__in=bucket_starts
+        ).delete()
+
+def recompute_raw_buckets(touched, max_reading_id):
+    """
+    Recompute 5-minute buckets {sensor_id: {bucket_start, ...}} from raw
+    readings with id <= max_reading_id (the checkpoint), so readings newer
+    than the checkpoint are never counted twice by sensor_statistics
+    """
+    from .archive import archived_rows, archived_until
+
+    step = RESOLUTION_STEPS['5m']
+    buckets = {}
+    # Raw readings of archived months are read back from the archive files
+    archived_end = archived_until()
+
+    for sensor_id, bucket_starts in touched.items():
+        for bucket_start in bucket_starts:
+            buckets[(sensor_id, bucket_start)] = Aggregate()
+
+        start, end = min(bucket_starts), max(bucket_starts) + step
+        rows = SensorReading.objects.filter(
+            sensor_id=sensor_id,
+            id__lte=max_reading_id,
+            timestamp__gte=start,
+            timestamp__lt=end
+        ).order_by().values_list('timestamp', *METRICS).iterator(chunk_size=10000)
+        if archived_end is not None and start < archived_end:
+            rows = chain(rows, (row[1:] for row in archived_rows([sensor_id], start, end, METRICS)))
+
+        for timestamp, *values in rows:
+            aggregate = buckets.get((sensor_id, floor_bucket(timestamp, step)))
+            if aggregate is not None:
+                aggregate.add(dict(zip(METRICS, values)))
+
+    save_buckets('5m', buckets)
+
+def recompute_derived_buckets(resolution, touched):
+    """Recompute hourly/daily buckets by merging the next finer resolution"""
+    step = RESOLUTION_STEPS[resolution]
+    source = SOURCE_RESOLUTION[resolution]
+    buckets = {}
+
+    for sensor_id, bucket_starts in touched.items():
+        for bucket_start in bucket_starts:
+            buckets[(sensor_id, bucket_start)] = Aggregate()
+
+        rows = SensorReadingRollup.objects.filter(
+            sensor_id=sensor_id,
+            resolution=source,
+            bucket_start__gte=min(bucket_starts),
+            bucket_start__lt=max(bucket_starts) + step
+        )
+        for rollup in rows.iterator(chunk_size=2000):
+            aggregate = buckets.get((sensor_id, floor_bucket(rollup.bucket_start, step)))
+            if aggregate is not None:
+                aggregate.merge(Aggregate.from_rollup(rollup))
+
+    save_buckets(resolution, buckets)
+
+def refresh_buckets(touched, max_reading_id):
+    """Recompute all resolutions for touched 5-minute buckets {sensor_id: {bucket_start}}"""
+    recompute_raw_buckets(touched, max_reading_id)
+    for resolution in ('1h', '1d'):
+        step = RESOLUTION_STEPS[resolution]
+        touched = {
+            sensor_id: {floor_bucket(bucket_start, step) for bucket_start in bucket_starts}
+            for sensor_id, bucket_starts in touched.items()
+        }
+        recompute_derived_buckets(resolution, touched)
+
+def fold_segment(limit, lookback):
+    """
+    Fold up to `limit` readings after the checkpoint (minus the id lookback
+    if requested) in one transaction, so the write lock is only held for a
+    segment. Returns (new readings folded, readings read).
+    """
+    step = RESOLUTION_STEPS['5m']
+
+    with transaction.atomic():
+        checkpoint = SensorRollupCheckpoint.objects.select_for_update().filter(pk=1).first()
+        if checkpoint is None:
+            checkpoint = get_checkpoint()
+
+        since_id = checkpoint.last_reading_id
+        if lookback:
+            since_id = max(since_id - settings.ROLLUP_ID_LOOKBACK, 0)
+        rows = SensorReading.objects.filter(id__gt=since_id).order_by('id').values_list(
+            'id', 'sensor_id', 'timestamp'
+        )[:limit]
+
+        touched = defaultdict(set)
+        last_id = checkpoint.last_reading_id
+        new = read = 0
+        for reading_id, sensor_id, timestamp in rows:
+            touched[sensor_id].add(floor_bucket(timestamp, step))
+            if reading_id > checkpoint.last_reading_id:
+                new += 1
+            last_id = max(last_id, reading_id)
+            read += 1
+
+        if touched:
+            refresh_buckets(touched, last_id)
+
+        checkpoint.last_reading_id = last_id
+        checkpoint.save()
+
+    return new, read
+
+def update_rollups(batch_size=None):
+    """
+    Fold readings stored since the last run into the rollups, committing
+    every ROLLUP_COMMIT_SIZE readings. Returns the number of new readings
+    folded (not counting the re-checked lookback).
+    """
+    batch_size = batch_size or settings.ROLLUP_BATCH_SIZE
+    processed = 0
+    lookback = True
+    while processed < batch_size:
+        limit = min(settings.ROLLUP_COMMIT_SIZE, batch_size - processed)
+        new, read = fold_segment(limit, lookback)
+        processed += new
+        lookback = False
+        if read < limit:
+            break
+    return processed
+
+def rebuild_rollups(sensors, start, end):
+    """Recompute every bucket of the given sensors overlapping [start, end)"""
+    step = RESOLUTION_STEPS['5m']
+    first = floor_bucket(start, step)
+    bucket_starts = set()
+    while first < end:
+        bucket_starts.add(first)
+        first += step
+
+    with transaction.atomic():
+        checkpoint = get_checkpoint()
+        refresh_buckets({sensor.pk: bucket_starts for sensor in sensors},
+                        checkpoint.last_reading_id)
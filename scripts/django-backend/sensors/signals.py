@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .calibration import calibration_index
+from .models import SensorCalibration
+
+@receiver(pre_save, sender=SensorCalibration)
+def remember_calibration_range(sender, instance, **kwargs):
+    """Keep the stored sensor and start so a moved calibration re-corrects its old range too"""
+    instance._previous = (
+        SensorCalibration.objects.filter(pk=instance.pk).values_list('sensor_id', 'effective_from').first()
+        if instance.pk else None
+    )
+
+@receiver(post_save, sender=SensorCalibration)
+@receiver(post_delete, sender=SensorCalibration)
+def recalibrate_affected_readings(sender, instance, **kwargs):
+    """Rebuild the calibration index and re-correct stored readings once the change is committed"""
+    from .tasks import recalibrate_sensor_readings
+
+    ranges = {instance.sensor_id: [instance.effective_from]}
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        sensor_id, effective_from = previous
+        ranges.setdefault(sensor_id, []).append(effective_from)
+
+    def schedule():
+        calibration_index.invalidate()
+        # Wait until the other processes picked up the change, then also
+        # correct what they stored with the old factors meanwhile
+        for sensor_id, moments in ranges.items():
+            recalibrate_sensor_readings.apply_async(
+                (str(sensor_id), min(moments).isoformat(), max(moments).isoformat()),
+                countdown=settings.CALIBRATION_RECALIBRATE_DELAY
+            )
+
+    transaction.on_commit(schedule)
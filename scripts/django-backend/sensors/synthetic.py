@@ -0,0 +1,193 @@
+"""
+Reproducible synthetic sensor readings for demos and capacity tests.
+
+Series are generated with NumPy from a seeded generator, one sensor at a
+time, as whole arrays:
+
+- water level: a base level with a diurnal cycle (snowmelt peaks in the
+  afternoon), rain events shared by the sensors of a river (fast rise,
+  exponential recession, slightly later downstream) and correlated noise;
+- flow rate from the level through a power-law rating curve;
+- temperature with a diurnal cycle, cooler during rain;
+- battery charged by day and drained by night, signal weaker during rain;
+- dropouts: outages of a few minutes to hours plus isolated lost packets.
+
+load_synthetic_readings() applies the sensors' calibrations, stores the
+readings with PostgreSQL COPY when available, else with bulk_create in
+batches, then brings rollups and latest state up to date.
+"""
+import io
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.db import connection, transaction
+from .calibration import build_index, correct_levels
+from .ingest import rebuild_latest_state
+from .models import SensorCalibration, SensorReading
+from .rollups import update_rollups
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+DAY_SECONDS = 24 * 3600
+
+# Rain events per 30 days, their peak rise as a fraction of max_level and
+# recession time constant in hours
+RAIN_EVENTS_PER_MONTH = 3
+RAIN_PEAK_RANGE = (0.1, 0.45)
+RAIN_RECESSION_HOURS = (6, 36)
+
+# Outages per 30 days, and the share of isolated lost readings
+OUTAGES_PER_MONTH = 2
+PACKET_LOSS = 0.005
+
+NOISE_KERNEL = 0.95 ** np.arange(60)
+
+# Rollups are refreshed in batches of this many readings after a load
+ROLLUP_BATCH_SIZE = 1_000_000
+
+COLUMNS = ['water_level', 'temperature', 'flow_rate', 'battery_level', 'signal_strength']
+
+def _local_hours(seconds):
+    """Hour of day (float) in Chile's standard time, good enough for diurnal cycles"""
+    return ((seconds - 4 * 3600) % DAY_SECONDS) / 3600
+
+def rain_events(rng, start, end):
+    """[(start seconds, peak fraction, recession hours)] of the rain events of a river"""
+    span = (end - start).total_seconds()
+    count = rng.poisson(RAIN_EVENTS_PER_MONTH * span / (30 * DAY_SECONDS))
+    begin = (start - EPOCH).total_seconds()
+    return list(zip(
+        begin + rng.uniform(0, span, count),
+        rng.uniform(*RAIN_PEAK_RANGE, count),
+        rng.uniform(*RAIN_RECESSION_HOURS, count),
+    ))
+
+def generate_series(rng, sensor, start, end, interval, events, lag_hours=0.0):
+    """
+    Column arrays (timestamp in seconds since the epoch plus COLUMNS) of
+    one sensor over [start, end) every `interval` seconds, with dropouts
+    already removed
+    """
+    begin = (start - EPOCH).total_seconds()
+    seconds = np.arange(begin, (end - EPOCH).total_seconds(), interval)
+    count = len(seconds)
+    hours = _local_hours(seconds)
+    max_level = sensor.max_level
+
+    # Level: base, diurnal snowmelt cycle peaking around 17:00 and rain events
+    level = max_level * (0.4 + 0.05 * np.sin(2 * np.pi * (hours - 11) / 24))
+    rain = np.zeros(count)
+    for event_start, peak, recession in events:
+        elapsed = (seconds - event_start) / 3600 - lag_hours
+        rising = (elapsed >= 0) & (elapsed < 3)
+        falling = elapsed >= 3
+        rain[rising] += peak * elapsed[rising] / 3
+        rain[falling] += peak * np.exp(-(elapsed[falling] - 3) / recession)
+    level += max_level * rain
+
+    # Correlated noise: white noise through an exponentially decaying (AR(1)-like) filter
+    noise = rng.normal(0, 0.004 * max_level, count)
+    smoothed = np.convolve(noise, NOISE_KERNEL)[:count]
+    level = np.clip(level + smoothed, 0, max_level * 1.05)
+
+    raining = rain > 0.02
+    columns = {
+        'timestamp': seconds,
+        'water_level': level,
+        'flow_rate': 6.0 * np.power(level, 1.6),
+        'temperature': 11 + 4 * np.sin(2 * np.pi * (hours - 9) / 24) - 3 * raining
+                       + rng.normal(0, 0.3, count),
+        'battery_level': np.clip(80 + 12 * np.sin(2 * np.pi * (hours - 8) / 24)
+                                 + rng.normal(0, 1, count), 0, 100),
+        'signal_strength': np.clip(np.rint(rng.normal(-72, 4, count) - 8 * raining), -120, 0).astype(int),
+    }
+
+    # Dropouts: outages (lognormal durations around an hour) and lost packets
+    keep = rng.random(count) >= PACKET_LOSS
+    outages = rng.poisson(OUTAGES_PER_MONTH * (seconds[-1] - begin) / (30 * DAY_SECONDS)) if count else 0
+    for outage_start, duration in zip(rng.uniform(begin, begin + count * interval, outages),
+                                      rng.lognormal(np.log(3600), 1, outages)):
+        keep &= (seconds < outage_start) | (seconds >= outage_start + duration)
+    return {name: values[keep] for name, values in columns.items()}
+
+def _timestamps(seconds):
+    return [EPOCH + timedelta(seconds=value) for value in seconds.tolist()]
+
+def _stored_columns(columns):
+    """COLUMNS plus raw_water_level when a calibration corrected the levels"""
+    return [name for name in (*COLUMNS, 'raw_water_level') if name in columns]
+
+def _bulk_create(sensor, columns, batch_size):
+    names = _stored_columns(columns)
+    values = [columns[name].tolist() for name in names]
+    SensorReading.objects.bulk_create(
+        (
+            SensorReading(sensor=sensor, timestamp=timestamp, **dict(zip(names, row)))
+            for timestamp, *row in zip(_timestamps(columns['timestamp']), *values)
+        ),
+        batch_size=batch_size
+    )
+
+def _copy(sensor, columns, batch_size):
+    """PostgreSQL COPY of the rows in CSV chunks of batch_size"""
+    table = SensorReading._meta.db_table
+    names = _stored_columns(columns)
+    fields = ['sensor_id', 'timestamp', *names]
+    total = len(columns['timestamp'])
+    with connection.cursor() as cursor:
+        for offset in range(0, total, batch_size):
+            window = slice(offset, offset + batch_size)
+            buffer = io.StringIO()
+            rows = zip(
+                _timestamps(columns['timestamp'][window]),
+                *(columns[name][window].tolist() for name in names)
+            )
+            for timestamp, *row in rows:
+                values = ','.join('' if value is None else str(value) for value in row)
+                buffer.write(f"{sensor.pk},{timestamp.isoformat()},{values}\n")
+            sql = f"COPY {table} ({', '.join(fields)}) FROM STDIN WITH (FORMAT csv)"
+            if hasattr(cursor, 'copy_expert'):  # psycopg2
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with cursor.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+def load_synthetic_readings(sensors, start, end, interval=300, seed=0, batch_size=5000, refresh=True):
+    """
+    Generate and store readings for the sensors over [start, end).
+    Returns (readings stored, seconds spent).
+    """
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    sensors = sorted(sensors, key=lambda sensor: (sensor.river_id, sensor.sensor_code))
+    store = _copy if connection.vendor == 'postgresql' else _bulk_create
+    # Levels are stored calibrated, like readings that go through ingest
+    calibrations = build_index(SensorCalibration.objects.filter(sensor__in=sensors))
+
+    river_events = {}
+    river_sensors = {}
+    stored = 0
+    for sensor in sensors:
+        if sensor.river_id not in river_events:
+            river_events[sensor.river_id] = rain_events(rng, start, end)
+        # Sensors further down a river see the same events a little later
+        lag_hours = 0.5 * river_sensors.get(sensor.river_id, 0)
+        river_sensors[sensor.river_id] = river_sensors.get(sensor.river_id, 0) + 1
+
+        columns = generate_series(rng, sensor, start, end, interval, river_events[sensor.river_id], lag_hours)
+        if sensor.pk in calibrations:
+            starts, factors = calibrations[sensor.pk]
+            levels, raw = correct_levels(columns['timestamp'], columns['water_level'],
+                                         [(moment - EPOCH).total_seconds() for moment in starts], factors)
+            columns['water_level'] = levels
+            columns['raw_water_level'] = np.where(np.isnan(raw), None, raw)
+        with transaction.atomic():
+            store(sensor, columns, batch_size)
+        stored += len(columns['timestamp'])
+
+    if refresh:
+        # update_rollups counts new readings only, a batch that is not full means it caught up
+        while update_rollups(batch_size=ROLLUP_BATCH_SIZE) >= ROLLUP_BATCH_SIZE:
+            pass
+        rebuild_latest_state(sensors)
+    return stored, time.perf_counter() - started
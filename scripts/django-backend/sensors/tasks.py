@@ -0,0 +1,25 @@
+from celery import shared_task
+from .rollups import update_rollups
+
+@shared_task
+def update_reading_rollups():
+    """Fold new sensor readings into the 5-minute, hourly and daily rollups"""
+    processed = update_rollups()
+    return f"Rolled up {processed} readings"
+
+@shared_task
+def archive_old_readings():
+    """Compact and archive raw readings older than READING_RETENTION_DAYS"""
+    from .archive import archive_old_readings as archive_readings
+    
+    archives = archive_readings()
+    return f"Archived {sum(archive.row_count for archive in archives)} readings in {len(archives)} files"
+
+@shared_task
+def recalibrate_sensor_readings(sensor_id, start, through):
+    """Re-apply a sensor's calibrations to the stored readings a calibration change affects"""
+    from django.utils.dateparse import parse_datetime
+    from .calibration import recalibrate_readings
+    
+    updated = recalibrate_readings(sensor_id, parse_datetime(start), parse_datetime(through))
+    return f"Recalibrated {updated} readings of sensor {sensor_id}"
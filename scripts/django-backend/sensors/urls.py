@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RiverViewSet, SensorViewSet, SensorReadingViewSet, SensorCalibrationViewSet
+from .views import RiverViewSet, SensorViewSet, SensorReadingViewSet, SensorCalibrationViewSet, LiveStreamView
 
 router = DefaultRouter()
 router.register(r'rivers', RiverViewSet)
@@ -9,5 +9,6 @@ router.register(r'readings', SensorReadingViewSet)
 router.register(r'calibrations', SensorCalibrationViewSet)
 
 urlpatterns = [
+    path('stream/', LiveStreamView.as_view(), name='live-stream'),
     path('', include(router.urls)),
 ]
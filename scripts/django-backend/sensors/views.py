@@ -1,25 +1,193 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import timedelta
-from django.db.models import Avg, Max, Min, Count
-from .models import River, Sensor, SensorReading, SensorCalibration
+from operator import itemgetter
+import heapq
+import numpy as np
+import uuid
+from django.core.cache import cache
+from django.db.models import Avg, Case, Count, F, FloatField, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Least
+from django.db.models.lookups import GreaterThanOrEqual, LessThan
+from river_monitoring.pagination import ReadingCursorPagination
+from river_monitoring.live import EventStreamRenderer, open_stream
+from .models import River, Sensor, SensorReading, SensorCalibration, SensorLatestState
 from .serializers import (
     RiverSerializer, SensorSerializer, SensorReadingSerializer,
-    SensorCalibrationSerializer, SensorReadingCreateSerializer
+    SensorCalibrationSerializer, SensorReadingCreateSerializer,
+    SensorReadingBulkSerializer
 )
+from .ingest import ingest_readings, readings_changed
+from .cache import DASHBOARD_SUMMARY_CACHE_KEY, river_summary_cache_key
+from .rollups import sensor_statistics
+from .downsampling import DOWNSAMPLING_METHODS
+from .export import EXPORT_FORMATS, parquet_available, stream_readings
+from .archive import archived_rows
+
+SERIES_METRICS = ['water_level', 'temperature', 'flow_rate', 'battery_level', 'signal_strength']
+
+def parse_time_range(query_params, default_span):
+    """
+    Parse the start/end query parameters (ISO 8601). end defaults to now and
+    start to end - default_span. Raises ValueError if the range is invalid.
+    """
+    end = query_params.get('end')
+    start = query_params.get('start')
+    
+    end = parse_datetime(end) if end else timezone.now()
+    if end is None:
+        raise ValueError('Invalid end')
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    
+    start = parse_datetime(start) if start else end - default_span
+    if start is None:
+        raise ValueError('Invalid start')
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    
+    if start >= end:
+        raise ValueError('Invalid time range')
+    return start, end
+
+def level_percentage_expression(prefix=''):
+    """Current level percentage from the latest state, same rules as Sensor.current_level_percentage"""
+    return Coalesce(
+        Case(
+            When(
+                **{f'{prefix}max_level__gt': 0},
+                then=Least(
+                    F(f'{prefix}latest_state__water_level') * 100.0 / F(f'{prefix}max_level'), Value(100.0)
+                )
+            ),
+            output_field=FloatField()
+        ),
+        Value(0.0)
+    )
+
+def level_status(level_percentage, warning_threshold, critical_threshold):
+    """Same rules as Sensor.alert_status"""
+    if level_percentage >= critical_threshold:
+        return 'critical'
+    if level_percentage >= warning_threshold:
+        return 'warning'
+    return 'normal'
 
 class RiverViewSet(viewsets.ModelViewSet):
-    queryset = River.objects.all()
+    # Active sensors counted in the same query, read by RiverSerializer
+    queryset = River.objects.annotate(
+        active_sensor_count=Count('sensors', filter=Q(sensors__status='active'))
+    ).order_by('name')
     serializer_class = RiverSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['name']
     search_fields = ['name', 'description']
 
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Level, flow and alert state of every river and its sensors, for the map"""
+        river_ids = list(self.filter_queryset(self.get_queryset()).values_list('pk', flat=True))
+        keys = {river_id: river_summary_cache_key(river_id) for river_id in river_ids}
+        cached = cache.get_many(keys.values())
+        
+        missing = [river_id for river_id in river_ids if keys[river_id] not in cached]
+        if missing:
+            computed = self.compute_river_summaries(missing)
+            cache.set_many(
+                {keys[river_id]: summary for river_id, summary in computed.items()},
+                settings.RIVER_SUMMARY_CACHE_TTL
+            )
+            cached.update((keys[river_id], summary) for river_id, summary in computed.items())
+        
+        return Response([cached[keys[river_id]] for river_id in river_ids if keys[river_id] in cached])
+
+    def compute_river_summaries(self, river_ids):
+        """Compute {river_id: summary} in a constant number of queries"""
+        from alerts.models import Alert
+        
+        level = level_percentage_expression('sensors__')
+        rivers = River.objects.filter(pk__in=river_ids).annotate(
+            sensor_count=Count('sensors'),
+            active_sensors=Count('sensors', filter=Q(sensors__status='active')),
+            critical_count=Count('sensors', filter=GreaterThanOrEqual(level, F('sensors__critical_threshold'))),
+            warning_count=Count('sensors', filter=GreaterThanOrEqual(level, F('sensors__warning_threshold'))
+                                & LessThan(level, F('sensors__critical_threshold'))),
+            max_level_percentage=Max(level),
+            mean_level_percentage=Avg(level),
+            total_flow=Sum('sensors__latest_state__flow_rate'),
+            last_reading=Max('sensors__latest_state__timestamp'),
+        )
+        
+        # Count and worst severity of the active alerts per river
+        severities = [severity for severity, _ in Alert.SEVERITY_CHOICES]
+        active_alerts = {
+            river_id: (count, severities[worst])
+            for river_id, count, worst in Alert.objects.filter(status='active', sensor__river_id__in=river_ids)
+            .values('sensor__river').annotate(
+                count=Count('id'),
+                worst=Max(Case(*(When(severity=severity, then=Value(rank))
+                                 for rank, severity in enumerate(severities)))),
+            ).order_by().values_list('sensor__river', 'count', 'worst')
+        }
+        
+        sensors = {}
+        rows = Sensor.objects.filter(river_id__in=river_ids).annotate(
+            level_percentage=level_percentage_expression(),
+            temperature=F('latest_state__temperature'),
+            flow_rate=F('latest_state__flow_rate'),
+            timestamp=F('latest_state__timestamp'),
+        ).values(
+            'id', 'river_id', 'name', 'sensor_code', 'latitude', 'longitude', 'status',
+            'warning_threshold', 'critical_threshold', 'level_percentage', 'temperature', 'flow_rate', 'timestamp'
+        ).order_by('name')
+        for row in rows:
+            warning_threshold = row.pop('warning_threshold')
+            critical_threshold = row.pop('critical_threshold')
+            row['level_status'] = level_status(row['level_percentage'], warning_threshold, critical_threshold)
+            row['level_percentage'] = round(row['level_percentage'], 1)
+            sensors.setdefault(row.pop('river_id'), []).append(row)
+        
+        summaries = {}
+        for river in rivers:
+            if river.critical_count:
+                river_level_status = 'critical'
+            elif river.warning_count:
+                river_level_status = 'warning'
+            else:
+                river_level_status = 'normal'
+            alert_count, alert_status = active_alerts.get(river.pk, (0, 'normal'))
+            summaries[river.pk] = {
+                'id': river.pk,
+                'name': river.name,
+                'latitude': river.latitude,
+                'longitude': river.longitude,
+                'sensor_count': river.sensor_count,
+                'active_sensors': river.active_sensors,
+                'critical_count': river.critical_count,
+                'warning_count': river.warning_count,
+                'normal_count': river.sensor_count - river.critical_count - river.warning_count,
+                'level_status': river_level_status,
+                # Worst severity of the active alerts, 'normal' without any
+                'alert_status': alert_status,
+                'active_alerts': alert_count,
+                'max_level_percentage': round(river.max_level_percentage, 1) if river.sensor_count else None,
+                'mean_level_percentage': round(river.mean_level_percentage, 1) if river.sensor_count else None,
+                'total_flow': round(river.total_flow or 0, 2),
+                'last_reading': river.last_reading,
+                'sensors': sensors.get(river.pk, []),
+            }
+        return summaries
+
 class SensorViewSet(viewsets.ModelViewSet):
-    queryset = Sensor.objects.select_related('river').prefetch_related('readings')
+    queryset = Sensor.objects.select_related('river', 'latest_state')
     serializer_class = SensorSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'river', 'river__name']
@@ -47,6 +215,54 @@ class SensorViewSet(viewsets.ModelViewSet):
         serializer = SensorReadingSerializer(readings, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def series(self, request, pk=None):
+        """Get a downsampled time series of one metric for charts"""
+        sensor = self.get_object()
+        
+        metric = request.query_params.get('metric', 'water_level')
+        method = request.query_params.get('method', 'lttb')
+        
+        try:
+            points = int(request.query_params.get('points', 500))
+            start, end = parse_time_range(request.query_params, timedelta(hours=24))
+        except ValueError:
+            return Response({'error': 'Invalid parameters'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if metric not in SERIES_METRICS or method not in DOWNSAMPLING_METHODS:
+            return Response({'error': 'Invalid metric or method'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 3 <= points <= settings.SERIES_MAX_POINTS:
+            return Response(
+                {'error': f'points must be between 3 and {settings.SERIES_MAX_POINTS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        rows = list(heapq.merge(
+            ((timestamp, value) for _, timestamp, value in archived_rows([sensor.pk], start, end, [metric])),
+            sensor.readings.filter(timestamp__gte=start, timestamp__lt=end)
+            .order_by('timestamp')
+            .values_list('timestamp', metric)
+            .iterator(chunk_size=10000),
+            key=itemgetter(0)
+        ))
+        
+        x = np.fromiter((timestamp.timestamp() for timestamp, _ in rows), dtype=float, count=len(rows))
+        y = np.fromiter((value for _, value in rows), dtype=float, count=len(rows))
+        indices = DOWNSAMPLING_METHODS[method](x, y, points)
+        
+        return Response({
+            'sensor': sensor.id,
+            'metric': metric,
+            'method': method,
+            'start': start,
+            'end': end,
+            'raw_count': len(rows),
+            'points': [
+                {'timestamp': rows[index][0], 'value': rows[index][1]}
+                for index in indices.tolist()
+            ],
+        })
+
     @action(detail=True, methods=['get'])
     def statistics(self, request, pk=None):
         """Get statistics for a specific sensor"""
@@ -60,21 +276,22 @@ class SensorViewSet(viewsets.ModelViewSet):
         except ValueError:
             return Response({'error': 'Invalid days parameter'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Calculate statistics
-        since = timezone.now() - timedelta(days=days)
-        readings = sensor.readings.filter(timestamp__gte=since)
+        # Calculate statistics from rollups, reading raw rows only at the edges
+        now = timezone.now()
+        aggregate = sensor_statistics(sensor, now - timedelta(days=days), now)
         
-        if not readings.exists():
+        if not aggregate.count:
             return Response({'message': 'No data available for the specified period'})
         
-        stats = readings.aggregate(
-            avg_level=Avg('water_level'),
-            max_level=Max('water_level'),
-            min_level=Min('water_level'),
-            avg_temperature=Avg('temperature'),
-            avg_flow_rate=Avg('flow_rate'),
-            reading_count=Count('id')
-        )
+        stats = {
+            'avg_level': aggregate.mean('water_level'),
+            'max_level': aggregate.maxs['water_level'],
+            'min_level': aggregate.mins['water_level'],
+            'std_level': aggregate.std('water_level'),
+            'avg_temperature': aggregate.mean('temperature'),
+            'avg_flow_rate': aggregate.mean('flow_rate'),
+            'reading_count': aggregate.count,
+        }
         
         # Calculate level percentages
         if sensor.max_level > 0:
@@ -87,71 +304,149 @@ class SensorViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def dashboard_summary(self, request):
         """Get summary data for dashboard"""
-        sensors = self.get_queryset()
-        
-        total_sensors = sensors.count()
-        active_sensors = sensors.filter(status='active').count()
-        
-        # Get sensors with current alert status
-        critical_sensors = []
-        warning_sensors = []
-        normal_sensors = []
-        
-        for sensor in sensors:
-            alert_status = sensor.alert_status
-            if alert_status == 'critical':
-                critical_sensors.append(sensor.id)
-            elif alert_status == 'warning':
-                warning_sensors.append(sensor.id)
-            else:
-                normal_sensors.append(sensor.id)
+        summary = cache.get(DASHBOARD_SUMMARY_CACHE_KEY)
+        if summary is None:
+            summary = self.compute_dashboard_summary()
+            cache.set(DASHBOARD_SUMMARY_CACHE_KEY, summary, settings.DASHBOARD_SUMMARY_CACHE_TTL)
+        
+        return Response(summary)
+
+    def compute_dashboard_summary(self):
+        """Compute the dashboard summary in a constant number of queries"""
+        sensors = self.get_queryset().annotate(level_percentage=level_percentage_expression())
         
-        # Calculate average level
-        recent_readings = SensorReading.objects.filter(
-            sensor__in=sensors,
-            timestamp__gte=timezone.now() - timedelta(hours=1)
+        counts = sensors.aggregate(
+            total_sensors=Count('id'),
+            active_sensors=Count('id', filter=Q(status='active')),
+            critical_count=Count('id', filter=Q(level_percentage__gte=F('critical_threshold'))),
+            warning_count=Count('id', filter=Q(
+                level_percentage__gte=F('warning_threshold'),
+                level_percentage__lt=F('critical_threshold')
+            )),
         )
         
-        avg_level = 0
-        if recent_readings.exists():
-            total_level = sum([
-                (reading.water_level / reading.sensor.max_level) * 100 
-                for reading in recent_readings 
-                if reading.sensor.max_level > 0
-            ])
-            avg_level = total_level / recent_readings.count() if recent_readings.count() > 0 else 0
+        # Calculate average level over the last hour in the database
+        avg_level = SensorReading.objects.filter(
+            timestamp__gte=timezone.now() - timedelta(hours=1),
+            sensor__max_level__gt=0
+        ).aggregate(
+            avg_level=Avg(F('water_level') * 100.0 / F('sensor__max_level'))
+        )['avg_level'] or 0
         
-        return Response({
+        total_sensors = counts['total_sensors']
+        active_sensors = counts['active_sensors']
+        
+        return {
             'total_sensors': total_sensors,
             'active_sensors': active_sensors,
-            'critical_count': len(critical_sensors),
-            'warning_count': len(warning_sensors),
-            'normal_count': len(normal_sensors),
+            'critical_count': counts['critical_count'],
+            'warning_count': counts['warning_count'],
+            'normal_count': total_sensors - counts['critical_count'] - counts['warning_count'],
             'average_level_percentage': round(avg_level, 1),
             'system_status': 'operational' if active_sensors == total_sensors else 'degraded'
-        })
+        }
 
 class SensorReadingViewSet(viewsets.ModelViewSet):
     queryset = SensorReading.objects.select_related('sensor')
+    pagination_class = ReadingCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['sensor', 'sensor__river']
-    ordering = ['-timestamp']
+    ordering = ['-timestamp', '-id']
 
     def get_serializer_class(self):
         if self.action == 'create':
             return SensorReadingCreateSerializer
+        if self.action == 'bulk':
+            return SensorReadingBulkSerializer
         return SensorReadingSerializer
 
+    def perform_update(self, serializer):
+        previous = serializer.instance.timestamp
+        reading = serializer.save()
+        readings_changed(reading.sensor, [previous, reading.timestamp])
+
+    def perform_destroy(self, instance):
+        sensor, timestamp = instance.sensor, instance.timestamp
+        instance.delete()
+        readings_changed(sensor, [timestamp])
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Ingest a batch of readings (e.g. replayed by a field gateway)"""
+        data = request.data
+        if isinstance(data, list):
+            data = {'readings': data}
+        
+        serializer = self.get_serializer(data=data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        readings, errors = ingest_readings(serializer.validated_data['readings'])
+        
+        return Response(
+            {
+                'created': len(readings),
+                'failed': len(errors),
+                'errors': errors,
+            },
+            status=status.HTTP_201_CREATED if readings else status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream readings of one or more sensors as CSV, NDJSON or Parquet"""
+        export_format = request.query_params.get('file_format', 'csv')
+        river = request.query_params.get('river')
+        
+        try:
+            sensor_ids = [
+                uuid.UUID(value)
+                for value in request.query_params.get('sensors', '').split(',') if value
+            ]
+            start, end = parse_time_range(request.query_params, timedelta(days=1))
+            river = int(river) if river else None
+        except ValueError:
+            return Response({'error': 'Invalid parameters'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"file_format must be one of {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if export_format == 'parquet' and not parquet_available():
+            return Response(
+                {'error': 'Parquet export requires pyarrow to be installed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        sensors = Sensor.objects.none()
+        if sensor_ids:
+            sensors |= Sensor.objects.filter(pk__in=sensor_ids)
+        if river:
+            sensors |= Sensor.objects.filter(river_id=river)
+        sensors = list(sensors.only('id', 'sensor_code'))
+        if not sensors:
+            return Response({'error': 'No sensors selected'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        content_type, extension = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            stream_readings(sensors, start, end, export_format),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="readings_{start:%Y%m%d}_{end:%Y%m%d}.{extension}"'
+        )
+        return response
+
     @action(detail=False, methods=['get'])
     def latest(self, request):
         """Get latest readings from all sensors"""
-        latest_readings = []
-        sensors = Sensor.objects.filter(status='active')
+        states = SensorLatestState.objects.filter(
+            sensor__status='active',
+            timestamp__isnull=False
+        ).select_related('sensor').order_by('sensor__name')
         
-        for sensor in sensors:
-            latest_reading = sensor.readings.first()
-            if latest_reading:
-                latest_readings.append(latest_reading)
+        latest_readings = [state.as_reading() for state in states]
         
         serializer = SensorReadingSerializer(latest_readings, many=True)
         return Response(serializer.data)
@@ -162,3 +457,28 @@ class SensorCalibrationViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['sensor']
     ordering = ['-calibration_date']
+
+class LiveStreamView(APIView):
+    """
+    Server-Sent Events stream of new readings and alert changes.
+    Optional filters: ?rivers=1,2&sensors=<uuid>,<uuid>
+    """
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+    def get(self, request):
+        rivers = [value for value in request.query_params.get('rivers', '').split(',') if value]
+        sensors = [value for value in request.query_params.get('sensors', '').split(',') if value]
+        
+        stream = open_stream(rivers=rivers, sensors=sensors)
+        if stream is None:
+            response = Response(
+                {'error': 'Too many live streams open, retry later'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = settings.LIVE_RETRY_MILLISECONDS // 1000
+            return response
+        
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
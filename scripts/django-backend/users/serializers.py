@@ -1,10 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import UserSession
+from river_monitoring.metrics import TimedSerializerMixin
 
 User = get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     full_name = serializers.CharField(source='get_full_name', read_only=True)
 
     class Meta:
@@ -14,7 +15,7 @@ class UserSerializer(serializers.ModelSerializer):
                  'is_emergency_contact', 'is_active', 'date_joined']
         read_only_fields = ['id', 'date_joined']
 
-class UserCreateSerializer(serializers.ModelSerializer):
+class UserCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=8)
     password_confirm = serializers.CharField(write_only=True)
 
@@ -37,7 +38,7 @@ class UserCreateSerializer(serializers.ModelSerializer):
         user.save()
         return user
 
-class UserSessionSerializer(serializers.ModelSerializer):
+class UserSessionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.get_full_name', read_only=True)
 
     class Meta:
@@ -0,0 +1,235 @@
+"""
+Load driver for the river monitoring API.
+
+Replays device POSTs (bulk readings) and dashboard polling against a
+running server at fixed rates and reports throughput, latency percentiles
+and errors. Requests are scheduled open-loop: latency is measured from the
+time a request was due, so a saturated server shows up as growing latency
+instead of a silently lower request rate.
+
+With --ramp the ingest rate is raised by --ramp step every --step-seconds
+until the p95 latency exceeds --p95-limit or more than 1% of the requests
+fail, which gives the ingest ceiling.
+
+    python scripts/load_driver.py --ingest-rate 20 --batch-size 10 --poll-rate 5 --duration 60
+    python scripts/load_driver.py --ingest-rate 10 --ramp 10 --step-seconds 30
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+import numpy as np
+import requests
+
+POLL_PATHS = [
+    '/api/sensors/sensors/dashboard_summary/',
+    '/api/sensors/readings/latest/',
+    '/api/alerts/alerts/active/',
+]
+
+class Client:
+    """JWT-authenticated client with one pooled session per thread"""
+
+    def __init__(self, base_url, username, password, pool_size):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._token_lock = threading.Lock()
+        self.token = None
+        self.login()
+
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def login(self):
+        response = requests.post(f"{self.base_url}/api/auth/login/",
+                                 json={'username': self.username, 'password': self.password}, timeout=10)
+        response.raise_for_status()
+        with self._token_lock:
+            self.token = response.json()['access']
+
+    def request(self, method, path, **kwargs):
+        for attempt in range(2):
+            response = self.session().request(
+                method, f"{self.base_url}{path}",
+                headers={'Authorization': f"Bearer {self.token}"}, timeout=30, **kwargs
+            )
+            if response.status_code != 401 or attempt:
+                return response
+            self.login()
+
+    def sensor_ids(self):
+        ids = []
+        path = '/api/sensors/sensors/'
+        while path:
+            data = self.request('GET', path).json()
+            ids += [sensor['id'] for sensor in data['results']]
+            path = data['next'] and data['next'].replace(self.base_url, '')
+        return ids
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latencies = {}
+            self.errors = {}
+
+    def record(self, kind, latency, ok):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(latency)
+            if not ok:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            lines = []
+            for kind, latencies in sorted(self.latencies.items()):
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+                errors = self.errors.get(kind, 0)
+                lines.append(f"  {kind:<8} {len(latencies) / elapsed:7.1f} req/s  p50 {p50:7.1f}ms  "
+                             f"p95 {p95:7.1f}ms  p99 {p99:7.1f}ms  errors {errors} "
+                             f"({100 * errors / len(latencies):.1f}%)")
+            return lines
+
+    def ingest_p95_and_error_rate(self):
+        with self._lock:
+            latencies = self.latencies.get('ingest', [])
+            if not latencies:
+                return 0.0, 0.0
+            return float(np.percentile(latencies, 95)), self.errors.get('ingest', 0) / len(latencies)
+
+def reading_batch(rng, sensor_ids, size):
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        {
+            'sensor': rng.choice(sensor_ids),
+            'water_level': round(rng.uniform(0.5, 3.5), 3),
+            'temperature': round(rng.uniform(6, 16), 2),
+            'flow_rate': round(rng.uniform(2, 40), 2),
+            'battery_level': round(rng.uniform(60, 100), 1),
+            'signal_strength': rng.randint(-95, -50),
+            'timestamp': now,
+        }
+        for _ in range(size)
+    ]
+
+def ingest(client, stats, rng, sensor_ids, batch_size, due):
+    try:
+        response = client.request('POST', '/api/sensors/readings/bulk/',
+                                  json={'readings': reading_batch(rng, sensor_ids, batch_size)})
+        ok = response.status_code == 201
+    except requests.RequestException:
+        ok = False
+    stats.record('ingest', time.perf_counter() - due, ok)
+
+def poll(client, stats, path, due):
+    try:
+        ok = client.request('GET', path).status_code == 200
+    except requests.RequestException:
+        ok = False
+    stats.record('poll', time.perf_counter() - due, ok)
+
+def run_phase(executor, client, stats, sensor_ids, rng, ingest_rate, poll_rate, batch_size, duration):
+    """
+    Schedule requests at the given rates for `duration` seconds and wait for
+    them to finish, returns the seconds spent scheduling
+    """
+    started = time.perf_counter()
+    schedules = []
+    if ingest_rate > 0:
+        schedules.append(['ingest', 1 / ingest_rate, started])
+    if poll_rate > 0:
+        schedules.append(['poll', 1 / poll_rate, started])
+    polls = 0
+    futures = []
+
+    while schedules:
+        schedule = min(schedules, key=lambda item: item[2])
+        kind, period, due = schedule
+        if due - started >= duration:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if kind == 'ingest':
+            futures.append(executor.submit(
+                ingest, client, stats, random.Random(rng.random()), sensor_ids, batch_size, due
+            ))
+        else:
+            futures.append(executor.submit(poll, client, stats, POLL_PATHS[polls % len(POLL_PATHS)], due))
+            polls += 1
+        schedule[2] = due + period
+    elapsed = time.perf_counter() - started
+    wait(futures)
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--ingest-rate', type=float, default=10, help='Device POSTs per second')
+    parser.add_argument('--batch-size', type=int, default=10, help='Readings per POST')
+    parser.add_argument('--poll-rate', type=float, default=2, help='Dashboard GETs per second')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds (per step with --ramp)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Requests in flight at most')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ramp', type=float, default=0, help='Ingest rate increase per step')
+    parser.add_argument('--step-seconds', type=float, default=30)
+    parser.add_argument('--max-rate', type=float, default=1000)
+    parser.add_argument('--p95-limit', type=float, default=1.0, help='Seconds, ramp stops beyond this')
+    options = parser.parse_args()
+
+    rng = random.Random(options.seed)
+    client = Client(options.base_url, options.username, options.password, options.concurrency)
+    sensor_ids = client.sensor_ids()
+    if not sensor_ids:
+        parser.error('The server has no sensors, load some with setup_database.py first')
+    print(f"{len(sensor_ids)} sensors, {options.batch_size} readings per POST")
+
+    stats = Stats()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+        if not options.ramp:
+            elapsed = run_phase(executor, client, stats, sensor_ids, rng, options.ingest_rate,
+                                options.poll_rate, options.batch_size, options.duration)
+            print(f"{options.ingest_rate:g} POST/s ({options.ingest_rate * options.batch_size:g} readings/s), "
+                  f"{options.poll_rate:g} polls/s for {elapsed:.0f}s")
+            print('\n'.join(stats.summary(elapsed)))
+            return
+
+        rate = options.ingest_rate
+        ceiling = None
+        while rate <= options.max_rate:
+            stats.reset()
+            elapsed = run_phase(executor, client, stats, sensor_ids, rng, rate, options.poll_rate,
+                                options.batch_size, options.step_seconds)
+            p95, error_rate = stats.ingest_p95_and_error_rate()
+            print(f"{rate:g} POST/s ({rate * options.batch_size:g} readings/s)")
+            print('\n'.join(stats.summary(elapsed)))
+            if p95 > options.p95_limit or error_rate > 0.01:
+                break
+            ceiling = rate
+            rate += options.ramp
+
+    if ceiling is None:
+        print(f"Ingest ceiling below {options.ingest_rate:g} POST/s")
+    else:
+        print(f"Ingest ceiling: {ceiling:g} POST/s ({ceiling * options.batch_size:g} readings/s) "
+              f"with p95 <= {options.p95_limit:g}s")
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ django.setup()
 from django.contrib.auth import get_user_model
 from sensors.models import River, Sensor, SensorReading
 from alerts.models import Alert
+from sensors.synthetic import load_synthetic_readings
 
 User = get_user_model()
 
@@ -119,33 +120,13 @@ def create_initial_data():
         if created:
             print(f"Created sensor: {sensor.name}")
     
-    # Create sample sensor readings
+    # Create sample sensor readings: 7 days every 5 minutes, reproducible
     print("Creating sample sensor readings...")
     sensors = Sensor.objects.all()
-    
-    for sensor in sensors:
-        # Create readings for the last 7 days
-        for i in range(168):  # 168 hours = 7 days
-            timestamp = timezone.now() - timedelta(hours=i)
-            
-            # Simulate realistic water levels with some variation
-            base_level = sensor.max_level * 0.6  # 60% of max level
-            variation = (i % 24) * 0.1  # Daily variation
-            noise = (hash(str(timestamp)) % 100) / 1000  # Random noise
-            
-            water_level = max(0, base_level + variation + noise)
-            temperature = 10 + (i % 24) * 0.5 + noise * 10  # Temperature variation
-            flow_rate = water_level * 8 + noise * 20  # Flow rate based on level
-            
-            SensorReading.objects.create(
-                sensor=sensor,
-                water_level=water_level,
-                temperature=temperature,
-                flow_rate=flow_rate,
-                battery_level=95 - (i * 0.01),  # Slowly decreasing battery
-                signal_strength=-45 - (i % 10),  # Signal strength variation
-                timestamp=timestamp
-            )
+    if not SensorReading.objects.filter(sensor__in=sensors).exists():
+        end = timezone.now().replace(second=0, microsecond=0)
+        stored, seconds = load_synthetic_readings(sensors, end - timedelta(days=7), end, interval=300)
+        print(f"Created {stored} readings in {seconds:.1f}s")
     
     print("Initial data creation completed!")
 